@@ -3,6 +3,8 @@ import awkward as ak
 from pocket_coffea.lib.cut_definition import Cut
 from copy import copy
 
+from mutag_calib.lib.fields import with_fields
+
 def tagger_mask(events, params, **kwargs):
     mask = np.zeros(len(events), dtype='bool')
     for tagger in params["taggers"]:
@@ -188,17 +190,15 @@ def mregbin(events, params, **kwargs):
     # Define the regressed mass (use GloParT if available (NanoAOD15, else use ParticleNet)
     if "globalParT3_massCorrX2p" in events.FatJetGood.fields:
         # NanoAODv15
-        events["FatJetGood"] = ak.with_field(
+        events["FatJetGood"] = with_fields(
             events.FatJetGood,
-            (events.FatJetGood.globalParT3_massCorrX2p * events.FatJetGood.mass * (1 - events.FatJetGood.rawFactor)),
-            "mass_reg",
+            {"mass_reg" : (events.FatJetGood.globalParT3_massCorrX2p * events.FatJetGood.mass * (1 - events.FatJetGood.rawFactor))},
         )
     elif "particleNet_massCorr" in events.FatJetGood.fields:
         # NanoAODv12
-        events["FatJetGood"] = ak.with_field(
+        events["FatJetGood"] = with_fields(
             events.FatJetGood,
-            (events.FatJetGood.particleNet_massCorr * events.FatJetGood.mass),
-            "mass_reg",
+            {"mass_reg" : (events.FatJetGood.particleNet_massCorr * events.FatJetGood.mass)},
         )
     else:
         raise ValueError("Could not find the mass regression factor in file for GloParT or PNet")
@@ -1,23 +1,40 @@
-import copy
 import importlib
 import gzip
+import threading
+import zlib
 import cloudpickle
 
 import awkward as ak
 import numpy as np
-import correctionlib
 
 from pocket_coffea.parameters.object_preselection import object_preselection
 from pocket_coffea.parameters.jec_config import JECjsonFiles
-
-# Initialization of the jet factory
-with importlib.resources.path("pocket_coffea.parameters.jec", "jets_evaluator.pkl.gz") as path:
-    with gzip.open(path) as fin:
-        jmestuff = cloudpickle.load(fin)
-
-jet_factory = jmestuff["jet_factory"]
-fatjet_factory = jmestuff["fatjet_factory"]
-met_factory = jmestuff["met_factory"]
+from mutag_calib.lib.corrections import get_correction_set
+from mutag_calib.lib.fields import with_fields
+from mutag_calib.lib.rng import counter_normal
+
+# The jet factories are loaded from the JME evaluator pickle at the first use in the process, and not at import:
+# the configs calibrating the jets with correctionlib never use them
+_jmestuff = None
+_jmestuff_lock = threading.Lock()
+
+def get_jme_factories():
+    '''Returns the dictionary with the jet_factory, fatjet_factory and met_factory of the JME evaluator pickle.
+    The pickle is loaded only at the first call in the process, by a single thread.'''
+    global _jmestuff
+    if _jmestuff is None:
+        with _jmestuff_lock:
+            if _jmestuff is None:
+                with importlib.resources.path("pocket_coffea.parameters.jec", "jets_evaluator.pkl.gz") as path:
+                    with gzip.open(path) as fin:
+                        _jmestuff = cloudpickle.load(fin)
+    return _jmestuff
+
+def __getattr__(name):
+    # The factories are still available as attributes of the module, loaded at the first access
+    if name in ["jet_factory", "fatjet_factory", "met_factory"]:
+        return get_jme_factories()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def add_jec_variables(jets, event_rho):
     jets["pt_raw"] = (1 - jets.rawFactor)*jets.pt
@@ -30,12 +47,12 @@ def add_jec_variables(jets, event_rho):
 def jet_correction(events, jets, jetType, year, cache, applyJER=True):
     name = year if applyJER else f"{year}_NOJER"
     if jetType == "AK4PFchs":
-        return jet_factory[name].build(
+        return get_jme_factories()["jet_factory"][name].build(
             add_jec_variables(jets, events.fixedGridRhoFastjetAll),
             cache
         )
     elif jetType == "AK8PFPuppi":
-        return fatjet_factory[name].build(
+        return get_jme_factories()["fatjet_factory"][name].build(
             add_jec_variables(jets, events.fixedGridRhoFastjetAll),
             cache
         )
@@ -49,55 +66,38 @@ def jet_correction_correctionlib(
     using factors from correctionlib common-POG json file
     example here: https://gitlab.cern.ch/cms-nanoAOD/jsonpog-integration/-/blob/master/examples/jercExample.py
 
+    The jets are flattened once: the L1L2L3Res compound, the JER scale factor and the pt resolution are evaluated
+    on the same flat numpy buffers, and only the output fields are unflattened, at the end.
     '''
     jsonfile = JECjsonFiles[year][
         [t for t in ['AK4', 'AK8'] if typeJet.startswith(t)][0]
     ]
-    JECfile = correctionlib.CorrectionSet.from_file(jsonfile)
+    JECfile = get_correction_set(jsonfile)
     corr = JECfile.compound[f'{JECversion}_L1L2L3Res_{typeJet}']
 
     # until correctionlib handles jagged data natively we have to flatten and unflatten
     jets = events[Jet]
-    jets['pt_raw'] = (1 - jets['rawFactor']) * jets['pt']
-    jets['mass_raw'] = (1 - jets['rawFactor']) * jets['mass']
-    jets['rho'] = ak.broadcast_arrays(events.fixedGridRhoFastjetAll, jets.pt)[0]
-    j, nj = ak.flatten(jets), ak.num(jets)
-    flatCorrFactor = corr.evaluate(
-        np.array(j['area']),
-        np.array(j['eta']),
-        np.array(j['pt_raw']),
-        np.array(j['rho']),
-    )
-    corrFactor = ak.unflatten(flatCorrFactor, nj)
-
-    jets_corrected = copy.copy(jets)
-    jets_corrected['pt'] = jets['pt_raw'] * corrFactor
-    jets_corrected['mass'] = jets['mass_raw'] * corrFactor
-    jets_corrected['rho'] = jets['rho']
-
+    nj = ak.to_numpy(ak.num(jets))
+    flat = lambda field: ak.to_numpy(ak.flatten(jets[field]))
+    raw_factor = flat('rawFactor')
+    pt_raw = (1 - raw_factor) * flat('pt')
+    mass_raw = (1 - raw_factor) * flat('mass')
+    rho = np.repeat(ak.to_numpy(events.fixedGridRhoFastjetAll), nj)
+    eta = flat('eta')
+    corrFactor = corr.evaluate(flat('area'), eta, pt_raw, rho)
+    pt = pt_raw * corrFactor
+    mass = mass_raw * corrFactor
+
+    # The verbose printouts are labelled with the first event of the chunk
     seed = events.event[0]
 
     if verbose:
         print()
         print(seed, 'JEC: starting columns:', ak.fields(jets), end='\n\n')
-
-        print(seed, 'JEC: untransformed pt ratios', jets.pt / jets.pt_raw)
-        print(seed, 'JEC: untransformed mass ratios', jets.mass / jets.mass_raw)
-
-        print(
-            seed, 'JEC: corrected pt ratios', jets_corrected.pt / jets_corrected.pt_raw
-        )
-        print(
-            seed,
-            'JEC: corrected mass ratios',
-            jets_corrected.mass / jets_corrected.mass_raw,
-        )
-
-        print()
-        print(seed, 'JEC: corrected columns:', ak.fields(jets_corrected), end='\n\n')
-
-        # print('JES UP pt ratio',jets_corrected.JES_jes.up.pt/jets_corrected.pt_raw)
-        # print('JES DOWN pt ratio',jets_corrected.JES_jes.down.pt/jets_corrected.pt_raw, end='\n\n')
+        print(seed, 'JEC: untransformed pt ratios', flat('pt') / pt_raw)
+        print(seed, 'JEC: untransformed mass ratios', flat('mass') / mass_raw)
+        print(seed, 'JEC: corrected pt ratios', pt / pt_raw)
+        print(seed, 'JEC: corrected mass ratios', mass / mass_raw)
 
     # Apply JER pt smearing (https://twiki.cern.ch/twiki/bin/viewauth/CMS/JetResolution)
     # The hybrid scaling method is implemented: if a jet is matched to a gen-jet, the scaling method is applied;
@@ -105,107 +105,62 @@ def jet_correction_correctionlib(
     if JERversion:
         sf = JECfile[f'{JERversion}_ScaleFactor_{typeJet}']
         res = JECfile[f'{JERversion}_PtResolution_{typeJet}']
-        j, nj = ak.flatten(jets_corrected), ak.num(jets_corrected)
-        scaleFactor_flat = sf.evaluate(j['eta'].to_numpy(), 'nom')
-        ptResolution_flat = res.evaluate(
-            j['eta'].to_numpy(), j['pt'].to_numpy(), j['rho'].to_numpy()
-        )
-        scaleFactor = ak.unflatten(scaleFactor_flat, nj)
-        ptResolution = ak.unflatten(ptResolution_flat, nj)
-        # Match jets with gen-level jets, with DeltaR and DeltaPt requirements
-        dr_min = {'AK4PFchs': 0.2, 'AK8PFPuppi': 0.4}[
-            typeJet
-        ]  # Match jets within a cone with half the jet radius
-        pt_min = (
-            3 * ptResolution * jets_corrected['pt']
-        )  # Match jets whose pt does not differ more than 3 sigmas from the gen-level pt
+        scaleFactor = sf.evaluate(eta, 'nom')
+        ptResolution = res.evaluate(eta, pt, rho)
+
+        # Match jets with gen-level jets, with the association in NanoAOD, removing the indices that are not found.
+        # That happens because not all the genJet are saved in the NanoAODs (in NanoAOD nomatch == -1).
+        # The matched jets must have a pt that does not differ more than 3 sigmas from the gen-level pt.
         genJet    = {'AK4PFchs': 'GenJet', 'AK8PFPuppi': 'GenJetAK8'}[typeJet]
         genJetIdx = {'AK4PFchs': 'genJetIdx', 'AK8PFPuppi': 'genJetAK8Idx'}[typeJet]
-
-        # They can be matched manually
-        # matched_genjets, matched_jets, deltaR_matched = object_matching(genjets, jets_corrected, dr_min, pt_min)
-        # Or the association in NanoAOD it can be used, removing the indices that are not found. That happens because
-        # not all the genJet are saved in the NanoAODs.
-        genjets = events[genJet]
-        Ngenjet = ak.num(genjets)
-        matched_genjets_idx = ak.mask(
-            jets_corrected[genJetIdx],
-            (jets_corrected[genJetIdx] < Ngenjet) & (jets_corrected[genJetIdx] != -1),
-        )
-        # this array of indices has already the dimension of the Jet collection
-        # in NanoAOD nomatch == -1 --> convert to None with a mask
-        matched_objs_mask = ~ak.is_none(matched_genjets_idx, axis=1)
-        matched_genjets = genjets[matched_genjets_idx]
-        matched_jets = ak.mask(jets_corrected, matched_objs_mask)
-
-        deltaPt = ak.unflatten(
-            np.abs(ak.flatten(matched_jets.pt) - ak.flatten(matched_genjets.pt)),
-            ak.num(matched_genjets),
-        )
-        matched_genjets = ak.mask(matched_genjets, deltaPt < pt_min)
-        matched_jets = ak.mask(matched_jets, deltaPt < pt_min)
-
-        # Compute energy correction factor with the scaling method
-        detSmear = (
-            1
-            + (scaleFactor - 1)
-            * (matched_jets['pt'] - matched_genjets['pt'])
-            / matched_jets['pt']
-        )
-        # Compute energy correction factor with the stochastic method
-        np.random.seed(seed)
-        seed_dict = {}
-        filename = events.metadata['filename']
-        entrystart = events.metadata['entrystart']
-        entrystop = events.metadata['entrystop']
-        seed_dict[f'chunk_{filename}_{entrystart}-{entrystop}'] = seed
-        rand_gaus = np.random.normal(
-            np.zeros_like(ptResolution_flat), ptResolution_flat
+        genjets_pt = events[genJet].pt
+        Ngenjet = ak.to_numpy(ak.num(genjets_pt))
+        idx = flat(genJetIdx)
+        isMatched = (idx < np.repeat(Ngenjet, nj)) & (idx != -1)
+        # Index of the matched gen-jets in the flat gen-jet buffer
+        genjet_offsets = np.concatenate([[0], np.cumsum(Ngenjet)[:-1]])
+        genpt = np.zeros_like(pt)
+        genpt[isMatched] = ak.to_numpy(ak.flatten(genjets_pt))[(np.repeat(genjet_offsets, nj) + idx)[isMatched]]
+        isMatched &= np.abs(pt - genpt) < 3 * ptResolution * pt
+
+        # Compute energy correction factor with the stochastic method. The gaussian numbers are drawn with a
+        # counter-based generator keyed by the run, lumisection, event and index of each jet, so that the smearing
+        # does not depend on the chunks or on the executor (see `mutag_calib.lib.rng`).
+        # The jets of each type have an independent stream.
+        jet_index = ak.to_numpy(ak.flatten(ak.local_index(jets.pt)))
+        jersmear = ptResolution * counter_normal(
+            np.repeat(ak.to_numpy(events.run), nj),
+            np.repeat(ak.to_numpy(events.luminosityBlock), nj),
+            np.repeat(ak.to_numpy(events.event), nj),
+            jet_index,
+            stream=zlib.crc32(f"JER_{typeJet}".encode()),
         )
-        jersmear = ak.unflatten(rand_gaus, nj)
-        sqrt_arg_flat = scaleFactor_flat**2 - 1
-        sqrt_arg_flat = ak.where(
-            sqrt_arg_flat > 0, sqrt_arg_flat, ak.zeros_like(sqrt_arg_flat)
+        # Hybrid smearing factor: scaling method for the matched jets, stochastic method otherwise
+        smearFactor = np.where(
+            isMatched,
+            1 + (scaleFactor - 1) * (pt - genpt) / pt,
+            1 + jersmear * np.sqrt(np.maximum(scaleFactor**2 - 1, 0)),
         )
-        sqrt_arg = ak.unflatten(sqrt_arg_flat, nj)
-        stochSmear = 1 + jersmear * np.sqrt(sqrt_arg)
-        isMatched = ~ak.is_none(matched_jets.pt, axis=1)
-        smearFactor = ak.where(isMatched, detSmear, stochSmear)
-
-        jets_smeared = copy.copy(jets_corrected)
-        jets_smeared['pt'] = jets_corrected['pt'] * smearFactor
-        jets_smeared['mass'] = jets_corrected['mass'] * smearFactor
 
         if verbose:
             print()
             print(seed, "JER: isMatched", isMatched)
-            print(seed, "JER: matched_jets.pt", matched_jets.pt)
             print(seed, "JER: smearFactor", smearFactor, end='\n\n')
 
-            print(
-                seed,
-                'JER: corrected pt ratios',
-                jets_corrected.pt / jets_corrected.pt_raw,
-            )
-            print(
-                seed,
-                'JER: corrected mass ratios',
-                jets_corrected.mass / jets_corrected.mass_raw,
-            )
-
-            print(seed, 'JER: smeared pt ratios', jets_smeared.pt / jets_corrected.pt)
-            print(
-                seed,
-                'JER: smeared mass ratios',
-                jets_smeared.mass / jets_corrected.mass,
-            )
+        pt = pt * smearFactor
+        mass = mass * smearFactor
 
-            print()
-            print(seed, 'JER: corrected columns:', ak.fields(jets_smeared), end='\n\n')
+    # Only the output fields are unflattened, and attached to the jets at once
+    jets_corrected = with_fields(jets, {
+        field : ak.unflatten(values, nj)
+        for field, values in {'pt_raw' : pt_raw, 'mass_raw' : mass_raw, 'rho' : rho, 'pt' : pt, 'mass' : mass}.items()
+    })
+
+    if verbose:
+        print()
+        print(seed, 'JEC: corrected columns:', ak.fields(jets_corrected), end='\n\n')
 
-        return jets_smeared, seed_dict
-    else:
-        return jets_corrected
+    return jets_corrected
 
 
 def jet_selection(events, Jet, finalstate):
@@ -1,13 +1,16 @@
+import numpy as np
 import awkward as ak
 
-import correctionlib
+from mutag_calib.lib.corrections import get_correction_set
+from mutag_calib.lib.reweighting import get_reweighting
+from mutag_calib.lib.prescales import get_prescales
 
 #from mutag_calib.configs.fatjet_base.custom.parameters.pt_reweighting.pt_reweighting import pt_corrections, pteta_corrections
 
 def pt_reweighting(events, year):
     '''Reweighting scale factor based on the leading fatjet pT'''
     cat = 'pt350msd40'
-    cset = correctionlib.CorrectionSet.from_file(pt_corrections[year])
+    cset = get_correction_set(pt_corrections[year])
     pt_corr = cset[f'pt_corr_{year}']
 
     '''In case the jet pt is higher than 1500 GeV, the pt is padded to 0
@@ -20,7 +23,7 @@ def pt_reweighting(events, year):
 def pteta_reweighting(events, year):
     '''Reweighting scale factor based on the leading fatjet pT'''
     cat = 'pt350msd40'
-    cset = correctionlib.CorrectionSet.from_file(pteta_corrections[year])
+    cset = get_correction_set(pteta_corrections[year])
     pteta_corr = cset[f'pt_eta_2D_corr_{year}']
 
     '''In case the jet pt is higher than 1500 GeV, the pt is padded to 0
@@ -34,32 +37,44 @@ def pteta_reweighting(events, year):
 def sf_trigger_prescale(events, year, params):
     '''Trigger prescale factor'''
     # Here we assume that both BTagMu_AK4Jet300_Mu5 and BTagMu_AK8Jet170_DoubleMu5 triggers have a prescale of 1
-    sf = ak.Array(len(events)*[1.0])
-    pass_unprescaled_triggers = events.HLT["BTagMu_AK4Jet300_Mu5"] | events.HLT["BTagMu_AK8Jet170_DoubleMu5"]
-    sf = ak.where(events.HLT["BTagMu_AK8Jet300_Mu5"] & (~pass_unprescaled_triggers), 1. / params["HLT_triggers_prescales"][year]["BTagMu"]["BTagMu_AK8Jet300_Mu5"], sf)
-    sf = ak.where(events.HLT["BTagMu_AK8DiJet170_Mu5"] & (~events.HLT["BTagMu_AK8Jet300_Mu5"]) & (~pass_unprescaled_triggers), 1. / params["HLT_triggers_prescales"][year]["BTagMu"]["BTagMu_AK8DiJet170_Mu5"], sf)
+    prescales = params["HLT_triggers_prescales"][year]["BTagMu"]
+    hlt = {trigger : ak.to_numpy(events.HLT[trigger]) for trigger in ["BTagMu_AK4Jet300_Mu5", "BTagMu_AK8Jet170_DoubleMu5", "BTagMu_AK8Jet300_Mu5", "BTagMu_AK8DiJet170_Mu5"]}
+    sf = np.ones(len(events))
+    pass_unprescaled_triggers = hlt["BTagMu_AK4Jet300_Mu5"] | hlt["BTagMu_AK8Jet170_DoubleMu5"]
+    sf = np.where(hlt["BTagMu_AK8Jet300_Mu5"] & (~pass_unprescaled_triggers), 1. / prescales["BTagMu_AK8Jet300_Mu5"], sf)
+    sf = np.where(hlt["BTagMu_AK8DiJet170_Mu5"] & (~hlt["BTagMu_AK8Jet300_Mu5"]) & (~pass_unprescaled_triggers), 1. / prescales["BTagMu_AK8DiJet170_Mu5"], sf)
 
     return sf
 
+def sf_trigger_prescale_runlumi(events, year, isMC, params):
+    '''Trigger prescale factor by run and lumisection, from the prescale JSON files of the HLT paths.
+    The data events are weighted by the prescale of the least prescaled HLT path fired in their lumisection
+    (see `mutag_calib.lib.prescales.get_prescales`), while the MC events have a weight of 1.
+    This weight is an alternative to `sf_trigger_prescale`, which scales the MC by the inverse of the average prescales:
+    a config requests only one of the two.
+    The events of runs missing in the prescale files are handled according to the `HLT_triggers_prescales_missing_runs`
+    parameter ("raise" by default, or "disabled").'''
+    if isMC:
+        return np.ones(len(events))
+    if year not in params["HLT_triggers_prescales_runlumi"]:
+        raise Exception(f"The prescale files of the year {year} are not defined in the parameters 'HLT_triggers_prescales_runlumi'.")
+    files = params["HLT_triggers_prescales_runlumi"][year]["BTagMu"]
+    return get_prescales(events, files, missing_runs=params.get("HLT_triggers_prescales_missing_runs", "raise"))
+
 def sf_ptetatau21_reweighting(events, year, params):
     '''Correction of jets observable by a 3D reweighting based on (pT, eta, tau21).
     The function returns the nominal, up and down weights, where the up/down variations are computed considering the statistical uncertainty on data and MC.'''
 
 
-    cset = correctionlib.CorrectionSet.from_file(params["ptetatau21_reweighting"][year])
-    key = list(cset.keys())[0]
-    corr = cset[key]
-
-    cat = "inclusive"
-    nfatjet  = ak.num(events.FatJetGood.pt)
-    pos = ak.flatten(ak.local_index(events.FatJetGood.pt))
-    pt = ak.flatten(events.FatJetGood.pt)
-    eta = ak.flatten(events.FatJetGood.eta)
-    tau21 = ak.flatten(events.FatJetGood.tau21)
+    reweighting = get_reweighting(params["ptetatau21_reweighting"][year], {"cat" : "inclusive"})
+    nfatjet  = ak.to_numpy(ak.num(events.FatJetGood.pt))
+    pos = ak.to_numpy(ak.flatten(ak.local_index(events.FatJetGood.pt)))
+    pt = ak.to_numpy(ak.flatten(events.FatJetGood.pt))
+    eta = ak.to_numpy(ak.flatten(events.FatJetGood.eta))
+    tau21 = ak.to_numpy(ak.flatten(events.FatJetGood.tau21))
 
-    weight = {}
-    for var in ["nominal", "statUp", "statDown"]:
-        w = corr.evaluate(cat, var, pos, pt, eta, tau21)
-        weight[var] = ak.unflatten(w, nfatjet)
+    # The nominal, up and down weights are evaluated at once
+    weights = reweighting.evaluate(pos, pt, eta, tau21)
+    weight = {var : ak.unflatten(weights[i], nfatjet) for i, var in enumerate(reweighting.variations)}
 
     return weight["nominal"], weight["statUp"], weight["statDown"]
@@ -1,5 +1,5 @@
 from pocket_coffea.lib.weights.weights import WeightLambda
-from mutag_calib.configs.fatjet_base.custom.scale_factors import pt_reweighting, pteta_reweighting, sf_ptetatau21_reweighting, sf_trigger_prescale
+from mutag_calib.configs.fatjet_base.custom.scale_factors import pt_reweighting, pteta_reweighting, sf_ptetatau21_reweighting, sf_trigger_prescale, sf_trigger_prescale_runlumi
 
 pt_weight = WeightLambda.wrap_func(
     name="pt_reweighting",
@@ -18,6 +18,15 @@ SF_trigger_prescale = WeightLambda.wrap_func(
     has_variations=False,
     )
 
+# Prescale of the data events by run and lumisection, computed also for data
+SF_trigger_prescale_runlumi = WeightLambda.wrap_func(
+    name="sf_trigger_prescale_runlumi",
+    function=lambda params, metadata, events, size, shape_variations:
+        sf_trigger_prescale_runlumi(events, metadata['year'], metadata['isMC'], params),
+    has_variations=False,
+    isMC_only=False,
+    )
+
 SF_ptetatau21_reweighting = WeightLambda.wrap_func(
     name="sf_ptetatau21_reweighting",
     function=lambda params, metadata, events, size, shape_variations:
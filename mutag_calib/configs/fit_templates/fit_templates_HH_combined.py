@@ -0,0 +1,173 @@
+from pocket_coffea.utils.configurator import Configurator
+from pocket_coffea.lib.cut_definition import Cut
+from pocket_coffea.lib.cut_functions import get_nObj_eq, get_nObj_min, get_HLTsel, get_nPVgood, goldenJson, eventFlags
+from pocket_coffea.parameters.cuts import passthrough
+
+from pocket_coffea.lib.calibrators.common.common import JetsCalibrator, JetsSoftdropMassCalibrator
+from pocket_coffea.lib.weights.common.common import common_weights
+import mutag_calib
+from mutag_calib.configs.fatjet_base.custom.cuts import get_nObj_minmsd, get_flavor
+from mutag_calib.configs.fatjet_base.custom.weights import SF_trigger_prescale
+import mutag_calib.workflows.mutag_multianalysis_processor as workflow
+from mutag_calib.workflows.mutag_multianalysis_processor import mutagMultiAnalysisProcessor
+import os
+
+localdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loading default parameters
+from pocket_coffea.parameters import defaults
+default_parameters = defaults.get_default_parameters()
+defaults.register_configuration_dir("config_dir", localdir+"/params")
+
+parameters = defaults.merge_parameters_from_files(default_parameters,
+                                                f"{localdir}/params/object_preselection.yaml",
+                                                f"{localdir}/params/jets_calibration.yaml",
+                                                f"{localdir}/params/triggers_run3.yaml",
+                                                f"{localdir}/params/triggers_prescales_run3.yaml",
+                                                f"{localdir}/params/plotting_style.yaml",
+                                                update=True)
+
+samples = [
+    "QCD_MuEnriched",
+    "QCD_Madgraph",
+    "VJets",
+    "TTto4Q",
+    "SingleTop",
+    "DATA_BTagMu"
+]
+
+subsamples = {}
+for s in filter(lambda x: 'DATA_BTagMu' not in x, samples):
+    subsamples[s] = {f"{s}_{f}" : [get_flavor(f)] for f in ['l', 'c', 'b', 'cc', 'bb']}
+
+# The skim, calibration, object selection and preselection are run once per chunk for all the analyses.
+# The categories and histograms of each analysis are defined in its config, and its output is saved in output["analyses"][name].
+# The samples, years, weights and shape variations of this config include the ones of all the analyses.
+analyses = ["HHbbbb", "HHbbgg", "HHbbtt"]
+
+workflow_options = {
+    "analyses" : {name : f"{localdir}/fit_templates/fit_templates_{name}.py" for name in analyses},
+    # No histogram is filled with the categories of this config
+    "histograms_to_reweigh" : {
+        "by_pos" : {}
+    }
+}
+
+cfg = Configurator(
+    parameters = parameters,
+    datasets = {
+        "jsons": ["datasets/MC_QCD_MuEnriched_run3_redirector.json",
+                  "datasets/MC_QCD_Madgraph_run3_redirector.json",
+                  "datasets/MC_VJets_run3_redirector.json",
+                  "datasets/MC_TTto4Q_run3_redirector.json",
+                  "datasets/MC_singletop_run3_redirector.json",
+                  "datasets/DATA_BTagMu_run3_redirector.json"],
+        "filter" : {
+            "samples": samples,
+            "samples_exclude" : [],
+            "year": [
+                '2022_preEE',
+                '2022_postEE',
+                '2023_preBPix',
+                '2023_postBPix',
+                '2024'
+            ]
+        },
+        "subsamples": subsamples
+    },
+
+    workflow = mutagMultiAnalysisProcessor,
+    workflow_options = workflow_options,
+
+    skim = [get_nPVgood(1),
+            eventFlags,
+            goldenJson,
+            get_nObj_min(1, 200., "FatJet"),
+            get_nObj_minmsd(1, 30., "FatJet"),
+            get_nObj_min(1, 3., "Muon"),
+            get_HLTsel()],
+
+    preselections = [get_nObj_min(1, parameters.object_preselection["FatJet"]["pt"], "FatJetGood")],
+    categories = {
+        "baseline" : [passthrough],
+    },
+
+    weights_classes = common_weights + [SF_trigger_prescale],
+    weights = {
+        "common": {
+            "inclusive": ["genWeight","lumi","XS","sf_trigger_prescale",
+                          "pileup"],
+            "bycategory" : {
+            }
+        },
+        "bysample": {
+            "QCD_Madgraph": {
+                "inclusive": ["sf_partonshower_isr", "sf_partonshower_fsr"],
+                "bycategory" : {
+                }
+            },
+            "VJets": {
+                "inclusive": ["sf_partonshower_isr", "sf_partonshower_fsr"],
+                "bycategory" : {
+                }
+            },
+            "TTto4Q": {
+                "inclusive": ["sf_partonshower_isr", "sf_partonshower_fsr"],
+                "bycategory" : {
+                }
+            },
+            "SingleTop": {
+                "inclusive": ["sf_partonshower_isr", "sf_partonshower_fsr"],
+                "bycategory" : {
+                }
+            }
+        }
+    },
+
+    calibrators = [JetsCalibrator, JetsSoftdropMassCalibrator],
+    variations = {
+        "weights": {
+            "common": {
+                "inclusive": ["pileup"],
+                "bycategory" : {
+                }
+            },
+            "bysample": {
+                "QCD_Madgraph": {
+                    "inclusive": ["sf_partonshower_isr", "sf_partonshower_fsr"],
+                    "bycategory": {
+                    }
+                },
+                "VJets": {
+                    "inclusive": ["sf_partonshower_isr", "sf_partonshower_fsr"],
+                    "bycategory": {
+                    }
+                },
+                "TTto4Q": {
+                    "inclusive": ["sf_partonshower_isr", "sf_partonshower_fsr"],
+                    "bycategory": {
+                    }
+                },
+                "SingleTop": {
+                    "inclusive": ["sf_partonshower_isr", "sf_partonshower_fsr"],
+                    "bycategory": {
+                    }
+                }
+            }   
+        },
+        "shape": {
+            "common": {
+                "inclusive" : ["jet_calibration"]
+            }
+        }
+    },
+
+    variables = {},
+
+    columns = {}
+)
+
+# Registering custom functions
+import cloudpickle
+cloudpickle.register_pickle_by_value(workflow)
+cloudpickle.register_pickle_by_value(mutag_calib)
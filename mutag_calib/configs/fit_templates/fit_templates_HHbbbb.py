@@ -2,7 +2,8 @@ from pocket_coffea.utils.configurator import Configurator
 from pocket_coffea.lib.cut_definition import Cut
 from pocket_coffea.lib.cut_functions import get_nObj_eq, get_nObj_min, get_HLTsel, get_nPVgood, goldenJson, eventFlags
 from pocket_coffea.parameters.cuts import passthrough
-from pocket_coffea.lib.categorization import CartesianSelection, MultiCut
+from pocket_coffea.lib.categorization import MultiCut
+from mutag_calib.lib.categorization import PackedCartesianSelection
 
 from pocket_coffea.lib.calibrators.common.common import JetsCalibrator, JetsSoftdropMassCalibrator
 from pocket_coffea.lib.weights.common.common import common_weights
@@ -179,7 +180,7 @@ cfg = Configurator(
             get_HLTsel()],
 
     preselections = [get_nObj_min(1, parameters.object_preselection["FatJet"]["pt"], "FatJetGood")],
-    categories = CartesianSelection(multicuts=multicuts, common_cats=common_cats),
+    categories = PackedCartesianSelection(multicuts=multicuts, common_cats=common_cats),
 
     weights_classes = common_weights + [SF_trigger_prescale],
     weights = {
@@ -0,0 +1,170 @@
+import numpy as np
+import awkward as ak
+
+from pocket_coffea.lib.categorization import CartesianSelection
+from mutag_calib.configs.fatjet_base.custom.functions import ptbin, msoftdropbin, tagger_mask_inclusive_wp
+
+def cut_interval(cut):
+    '''Returns the interval of a field of the AK8 jets selected by a binning cut, as a tuple
+    (field, low, high, low_closed, high_closed), with None for an unbounded side of the interval.
+    The supported cuts are `get_ptbin`, `get_msdbin` and `get_inclusive_wp`: the interval selects exactly
+    the same jets as the cut function (e.g. the fail region of a WP is [0, wp]).'''
+    params = cut.params
+    if cut.function is ptbin:
+        if isinstance(params["pt_high"], str) and params["pt_high"] != 'Inf':
+            raise Exception(f"The upper edge of the pt bin of the cut {cut.name} must be a number or 'Inf', not '{params['pt_high']}'.")
+        return ("pt", params["pt_low"], None if params["pt_high"] == 'Inf' else params["pt_high"], False, False)
+    elif cut.function is msoftdropbin:
+        if isinstance(params["msd_max"], str) and params["msd_max"] != 'Inf':
+            raise Exception(f"The upper edge of the msoftdrop bin of the cut {cut.name} must be a number or 'Inf', not '{params['msd_max']}'.")
+        return ("msoftdrop", params["msd_min"], None if params["msd_max"] == 'Inf' else params["msd_max"], True, False)
+    elif cut.function is tagger_mask_inclusive_wp:
+        cut_low = params["wp"] if isinstance(params["wp"], float) else params["wp"][0]
+        if params["category"] == "pass":
+            return (params["tagger"], cut_low, None, False, False)
+        elif params["category"] == "fail":
+            return (params["tagger"], 0., min(cut_low, 1.), True, True)
+        raise Exception(f"The allowed categories for the tagger selection are 'pass' and 'fail', not '{params['category']}'.")
+    raise Exception(f"The cut {cut.name} (function {cut.function.__name__}) is not a binning cut supported by PackedCartesianSelection.")
+
+def in_interval(values, interval):
+    '''Returns the mask of the values inside the interval (field, low, high, low_closed, high_closed).
+    The bounds are converted to the type of the values, as in the comparisons of the cut functions.'''
+    _, low, high, low_closed, high_closed = interval
+    mask = np.ones(len(values), dtype=bool)
+    if low is not None:
+        low = values.dtype.type(low)
+        mask &= (values >= low) if low_closed else (values > low)
+    if high is not None:
+        high = values.dtype.type(high)
+        mask &= (values <= high) if high_closed else (values < high)
+    return mask
+
+class FieldCells:
+    '''Partition of the values of a field in elementary cells, delimited by the bounds of all the intervals on the field.
+    With the sorted bounds b_0 < ... < b_n-1, the cells are: the open interval below b_0 (cell 0), the value b_i (cell 2i+1),
+    the open interval between b_i and b_i+1 (cell 2i+2), the open interval above b_n-1 (cell 2n) and NaN (cell 2n+1).
+    All the values of a cell are in the same intervals, so that an interval is a set of cells.
+    The bounds are converted to the type of the values of the field, as in the comparisons of the cut functions.'''
+    def __init__(self, field, intervals, dtype):
+        self.field = field
+        self.dtype = np.dtype(dtype)
+        self.bounds = np.unique(np.array([b for interval in intervals for b in interval[1:3] if b is not None], dtype=self.dtype))
+        if len(self.bounds) == 0:
+            raise Exception(f"The intervals on the field {field} are not bounded.")
+        self.ncells = 2 * len(self.bounds) + 2
+        self.nbits = int(self.ncells - 1).bit_length()
+        # One value of each cell, to evaluate the intervals on the cells
+        nbounds = len(self.bounds)
+        representatives = np.zeros(self.ncells, dtype=self.dtype)
+        representatives[1:2*nbounds:2] = self.bounds
+        representatives[2:2*nbounds-1:2] = self.bounds[:-1] + (self.bounds[1:] - self.bounds[:-1]) / 2
+        if self.dtype.kind == "f":
+            representatives[0] = np.nextafter(self.bounds[0], self.dtype.type(-np.inf))
+            representatives[2*nbounds] = np.nextafter(self.bounds[-1], self.dtype.type(np.inf))
+            representatives[-1] = np.nan
+        else:
+            representatives[0] = self.bounds[0] - 1
+            representatives[2*nbounds] = self.bounds[-1] + 1
+        self.representatives = representatives
+
+    def cells(self, values):
+        '''Returns the index of the cell of each value.'''
+        index = np.searchsorted(self.bounds, values, side="left")
+        on_bound = self.bounds[np.minimum(index, len(self.bounds) - 1)] == values
+        cells = 2 * index + on_bound
+        if self.dtype.kind == "f":
+            cells[np.isnan(values)] = self.ncells - 1
+        return cells
+
+    def cells_in_interval(self, interval):
+        '''Returns the mask of the cells inside the interval.'''
+        return in_interval(self.representatives, interval)
+
+class CategoryCodes:
+    '''Packing of the cells of the fields (see `FieldCells`) in the bits of one integer code per jet,
+    and table of the codes inside each cut of each MultiCut, for the given types of the fields.'''
+    def __init__(self, intervals, dtypes):
+        self.fields = {
+            field : FieldCells(field, [i for cut_intervals in intervals for i in cut_intervals if i[0] == field], dtype)
+            for field, dtype in dtypes.items()
+        }
+        self.shifts = dict(zip(self.fields, np.cumsum([0] + [cells.nbits for cells in self.fields.values()])[:-1]))
+        ncodes = 1 << int(sum(cells.nbits for cells in self.fields.values()))
+        if ncodes > 1 << 24:
+            raise Exception(f"The packed category codes need more than 24 bits ({ncodes} codes).")
+        codes = np.arange(ncodes)
+        cells = {field : (codes >> self.shifts[field]) & ((1 << field_cells.nbits) - 1) for field, field_cells in self.fields.items()}
+        self.cut_tables = []
+        for cut_intervals in intervals:
+            table = np.zeros((len(cut_intervals), ncodes), dtype=bool)
+            for i, interval in enumerate(cut_intervals):
+                field_cells = self.fields[interval[0]]
+                valid = cells[interval[0]] < field_cells.ncells
+                table[i, valid] = field_cells.cells_in_interval(interval)[cells[interval[0]][valid]]
+            self.cut_tables.append(table)
+
+    def codes(self, values):
+        '''Returns the packed code of each jet, from the flat arrays of `values` of the fields ({field: array}).'''
+        codes = np.zeros(len(next(iter(values.values()))), dtype=np.int64)
+        for field, cells in self.fields.items():
+            codes |= cells.cells(values[field]).astype(np.int64) << self.shifts[field]
+        return codes
+
+class PackedCartesianSelection(CartesianSelection):
+    '''CartesianSelection of the AK8 jets in bins of pT, softdrop mass and tagger WPs, built from a packed category code per jet.
+    The MultiCut objects have to be made of the binning cuts supported by `cut_interval`, on the FatJetGood collection.
+    Instead of evaluating one mask per cut and the AND of the masks of each category, the cell of each jet is computed once
+    per field with `np.searchsorted` (see `FieldCells`) and the cells of the fields are packed in the bits of one integer code per jet.
+    The mask of a category is then a lookup of the codes of the jets in the table of the codes of the category.
+    The tables are computed once for each combination of types of the fields. The common categories are evaluated as in CartesianSelection.'''
+    def __init__(self, multicuts, common_cats=None):
+        super().__init__(multicuts, common_cats)
+        for multicut in self.multicuts:
+            if multicut.multidim_collection != "FatJetGood":
+                raise Exception(f"The MultiCut {multicut.name} of a PackedCartesianSelection has to select the FatJetGood collection.")
+        self.intervals = [[cut_interval(cut) for cut in multicut.cuts] for multicut in self.multicuts]
+        self.fields = list(dict.fromkeys(interval[0] for cut_intervals in self.intervals for interval in cut_intervals))
+        self.category_codes = {}
+        self.cut_tables = None
+        self.codes = None
+        self.counts = None
+
+    def prepare(self, events, processor_params, **kwargs):
+        # clean the cache
+        self.cache.clear()
+        if self.has_common_cats:
+            self.common_cats.prepare(events, processor_params, **kwargs)
+        fatjets = events[self.multidim_collection]
+        self.counts = ak.to_numpy(ak.num(fatjets))
+        values = {field : ak.to_numpy(ak.flatten(fatjets[field])) for field in self.fields}
+        dtypes = tuple(values[field].dtype for field in self.fields)
+        if dtypes not in self.category_codes:
+            self.category_codes[dtypes] = CategoryCodes(self.intervals, dict(zip(self.fields, dtypes)))
+        self.cut_tables = self.category_codes[dtypes].cut_tables
+        self.codes = self.category_codes[dtypes].codes(values)
+
+    def get_category_mask(self, multi_index):
+        '''Returns the mask of the jets in the category with indices `multi_index` in the MultiCut objects.'''
+        if isinstance(multi_index, str):
+            return self.common_cats.get_mask(multi_index)
+        if multi_index in self.cache:
+            return self.cache[multi_index]
+        if self.codes is None:
+            raise Exception("Before using the selection, call the prepare method to compute the category codes")
+        table = np.logical_and.reduce([cut_table[index] for cut_table, index in zip(self.cut_tables, multi_index)])
+        mask = ak.unflatten(table[self.codes], self.counts)
+        self.cache[multi_index] = mask
+        return mask
+
+    def get_masks(self):
+        for category, multi_index in zip(self.categories, self.cat_multi_index):
+            yield category, self.get_category_mask(multi_index)
+
+    def get_mask(self, category):
+        if category not in self.categories_dict:
+            raise ValueError(f"Requested category ({category}) does not exists")
+        return self.get_category_mask(self.categories_dict[category])
+
+    def __str__(self):
+        return f"PackedCartesianSelection {[m.name for m in self.multicuts]}, ({len(self.categories)} categories)"
@@ -0,0 +1,37 @@
+import numpy as np
+
+class JetColumnCache:
+    '''Cache of the per-jet columns of the AK8 jets of a chunk that are not changed by the shape variations
+    (e.g. the numbers of muons and SV matched to the jets, the SV mass observables and tau21,
+    which do not depend on the pT and mass of the jets changed by the jet calibration).
+    The jets are identified by their index in the chunk, `jet_index`, since the selected jets can be different
+    in each variation: the columns of the jets not seen in the previous variations are computed and added to the cache.
+    Each jet is stored with a key: the cached columns of a jet are used only if its key is the same as when
+    they were computed (e.g. the set of selected jets of the event, which the matching of the muons and SV depends on).
+    A key equal to 0 is never found in the cache. The cache must be created again for each chunk.'''
+
+    def __init__(self, njets):
+        self.njets = njets
+        self.columns = {}
+        self.keys = np.zeros(njets, dtype=np.uint64)
+        self.stats = {"hits" : 0, "misses" : 0}
+
+    def get(self, jet_index, keys, compute):
+        '''Returns the dictionary {column: flat array} of the columns of the jets `jet_index` with keys `keys`.
+        The function `compute` is called with the positions in `jet_index` of the jets missing in the cache
+        and has to return the dictionary of the flat arrays of all the columns for these jets.'''
+        missing = np.nonzero((keys == 0) | (self.keys[jet_index] != keys))[0]
+        if len(missing) > 0 or len(self.columns) == 0:
+            values = compute(missing)
+            for name, value in values.items():
+                if name not in self.columns:
+                    self.columns[name] = np.zeros(self.njets, dtype=value.dtype)
+                self.columns[name][jet_index[missing]] = value
+            self.keys[jet_index[missing]] = keys[missing]
+        self.stats["misses"] += len(missing)
+        self.stats["hits"] += len(jet_index) - len(missing)
+        return {name : column[jet_index] for name, column in self.columns.items()}
+
+    def lookup(self, name, jet_index):
+        '''Returns the column `name` of the jets `jet_index`, which have to be in the cache.'''
+        return self.columns[name][jet_index]
@@ -0,0 +1,116 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import correctionlib
+
+# Process-wide cache of the correctionlib CorrectionSet objects, and of the other objects built from
+# correction files, shared by all the weights and calibrations.
+# The objects are keyed by the absolute path and the checksum of the file, so that a file modified during
+# the processing is reloaded, and the least recently used object is evicted when the cache is full.
+_correction_sets = OrderedDict()
+# Checksum of the files, by absolute path, valid as long as the size and modification time are unchanged
+_checksums = {}
+_cache_stats = {"hits": 0, "misses": 0}
+_cache_size = 16
+# Lock of the cache. The files are parsed outside of it, holding only the lock of their key (see `get_cached`)
+_lock = threading.Lock()
+_key_locks = {}
+# Counters of the hits and misses of the calling thread, active in `count_correction_set_cache` blocks
+_local = threading.local()
+
+def file_checksum(path):
+    '''Returns the SHA-256 checksum of the file `path`.
+    The file is read again only if its size or modification time changed since the last call.'''
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    if path in _checksums and _checksums[path][0] == signature:
+        return _checksums[path][1]
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    _checksums[path] = (signature, sha256.hexdigest())
+    return _checksums[path][1]
+
+def get_correction_set(path):
+    '''Returns the correctionlib CorrectionSet of the JSON file `path` (optionally gzipped).
+    The set is parsed only at the first call in the process and then taken from the cache,
+    as long as the content of the file is unchanged.'''
+    return get_cached(path, correctionlib.CorrectionSet.from_file)
+
+def _count(outcome):
+    '''Increment the counter `outcome` ("hits" or "misses") of the process and of the active blocks of the thread.'''
+    _cache_stats[outcome] += 1
+    for counters in getattr(_local, "counters", []):
+        counters[outcome] += 1
+
+def get_cached(path, loader, *args):
+    '''Returns the object built by `loader(path, *args)` from the correction file `path`.
+    The object is built only at the first call in the process and then taken from the cache,
+    as long as the content of the file is unchanged. The `args` must be hashable.
+    The file is parsed outside of the lock of the cache, so that a slow parse does not block the lookups
+    of the other threads: only the threads requesting the same object wait for the first one to build it.'''
+    path = os.path.abspath(path)
+    key = (path, file_checksum(path), loader, args)
+    with _lock:
+        if key in _correction_sets:
+            _count("hits")
+            _correction_sets.move_to_end(key)
+            return _correction_sets[key]
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        with _lock:
+            # The object was built by another thread while waiting for the lock of the key
+            if key in _correction_sets:
+                _count("hits")
+                _correction_sets.move_to_end(key)
+                return _correction_sets[key]
+            _count("misses")
+        obj = loader(path, *args)
+        with _lock:
+            _correction_sets[key] = obj
+            while len(_correction_sets) > _cache_size:
+                _correction_sets.popitem(last=False)
+            _key_locks.pop(key, None)
+        return obj
+
+def set_correction_set_cache_size(size):
+    '''Set the maximum number of objects kept in the CorrectionSet cache.'''
+    global _cache_size
+    if size < 1:
+        raise ValueError("The size of the CorrectionSet cache must be at least 1.")
+    with _lock:
+        _cache_size = size
+        while len(_correction_sets) > _cache_size:
+            _correction_sets.popitem(last=False)
+
+def get_correction_set_cache_stats():
+    '''Returns a copy of the counters of the hits and misses of the CorrectionSet cache in the process.'''
+    with _lock:
+        return dict(_cache_stats)
+
+@contextmanager
+def count_correction_set_cache():
+    '''Context manager counting the hits and misses of the CorrectionSet cache in the calling thread only.
+    The block yields a dictionary of the counters, updated by the calls in the block:
+    unlike the difference of two `get_correction_set_cache_stats` snapshots, the calls of other threads
+    processing at the same time are not counted.'''
+    counters = {"hits": 0, "misses": 0}
+    if not hasattr(_local, "counters"):
+        _local.counters = []
+    _local.counters.append(counters)
+    try:
+        yield counters
+    finally:
+        _local.counters.remove(counters)
+
+def clear_correction_set_cache():
+    '''Remove all the CorrectionSet objects from the cache. The counters are not reset.'''
+    with _lock:
+        _correction_sets.clear()
+        _checksums.clear()
+        _key_locks.clear()
@@ -1,16 +1,206 @@
+import numba
+import numpy as np
 import awkward as ak
 
-def run_deltar_matching(obj1, obj2, radius=0.4): # NxM , NxG arrays
+# Implementations of the deltaR matching (see `run_deltar_matching`)
+DELTAR_MATCHING_BACKENDS = ["numba", "sweep", "awkward"]
+
+def check_deltar_matching_backend(backend):
+    '''Raise a ValueError if `backend` is not an implementation of the deltaR matching.'''
+    if backend not in DELTAR_MATCHING_BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}' for the deltaR matching. Available backends: {', '.join(repr(b) for b in DELTAR_MATCHING_BACKENDS)}.")
+
+def run_deltar_matching(obj1, obj2, radius=0.4, backend="numba"): # NxM , NxG arrays
+    '''
+    Doing this you can keep the assignment on the obj2 collection unique,
+    but you are not checking the uniqueness of the matching to the first collection.
+
+    The `radius` can be either a number or an array with the same shape as obj1 (NxM),
+    in which case each object of the first collection has its own matching cone.
+    The `backend` argument selects the implementation:
+      - "numba": compiled kernel looping over the event offsets, without building the NxMxG cartesian product
+      - "sweep": compiled kernel that sorts obj2 by eta in each event and, for each object of obj1,
+                 only tests the candidates inside the |deta| < R window (useful at high multiplicity)
+      - "awkward": reference implementation based on the nested `ak.cartesian`
+    All the backends return the same NxMxG' array.
+    '''
+    return run_deltar_matching_multi(obj1, [(obj2, radius)], backend=backend)[0]
+
+def run_deltar_matching_multi(obj1, collections, backend="numba"):
     '''
-    Doing this you can keep the assignment on the obj2 collection unique, 
-    but you are not checking the uniqueness of the matching to the first collection. 
+    Match several collections to the same obj1 collection (NxM) at once.
+    `collections` is a list of (obj2, radius) pairs, and the list of the matched NxMxG' arrays
+    is returned in the same order, each one identical to the output of `run_deltar_matching`.
+    With the compiled backends, the flat buffers of obj1 are built only once and all the collections
+    are matched in a single pass over the event offsets.
     '''
+    check_deltar_matching_backend(backend)
+    if backend == "numba":
+        return _run_deltar_matching_numba(obj1, collections)
+    elif backend == "sweep":
+        return _run_deltar_matching_numba(obj1, collections, sweep=True)
+    else:
+        return [_run_deltar_matching_awkward(obj1, obj2, radius) for obj2, radius in collections]
+
+def _run_deltar_matching_awkward(obj1, obj2, radius=0.4):
     _, obj2 = ak.unzip(ak.cartesian([obj1, obj2], nested=True)) # Obj2 is now NxMxG
     obj2['dR'] = obj1.delta_r(obj2)  # Calculating delta R
     t_index = ak.argmin(obj2.dR, axis=-2) # Finding the smallest dR (NxG array)
     s_index = ak.local_index(obj1.eta, axis=-1) #  NxM array
-    _, t_index = ak.unzip(ak.cartesian([s_index, t_index], nested=True)) 
+    _, t_index = ak.unzip(ak.cartesian([s_index, t_index], nested=True))
     obj2 = obj2[s_index == t_index] # Pairwise comparison to keep smallest delta R
     # Cutting on delta R
-    obj2 = obj2[obj2.dR < radius] #Additional cut on delta R, now a NxMxG' array 
+    obj2 = obj2[obj2.dR < radius] #Additional cut on delta R, now a NxMxG' array
     return obj2
+
+def _run_deltar_matching_numba(obj1, collections, sweep=False):
+    # Flat buffers of the first collection and its event offsets
+    n1 = ak.to_numpy(ak.num(obj1, axis=1))
+    offsets1 = np.zeros(len(n1) + 1, dtype=np.int64)
+    np.cumsum(n1, out=offsets1[1:])
+
+    # The flat buffers of the matched collections are concatenated: the offsets of the
+    # k-th collection in the concatenated buffers are stored in the k-th row of `offsets2`
+    eta2 = [ak.to_numpy(ak.flatten(obj2.eta)) for obj2, _ in collections]
+    phi2 = [ak.to_numpy(ak.flatten(obj2.phi)) for obj2, _ in collections]
+    start2 = np.cumsum([0] + [len(eta) for eta in eta2])
+    offsets2 = np.zeros((len(collections), len(n1) + 1), dtype=np.int64)
+    for k, (obj2, _) in enumerate(collections):
+        np.cumsum(ak.to_numpy(ak.num(obj2, axis=1)), out=offsets2[k, 1:])
+        offsets2[k] += start2[k]
+    # The deltaR is computed with the same precision as the coffea `delta_r` method
+    eta1 = ak.to_numpy(ak.flatten(obj1.eta))
+    phi1 = ak.to_numpy(ak.flatten(obj1.phi))
+    dtype = np.result_type(eta1, phi1, *eta2, *phi2)
+    eta1 = eta1.astype(dtype, copy=False)
+    phi1 = phi1.astype(dtype, copy=False)
+    radius1 = np.empty((len(collections), len(eta1)), dtype=np.float64)
+    for k, (_, radius) in enumerate(collections):
+        if isinstance(radius, (int, float)):
+            # A python scalar is compared to dR in the dR precision, as numpy does
+            radius1[k] = dtype.type(radius)
+        else:
+            radius1[k] = ak.to_numpy(ak.flatten(ak.broadcast_arrays(radius, obj1.eta)[0]))
+    eta2 = np.concatenate(eta2).astype(dtype, copy=False)
+    phi2 = np.concatenate(phi2).astype(dtype, copy=False)
+
+    match_idx = np.empty(len(eta2), dtype=np.int64)
+    match_dr = np.empty(len(eta2), dtype=dtype)
+    _get_matching_kernel(dtype, sweep)(
+        offsets1, eta1, phi1, radius1, offsets2, eta2, phi2, match_idx, match_dr
+    )
+
+    output = []
+    for k, (obj2, _) in enumerate(collections):
+        idx = match_idx[start2[k]:start2[k + 1]]
+        dr = match_dr[start2[k]:start2[k + 1]]
+        # Group the matched objects by the index of the object they are matched to.
+        # The stable sort preserves the original ordering of obj2 within each group.
+        idx_matched = np.nonzero(idx >= 0)[0]
+        idx_matched = idx_matched[np.argsort(idx[idx_matched], kind="stable")]
+        counts = np.bincount(idx[idx_matched], minlength=len(eta1))
+
+        matched = ak.flatten(obj2)[idx_matched]
+        matched['dR'] = dr[idx_matched]
+        # The awkward backend selects the matched objects with a masked index, returning an option type:
+        # the same type is kept here so that the two backends are interchangeable
+        matched = ak.mask(matched, np.ones(len(idx_matched), dtype=bool))
+        output.append(ak.unflatten(ak.unflatten(matched, counts), n1)) # NxMxG' array
+    return output
+
+_matching_kernels = {}
+
+def _get_matching_kernel(dtype, sweep=False):
+    '''Returns the matching kernel compiled for the floating point type `dtype`.'''
+    key = (np.dtype(dtype), sweep)
+    if key not in _matching_kernels:
+        build = _build_sweep_kernel if sweep else _build_matching_kernel
+        _matching_kernels[key] = build(key[0].type)
+    return _matching_kernels[key]
+
+def build_delta_r(ftype):
+    '''Returns a compiled function computing the deltaR between two objects with the
+    same arithmetic as `delta_r` in coffea.nanoevents.methods.vector, in the precision `ftype`.'''
+
+    @numba.njit
+    def delta_r(eta1, phi1, eta2, phi2):
+        deta = ftype(eta1 - eta2)
+        # As the float32/float64 signatures of the dphi kernel of coffea: the difference is taken in the input
+        # precision, the wrap-around with the float64 constant pi, and the result is cast back to the input precision.
+        # Doing the wrap-around in float32 changes the dR in the last place, and the matching at the cone edge.
+        dphi = ftype((phi1 - phi2 + np.pi) % (2 * np.pi) - np.pi)
+        return ftype(np.hypot(deta, dphi))
+
+    return delta_r
+
+def _build_matching_kernel(ftype):
+    delta_r = build_delta_r(ftype)
+
+    @numba.njit
+    def kernel(offsets1, eta1, phi1, radius1, offsets2, eta2, phi2, match_idx, match_dr):
+        '''For each object of the matched collections, find the closest object of the first collection
+        in the same event and store its flat index in `match_idx` if the distance is within its radius,
+        otherwise -1 is stored.'''
+        for iev in range(len(offsets1) - 1):
+            for k in range(offsets2.shape[0]):
+                for j in range(offsets2[k, iev], offsets2[k, iev + 1]):
+                    best = -1
+                    best_dr = ftype(0)
+                    for i in range(offsets1[iev], offsets1[iev + 1]):
+                        dr = delta_r(eta1[i], phi1[i], eta2[j], phi2[j])
+                        # Keep the first minimum, as `ak.argmin`
+                        if best < 0 or dr < best_dr:
+                            best = i
+                            best_dr = dr
+                    if best >= 0 and best_dr < radius1[k, best]:
+                        match_idx[j] = best
+                        match_dr[j] = best_dr
+                    else:
+                        match_idx[j] = -1
+
+    return kernel
+
+# Absolute margin added to the eta window of the sweep, so that the float32 rounding of deta
+# can never exclude a candidate that would pass the dR < R requirement
+ETA_WINDOW_MARGIN = 1e-5
+
+def _build_sweep_kernel(ftype):
+    delta_r = build_delta_r(ftype)
+
+    @numba.njit
+    def kernel(offsets1, eta1, phi1, radius1, offsets2, eta2, phi2, match_idx, match_dr):
+        '''Same output as the brute-force kernel. In each event the matched objects are sorted by eta and
+        each object of the first collection is compared only with the objects in the window |deta| < Rmax,
+        where Rmax is the largest radius in the event. The objects outside the window cannot be
+        matched, since their dR to the closest object of the first collection is always above Rmax.
+        The phi wrap-around is handled by the dphi computation, so no window is applied in phi.'''
+        for iev in range(len(offsets1) - 1):
+            start1, stop1 = offsets1[iev], offsets1[iev + 1]
+            for k in range(offsets2.shape[0]):
+                start2, stop2 = offsets2[k, iev], offsets2[k, iev + 1]
+                for j in range(start2, stop2):
+                    match_idx[j] = -1
+                if (stop1 == start1) or (stop2 == start2):
+                    continue
+                order2 = np.argsort(eta2[start2:stop2])
+                eta2_sorted = eta2[start2:stop2][order2]
+                rmax = radius1[k, start1]
+                for i in range(start1 + 1, stop1):
+                    rmax = max(rmax, radius1[k, i])
+                rmax += ETA_WINDOW_MARGIN
+                # Loop over the first collection in its original order: with a strict comparison
+                # the first minimum is kept, as `ak.argmin`
+                for i in range(start1, stop1):
+                    lo = np.searchsorted(eta2_sorted, eta1[i] - rmax, side="left")
+                    hi = np.searchsorted(eta2_sorted, eta1[i] + rmax, side="right")
+                    for l in range(lo, hi):
+                        j = start2 + order2[l]
+                        dr = delta_r(eta1[i], phi1[i], eta2[j], phi2[j])
+                        if match_idx[j] < 0 or dr < match_dr[j]:
+                            match_idx[j] = i
+                            match_dr[j] = dr
+                for j in range(start2, stop2):
+                    if match_idx[j] >= 0 and not (match_dr[j] < radius1[k, match_idx[j]]):
+                        match_idx[j] = -1
+
+    return kernel
@@ -0,0 +1,78 @@
+import numpy as np
+import awkward as ak
+
+def with_fields(base, fields, behavior=None):
+    '''Attach all the arrays in the dictionary `fields` to the records of `base`, with the field names as keys.
+    This is equivalent to calling `ak.with_field` once per field, but the record layout is rebuilt only once,
+    instead of once per field. Existing fields with the same name are replaced.
+    If `base` is a jagged collection (e.g. events.FatJetGood) and the fields are either jagged arrays with the
+    same counts, per-event arrays without missing values or scalars, the record layout is built directly
+    from the flat buffers with the `ak.layout` classes of awkward 1. Otherwise `ak.with_field` is called once per field.
+    Only the public API of awkward is used.
+    '''
+    if len(fields) == 0:
+        return base
+    if behavior is None:
+        behavior = base.behavior
+    layout = ak.to_layout(base, allow_record=True, allow_other=False)
+    what = {name : ak.to_layout(value, allow_record=True, allow_other=True) for name, value in fields.items()}
+
+    out = _with_fields_jagged(layout, what)
+    if out is None:
+        for name, value in fields.items():
+            base = ak.with_field(base, value, name)
+        return ak.Array(base, behavior=behavior) if behavior is not None else base
+    return ak.Array(out, behavior=behavior)
+
+def _with_fields_jagged(base, what):
+    '''Builds the records of the jagged collection `base` with the fields in `what` from the flat buffers.
+    Returns None if the layouts are not supported.'''
+    base = _project(base)
+    if not isinstance(base, (ak.layout.ListOffsetArray32, ak.layout.ListOffsetArrayU32, ak.layout.ListOffsetArray64,
+                             ak.layout.ListArray32, ak.layout.ListArrayU32, ak.layout.ListArray64)):
+        return None
+    base = base.toListOffsetArray64(True)
+    records = _project(base.content)
+    if not isinstance(records, ak.layout.RecordArray) or records.istuple:
+        return None
+    offsets = np.asarray(base.offsets)
+    counts = np.diff(offsets)
+
+    contents = []
+    unmasked = False
+    for value in what.values():
+        if not isinstance(value, ak.layout.Content):
+            contents.append(ak.layout.NumpyArray(np.repeat(value, len(records))))
+            continue
+        value = _project(value)
+        if isinstance(value, (ak.layout.ListOffsetArray32, ak.layout.ListOffsetArrayU32, ak.layout.ListOffsetArray64,
+                                ak.layout.ListArray32, ak.layout.ListArrayU32, ak.layout.ListArray64)):
+            value = value.toListOffsetArray64(True)
+            if not np.array_equal(np.asarray(value.offsets), offsets):
+                return None
+            contents.append(value.content)
+        elif isinstance(value, ak.layout.NumpyArray) and value.ndim == 1 and len(value) == len(counts):
+            # Per-event values are repeated for all the objects of the event
+            contents.append(ak.layout.NumpyArray(np.repeat(np.asarray(value), counts)))
+        elif (isinstance(value, ak.layout.UnmaskedArray) and isinstance(value.content, ak.layout.NumpyArray)
+              and value.content.ndim == 1 and len(value) == len(counts)):
+            # Option type without missing values (e.g. from `ak.firsts`): as in `ak.with_field`,
+            # the option type is moved to the lists of objects
+            contents.append(ak.layout.NumpyArray(np.repeat(np.asarray(value.content), counts)))
+            unmasked = True
+        else:
+            return None
+
+    keys = [key for key in records.keys() if key not in what]
+    records = ak.layout.RecordArray(
+        [records.field(key) for key in keys] + contents, keys + list(what.keys()), len(records), parameters=records.parameters
+    )
+    out = ak.layout.ListOffsetArray64(base.offsets, records, parameters=base.parameters)
+    return ak.layout.UnmaskedArray(out) if unmasked else out
+
+def _project(layout):
+    '''Materializes the virtual arrays and applies the index of the indexed arrays (e.g. from an event selection)
+    at the outermost level of `layout`.'''
+    while isinstance(layout, (ak.layout.VirtualArray, ak.layout.IndexedArray32, ak.layout.IndexedArrayU32, ak.layout.IndexedArray64)):
+        layout = layout.array if isinstance(layout, ak.layout.VirtualArray) else layout.project()
+    return layout
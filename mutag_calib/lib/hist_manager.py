@@ -0,0 +1,51 @@
+import hist
+
+from pocket_coffea.lib.hist_manager import HistManager
+
+class VariedWeight:
+    '''Custom weight of a histogram (see the `custom_weight` argument of `HistManager.fill_histograms`)
+    with variations, as {variation: weight}. The `nominal` weight is used for the variations without a varied weight.
+    The `name` identifies the weight in the weights cache of the HistManager.'''
+
+    def __init__(self, name, weights):
+        if not "nominal" in weights:
+            raise Exception(f"The custom weight '{name}' does not contain the nominal weight.")
+        self.name = name
+        self.weights = weights
+
+    def get(self, variation):
+        return self.weights.get(variation, self.weights["nominal"])
+
+class ReweightingHistManager(HistManager):
+    '''HistManager filling the variations of the custom weights of the histograms in the nominal pass.
+    The `weight_variations` are added to the variation axis of the `weighted_histograms`, for the MC samples,
+    and are filled as the variations of the weights of the WeightsManager: with the nominal weights of the events
+    times the varied custom weight of the histogram, passed as a `VariedWeight` in the `custom_weight` of `fill_histograms`.
+    The masking and broadcasting of the data and weights, and the collapsing of the 2D masks, are the ones of the HistManager.'''
+
+    def __init__(self, *args, weight_variations=None, weighted_histograms=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.weight_variations = list(weight_variations or [])
+        if not (self.isMC and self.weight_variations):
+            return
+        for subsample, histograms in self.histograms.items():
+            for name in weighted_histograms or []:
+                histo = histograms.get(name, None)
+                if histo is None or histo.no_weights or not histo.variations:
+                    continue
+                axes = [
+                    hist.axis.StrCategory(sorted(set(ax) | set(self.weight_variations)), name="variation", label="Variation", growth=False)
+                    if ax.name == "variation" else ax
+                    for ax in histo.hist_obj.axes
+                ]
+                histo.hist_obj = hist.Hist(*axes, storage=histo.storage, name="Counts")
+                histo.only_variations = list(histo.hist_obj.axes["variation"])
+
+    def mask_and_broadcast_weight(self, category, subsample, variation, weight, mask, data_structure):
+        # The varied custom weights are cached by their name, since the HistManager caches all the custom weights
+        # of a category under the same key
+        if isinstance(weight, VariedWeight):
+            return super().mask_and_broadcast_weight(
+                f"{category}_{weight.name}", subsample, variation, weight.get(variation), mask, data_structure
+            )
+        return super().mask_and_broadcast_weight(category, subsample, variation, weight, mask, data_structure)
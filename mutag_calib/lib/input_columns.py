@@ -0,0 +1,107 @@
+import awkward as ak
+
+from pocket_coffea.lib.categorization import CartesianSelection
+
+# Top-level NanoAOD fields read by the weights of PocketCoffea used in the mutag configs, by weight name
+WEIGHTS_INPUT_COLUMNS = {
+    "genWeight" : ["genWeight", "skimRescaleGenWeight"],
+    "signOf_genWeight" : ["genWeight"],
+    "lumi" : [],
+    "XS" : [],
+    "pileup" : ["Pileup"],
+    "sf_partonshower_isr" : ["PSWeight"],
+    "sf_partonshower_fsr" : ["PSWeight"],
+    "sf_trigger_prescale" : ["HLT"],
+    "sf_trigger_prescale_runlumi" : ["HLT", "run", "luminosityBlock"],
+    "sf_ptetatau21_reweighting" : [],
+}
+
+# Top-level NanoAOD fields read by the calibrators of PocketCoffea used in the mutag configs, by calibrator name.
+# The jet collections calibrated by the jet calibrators are read from the `jets_calibration` parameters
+# (see `get_calibrated_jet_collections`), together with the generator-level jets they are matched to.
+CALIBRATORS_INPUT_COLUMNS = {
+    "jet_calibration" : ["Rho", "fixedGridRhoFastjetAll", "GenJet", "GenJetAK8", "run", "event"],
+    "msoftdrop_calibration" : ["Rho", "fixedGridRhoFastjetAll", "SubGenJetAK8", "run", "event"],
+}
+# Calibrators calibrating the jet collections listed in the `jets_calibration.collection` parameters
+JET_CALIBRATORS = ["jet_calibration", "msoftdrop_calibration"]
+
+# Top-level NanoAOD fields read by `BaseProcessorABC.process` for the MC samples, independently of the weights
+PROCESSOR_INPUT_COLUMNS = ["genWeight"]
+
+def get_input_columns(cfg, workflow_columns):
+    '''Returns the set of top-level NanoAOD fields (collections or branches) that can be read by a workflow.
+    The set contains the `workflow_columns` declared by the workflow, the fields read by the weights and calibrators
+    of the config and the collections used in the cuts and in the histograms (see `get_config_collections`).
+    The collections that are not in the NanoAOD (e.g. the ones defined by the workflow) are ignored
+    by `restrict_input_columns`, therefore all the collections referenced in the config are included.
+    Additional fields can be declared with the `input_columns` entry of the `workflow_options`.
+    '''
+    columns = set(workflow_columns)
+    columns.update(cfg.workflow_options.get("input_columns", []))
+    # The fields missing in the data (e.g. genWeight) are ignored by `restrict_input_columns`
+    columns.update(PROCESSOR_INPUT_COLUMNS)
+
+    for weight in cfg.requested_weights:
+        if weight not in WEIGHTS_INPUT_COLUMNS:
+            raise Exception(f"The input columns of the weight '{weight}' are unknown. Please add them to `WEIGHTS_INPUT_COLUMNS` in `mutag_calib/lib/input_columns.py`.")
+        columns.update(WEIGHTS_INPUT_COLUMNS[weight])
+    for calibrator in cfg.calibrators:
+        if calibrator.name not in CALIBRATORS_INPUT_COLUMNS:
+            raise Exception(f"The input columns of the calibrator '{calibrator.name}' are unknown. Please add them to `CALIBRATORS_INPUT_COLUMNS` in `mutag_calib/lib/input_columns.py`.")
+        columns.update(CALIBRATORS_INPUT_COLUMNS[calibrator.name])
+        if calibrator.name in JET_CALIBRATORS:
+            columns.update(get_calibrated_jet_collections(cfg))
+
+    columns.update(get_config_collections(cfg))
+    return columns
+
+def get_calibrated_jet_collections(cfg):
+    '''Returns the set of the jet collections that can be calibrated by the jet calibrators in the years of the config,
+    from the `jets_calibration.collection` parameters. The parameters of the config are merged with the defaults
+    of PocketCoffea, therefore they can include collections (e.g. AK4 jets) that are not calibrated in the config.'''
+    collections = set()
+    for year in cfg.years:
+        collections.update(cfg.parameters.jets_calibration.collection.get(year, {}).values())
+    return collections
+
+def get_config_cuts(cfg):
+    '''Returns the list of the Cut objects of the skim, preselections and categories of the config.'''
+    return cfg.skim + cfg.preselections + get_category_cuts(cfg.categories)
+
+def get_config_collections(cfg):
+    '''Returns the set of the collections used in the cuts and in the histograms of the config.
+    For the histograms of event-level quantities (coll="events"), the name of the field is returned.'''
+    collections = set()
+    for cut in get_config_cuts(cfg):
+        collections.add(cut.collection)
+        if cut.params and "coll" in cut.params:
+            collections.add(cut.params["coll"])
+    for coll, field in get_histogram_fields(cfg):
+        collections.add(field if coll == "events" else coll)
+    return collections
+
+def get_histogram_fields(cfg):
+    '''Returns the set of the (collection, field) pairs filled in the histograms of the config.'''
+    return {(axis.coll, axis.field) for histconf in cfg.variables.values() for axis in histconf.axes}
+
+def get_category_cuts(categories):
+    '''Returns the list of the Cut objects used to define the categories.'''
+    if isinstance(categories, CartesianSelection):
+        cuts = [cut for multicut in categories.multicuts for cut in multicut.cuts]
+        if categories.has_common_cats:
+            cuts += get_category_cuts(categories.common_cats)
+        return cuts
+    return list(categories.cut_functions)
+
+def restrict_input_columns(events, columns):
+    '''Returns a view of the NanoEvents `events` containing only the top-level fields in `columns`.
+    The view keeps the lazy loading, the metadata and the behaviors of the original events,
+    while accessing a field that is not in `columns` raises an AttributeError (or a ValueError with `events[field]`).
+    '''
+    layout = events.layout.array if isinstance(events.layout, ak.layout.VirtualArray) else events.layout
+    fields = [field for field in layout.keys() if field in columns]
+    return ak.Array(
+        ak.layout.RecordArray([layout.field(field) for field in fields], fields, len(layout), parameters=layout.parameters),
+        behavior=events.behavior,
+    )
@@ -1,13 +1,16 @@
+import numba
+import numpy as np
 import awkward as ak
-from .deltar_matching import run_deltar_matching
+from .deltar_matching import run_deltar_matching, build_delta_r
 
-def muons_matched_to_fatjet(events):
+def muons_matched_to_fatjet(events, backend="numba"):
     '''This function returns the collection of muons matched to the fatjets.
     The output array has the same shape as the events.FatJetGood collection.
+    The `backend` argument is passed to `run_deltar_matching`.
     '''
-    return run_deltar_matching(events.FatJetGood, events.MuonGood, radius=0.8)
+    return run_deltar_matching(events.FatJetGood, events.MuonGood, radius=0.8, backend=backend)
 
-def muon_matched_to_subjet(events, pos, unique=True):
+def muon_matched_to_subjet(events, pos, unique=True, backend="numba"):
     '''This function returns the collection of muons matched to the subjet in the position `pos` contained in the AK8 jet.
     If pos=0, the muons matched to the leading subjet are returned.
     If pos=1, the muons matched to the leading subjet are returned.
@@ -25,8 +28,103 @@ def muon_matched_to_subjet(events, pos, unique=True):
         radius = R
 
     # This collection of muons will contain all the muons contained within the dR cone
-    muons_matched = run_deltar_matching(sj, events.MuonGood, radius=radius)
+    muons_matched = run_deltar_matching(sj, events.MuonGood, radius=radius, backend=backend)
 
     # Of all the muons contained in the dR cone, we only consider the leading muon to be matched to the subjet
     # N.B.: the slicing syntax `[:,:,None]` is needed in order for the output array to have a 3 dimensions
     return ak.firsts(muons_matched, axis=2)[:,:,None]
+
+def muons_matched_to_subjets(events, R=0.4):
+    '''This function matches the muons to the leading and subleading subjets of the AK8 jets in a single pass,
+    both with fixed cones of radius R and with unique (non-overlapping) cones of radius min(R, dR(sj1, sj2)/2).
+    It returns the tuple (muons_matched, muons_matched_uniquely): each array has the same shape as the
+    events.FatJetGood collection, with 2 entries per jet containing the muon matched to the leading and
+    subleading subjet (None if no muon is matched).
+    The output is the same as concatenating the outputs of `muon_matched_to_subjet` for pos=0 and pos=1.
+    Subjets that are missing are not matched: a jet needs two subjets to define the unique cones.
+    '''
+    fatjets = events.FatJetGood
+    muons = events.MuonGood
+    njet = ak.to_numpy(ak.num(fatjets, axis=1))
+    offsets_jet = np.zeros(len(njet) + 1, dtype=np.int64)
+    np.cumsum(njet, out=offsets_jet[1:])
+    nsubjet = ak.to_numpy(ak.flatten(ak.num(fatjets.subjets, axis=2)))
+    offsets_sj = np.zeros(len(nsubjet) + 1, dtype=np.int64)
+    np.cumsum(nsubjet, out=offsets_sj[1:])
+    nmuon = ak.to_numpy(ak.num(muons, axis=1))
+    offsets_mu = np.zeros(len(nmuon) + 1, dtype=np.int64)
+    np.cumsum(nmuon, out=offsets_mu[1:])
+    sj_eta = ak.to_numpy(ak.flatten(fatjets.subjets.eta, axis=None))
+    sj_phi = ak.to_numpy(ak.flatten(fatjets.subjets.phi, axis=None))
+    mu_eta = ak.to_numpy(ak.flatten(muons.eta))
+    mu_phi = ak.to_numpy(ak.flatten(muons.phi))
+    dtype = np.result_type(sj_eta, sj_phi, mu_eta, mu_phi)
+
+    # Index of the muon matched to each (jet, subjet) pair, for the fixed (0) and unique (1) cones
+    match_idx = np.full((2, len(nsubjet), 2), -1, dtype=np.int64)
+    match_dr = np.zeros((2, len(nsubjet), 2), dtype=dtype)
+    _get_subjet_matching_kernel(dtype)(
+        offsets_jet, offsets_sj, sj_eta, sj_phi, offsets_mu, mu_eta, mu_phi, R, match_idx, match_dr
+    )
+
+    muons_flat = ak.flatten(muons)
+    output = []
+    for unique in [0, 1]:
+        idx = match_idx[unique].flatten()
+        matched = muons_flat[ak.mask(idx, idx >= 0)]
+        matched['dR'] = match_dr[unique].flatten()
+        output.append(ak.unflatten(ak.unflatten(matched, np.full(len(nsubjet), 2)), njet))
+    return tuple(output)
+
+_subjet_matching_kernels = {}
+
+def _get_subjet_matching_kernel(dtype):
+    '''Returns the subjet matching kernel compiled for the floating point type `dtype`.'''
+    dtype = np.dtype(dtype)
+    if dtype not in _subjet_matching_kernels:
+        _subjet_matching_kernels[dtype] = _build_subjet_matching_kernel(dtype.type)
+    return _subjet_matching_kernels[dtype]
+
+def _build_subjet_matching_kernel(ftype):
+    delta_r = build_delta_r(ftype)
+
+    @numba.njit
+    def kernel(offsets_jet, offsets_sj, sj_eta, sj_phi, offsets_mu, mu_eta, mu_phi, R, match_idx, match_dr):
+        '''For each subjet position, each muon is assigned to the closest subjet in that position among the jets
+        of the event. The first muon assigned to a subjet within the cone is stored in `match_idx`.
+        The radius comparisons reproduce the type promotion of `muon_matched_to_subjet`:
+        the fixed cone is compared in the dR precision, the unique cone in double precision.'''
+        R_fixed = ftype(R)
+        for iev in range(len(offsets_jet) - 1):
+            for pos in range(2):
+                for j in range(offsets_mu[iev], offsets_mu[iev + 1]):
+                    best = -1
+                    best_dr = ftype(0)
+                    for i in range(offsets_jet[iev], offsets_jet[iev + 1]):
+                        if offsets_sj[i + 1] - offsets_sj[i] <= pos:
+                            continue
+                        isj = offsets_sj[i] + pos
+                        dr = delta_r(sj_eta[isj], sj_phi[isj], mu_eta[j], mu_phi[j])
+                        if best < 0 or dr < best_dr:
+                            best = i
+                            best_dr = dr
+                    if best < 0:
+                        continue
+                    # Fixed cone
+                    if best_dr < R_fixed and match_idx[0, best, pos] < 0:
+                        match_idx[0, best, pos] = j
+                        match_dr[0, best, pos] = best_dr
+                    # Unique cone, defined only for jets with two subjets
+                    isj = offsets_sj[best]
+                    if offsets_sj[best + 1] - isj < 2:
+                        continue
+                    dr_non_overlapping_cone = ftype(0.5) * delta_r(sj_eta[isj], sj_phi[isj], sj_eta[isj + 1], sj_phi[isj + 1])
+                    if dr_non_overlapping_cone > R_fixed:
+                        radius = np.float64(R)
+                    else:
+                        radius = np.float64(dr_non_overlapping_cone)
+                    if best_dr < radius and match_idx[1, best, pos] < 0:
+                        match_idx[1, best, pos] = j
+                        match_dr[1, best, pos] = best_dr
+
+    return kernel
@@ -0,0 +1,202 @@
+import os
+import importlib
+import yaml
+import numpy as np
+import pandas as pd
+
+from mutag_calib.lib.corrections import file_checksum
+from mutag_calib.lib.prescales import compile_prescale_file, LUMI_RANGE
+
+# Tables of the prescales of the HLT paths used by the prescale scripts (`mutag_calib/scripts`).
+# The evaluation of the prescales in the processing is in `mutag_calib.lib.prescales`, which does not depend on pandas.
+
+# Default directory of the cache of the prescale tables (Parquet, or npz if no Parquet engine is installed)
+PRESCALE_TABLE_CACHE = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "mutag_calib", "prescales")
+# Columns of the prescale tables
+PRESCALE_TABLE_COLUMNS = ["run", "hlt_path", "lumi_start", "lumi_end", "weight"]
+
+def prescale_table_from_file(path):
+    '''Returns the columnar prescale table of the correctionlib prescale JSON `path`, as a DataFrame
+    with one row per lumisection range of each run and HLT path (see `PRESCALE_TABLE_COLUMNS`).
+    The constant prescales of a run are in the range [1, inf).'''
+    tables = []
+    for hlt_path, lookup in compile_prescale_file(path).items():
+        tables.append(pd.DataFrame({
+            "run" : np.repeat(lookup.runs, np.diff(lookup.offsets)),
+            "hlt_path" : hlt_path,
+            "lumi_start" : lookup.lumi_lower,
+            "lumi_end" : lookup.lumi_upper,
+            "weight" : lookup.prescales,
+        }))
+    return pd.concat(tables, ignore_index=True)
+
+def get_parquet_engine():
+    '''Returns the name of a Parquet engine of pandas that can be imported ("pyarrow" or "fastparquet"), or None.
+    The engines are optional dependencies: without them the prescale tables are cached as npz files.'''
+    for engine in ["pyarrow", "fastparquet"]:
+        try:
+            importlib.import_module(engine)
+            return engine
+        except ImportError:
+            continue
+    return None
+
+def write_prescale_table(table, cache_file, engine):
+    '''Save the prescale table in `cache_file`, as Parquet with the `engine` or as npz if `engine` is None.
+    The table is written to a temporary file first, so that concurrent processes never read a partial file.'''
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    if engine is not None:
+        table.to_parquet(tmp_file, index=False, engine=engine)
+    else:
+        with open(tmp_file, "wb") as f:
+            np.savez(f, **{column : table[column].to_numpy(dtype=str if column == "hlt_path" else None) for column in PRESCALE_TABLE_COLUMNS})
+    os.replace(tmp_file, cache_file)
+
+def read_prescale_table(cache_file, engine):
+    '''Returns the prescale table saved in `cache_file` by `write_prescale_table`.'''
+    if engine is not None:
+        return pd.read_parquet(cache_file, engine=engine)
+    with np.load(cache_file) as data:
+        return pd.DataFrame({column : data[column] for column in PRESCALE_TABLE_COLUMNS})
+
+def get_prescale_table(path, cache_dir=PRESCALE_TABLE_CACHE):
+    '''Returns the prescale table of the prescale JSON `path` (see `prescale_table_from_file`).
+    The table is saved in `cache_dir`, keyed by the checksum of the JSON file, so that each JSON file is parsed only once:
+    as Parquet if a Parquet engine is installed, otherwise as npz. The cache is disabled if `cache_dir` is None.'''
+    if cache_dir is None:
+        return prescale_table_from_file(path)
+    engine = get_parquet_engine()
+    name = os.path.splitext(os.path.basename(path))[0]
+    cache_file = os.path.join(cache_dir, f"{name}_{file_checksum(path)[:16]}.{'parquet' if engine else 'npz'}")
+    if os.path.exists(cache_file):
+        return read_prescale_table(cache_file, engine)
+    table = prescale_table_from_file(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    write_prescale_table(table, cache_file, engine)
+    return table
+
+def get_prescale_tables(prescale_files, years=None, trigger_groups=None, unique_files=False, cache_dir=PRESCALE_TABLE_CACHE):
+    '''Returns the prescale table of all the JSON files in `prescale_files`, a dictionary year -> trigger group ->
+    trigger name -> JSON file (see `read_prescale_files`), with the year, trigger group, trigger name and JSON file
+    of each row as additional columns. The years and trigger groups can be restricted with `years` and `trigger_groups`.
+    If `unique_files` is True, each JSON file is included only once, for the first year and trigger group using it.'''
+    tables = []
+    included = set()
+    for year, year_data in prescale_files.items():
+        if years and year not in years:
+            continue
+        for trigger_group, triggers in year_data.items():
+            if trigger_groups and trigger_group not in trigger_groups:
+                continue
+            for trigger_name, path in triggers.items():
+                if not os.path.exists(path):
+                    print(f"Warning: JSON file not found: {path}")
+                    continue
+                if unique_files and path in included:
+                    continue
+                included.add(path)
+                tables.append(get_prescale_table(path, cache_dir).assign(
+                    year=year, trigger_group=trigger_group, trigger_name=trigger_name, json_file=os.path.basename(path)
+                ))
+    if not tables:
+        return pd.DataFrame(columns=PRESCALE_TABLE_COLUMNS + ["year", "trigger_group", "trigger_name", "json_file"])
+    return pd.concat(tables, ignore_index=True)
+
+def read_prescale_files(config_path, key="HLT_triggers_prescales_runlumi"):
+    '''Returns the dictionary year -> trigger group -> trigger name -> prescale JSON file of the entry `key`
+    of the YAML config `config_path`, with the `${config_dir:}` placeholders replaced by the folder of the config.
+    If `key` is not in the config, the `HLT_triggers_prescales` entry is read.'''
+    with open(config_path) as f:
+        config = yaml.safe_load(f)
+    config_dir = os.path.dirname(os.path.abspath(config_path))
+    prescale_files = config.get(key, config.get("HLT_triggers_prescales", {}))
+    return {
+        year : {
+            trigger_group : {
+                trigger_name : path.replace("${config_dir:}", config_dir)
+                for trigger_name, path in triggers.items() if isinstance(path, str)
+            }
+            for trigger_group, triggers in year_data.items()
+        }
+        for year, year_data in prescale_files.items()
+    }
+
+def read_run_ranges(config_path, key="HLT_triggers_prescales_run_ranges"):
+    '''Returns the dictionary year -> (first run, last run) of the entry `key` of the YAML config `config_path`,
+    or an empty dictionary if `key` is not in the config.'''
+    with open(config_path) as f:
+        config = yaml.safe_load(f)
+    return {year : (int(first), int(last)) for year, (first, last) in config.get(key, {}).items()}
+
+def restrict_to_run_ranges(table, run_ranges):
+    '''Returns the rows of the prescale `table` (see `get_prescale_tables`) in the run range of their year,
+    given as a dictionary year -> (first run, last run). The rows of the years without a run range are kept.'''
+    first = table["year"].map({year : r[0] for year, r in run_ranges.items()})
+    last = table["year"].map({year : r[1] for year, r in run_ranges.items()})
+    in_range = first.isna() | ((table["run"] >= first) & (table["run"] <= last))
+    return table[in_range.to_numpy(dtype=bool)].reset_index(drop=True)
+
+def read_lumi_csv(path):
+    '''Returns the recorded luminosity of each lumisection in the CSV file `path`, as a DataFrame with the columns
+    run, lumi and recorded. The file is either the output of `brilcalc lumi --byls -o <file>.csv`
+    (header `#run:fill,ls,...,recorded(/ub),...`) or a CSV file with the columns run, ls and recorded.
+    The unit of the recorded luminosity is the one of the file.'''
+    with open(path) as f:
+        header = next((line for line in f if line.lstrip("#").startswith("run")), None)
+    if header is None:
+        raise Exception(f"The header with the run, ls and recorded columns is missing in {path}.")
+    # The header of brilcalc is a comment, like the summary at the end of the file
+    names = header.lstrip("#").strip().split(",")
+    df = pd.read_csv(path, comment="#", names=names, header=None if header.startswith("#") else 0)
+    recorded = [column for column in names if column.startswith("recorded")]
+    if "ls" not in names or not recorded:
+        raise Exception(f"The run, ls and recorded columns are missing in {path}.")
+    # brilcalc saves the run as run:fill and the lumisection as ls:cms_ls
+    return pd.DataFrame({
+        "run" : df[names[0]].astype(str).str.split(":").str[0].astype(np.int64),
+        "lumi" : df["ls"].astype(str).str.split(":").str[0].astype(np.int64),
+        "recorded" : df[recorded[0]].astype(np.float64),
+    })
+
+def luminosity_weighted_prescales(table, lumi):
+    '''Returns the effective prescale of each year, trigger group and HLT path of the prescale `table`
+    (see `get_prescale_tables`), weighted by the recorded luminosity of the lumisections in `lumi`
+    (DataFrame with the columns year, run, lumi and recorded, see `read_lumi_csv`).
+    The effective prescale is the ratio of the recorded luminosity and of the luminosity recorded by the path,
+    sum(L) / sum(L / prescale): the MC scaled by its inverse has the yield of the prescaled data.
+    The lumisections with a zero prescale, where the path is disabled, only contribute to sum(L).
+    The lumisections are joined to the lumisection ranges of the table with a single `np.searchsorted`
+    over all the years and paths, with the same clamped overflow as `PrescaleLookup`.
+    The lumisections of runs missing in the table of a path are excluded from its average, with a warning.
+    Returns a DataFrame indexed by year, trigger group and HLT path, with the columns
+    recorded, recorded_path (luminosity recorded by the path) and prescale.'''
+    paths = ["year", "trigger_group", "hlt_path"]
+    table = table.sort_values(paths + ["run", "lumi_start"], ignore_index=True)
+    # Index of the table rows of each run of each path
+    runs = table.groupby(paths + ["run"], sort=False).size().rename("nbins").reset_index()
+    runs["first"] = np.concatenate([[0], np.cumsum(runs["nbins"].to_numpy())[:-1]])
+    runs["index"] = np.arange(len(runs))
+    run_index = np.repeat(runs["index"].to_numpy(), runs["nbins"].to_numpy())
+    keys = run_index * LUMI_RANGE + np.clip(table["lumi_start"].to_numpy(), 0, LUMI_RANGE - 1)
+
+    # Each lumisection is matched to the runs of all the paths of its year
+    paths_by_year = table[paths].drop_duplicates()
+    joined = lumi.merge(paths_by_year, on="year").merge(runs, on=paths + ["run"], how="left")
+    missing = joined["index"].isna()
+    if missing.any():
+        for (year, trigger_group, hlt_path), excluded in joined[missing].groupby(paths)["recorded"].sum().items():
+            print(f"Warning: {excluded:g} of recorded luminosity of {year} in runs missing in the prescale table of {trigger_group}/{hlt_path} is excluded.")
+        joined = joined[~missing]
+    index = joined["index"].to_numpy(dtype=np.int64)
+    first = joined["first"].to_numpy(dtype=np.int64)
+    bins = np.searchsorted(keys, index * LUMI_RANGE + np.clip(joined["lumi"].to_numpy(np.float64), 0, LUMI_RANGE - 1), side="right") - 1
+    bins = np.clip(bins, first, first + joined["nbins"].to_numpy(dtype=np.int64) - 1)
+    prescale = table["weight"].to_numpy()[bins]
+
+    recorded = joined["recorded"].to_numpy()
+    recorded_path = np.divide(recorded, prescale, out=np.zeros_like(recorded), where=prescale > 0)
+    result = pd.DataFrame({"recorded" : recorded, "recorded_path" : recorded_path}, index=joined.index) \
+               .join(joined[paths]).groupby(paths).sum()
+    result["prescale"] = np.divide(result["recorded"].to_numpy(), result["recorded_path"].to_numpy(),
+                                   out=np.full(len(result), np.inf), where=result["recorded_path"].to_numpy() > 0)
+    return result
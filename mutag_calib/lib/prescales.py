@@ -0,0 +1,107 @@
+import json
+import numpy as np
+import awkward as ak
+
+from mutag_calib.lib.corrections import get_cached
+
+# Handling of the events of runs missing in the prescale table of an HLT path (see `PrescaleLookup.evaluate`)
+MISSING_RUNS_OPTIONS = ["raise", "disabled"]
+
+# Offset between the runs in the sorted keys of the lumisection bins, larger than any lumisection number
+LUMI_RANGE = 2.**32
+
+class PrescaleLookup:
+    '''Prescale of an HLT path by run and lumisection, compiled from a correctionlib prescale JSON
+    (`configs/params/prescales`) into sorted arrays: the runs, the index of the first lumisection bin of each run,
+    the lower and upper edges of the lumisection bins and their prescales.
+    The bins are found with a single `np.searchsorted` over the whole chunk, with the same clamped overflow
+    as the correctionlib binning (the lumisections below the first edge are in the first bin of the run).
+    '''
+
+    def __init__(self, runs, offsets, lumi_lower, lumi_upper, prescales):
+        self.runs = np.asarray(runs, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lumi_lower = np.asarray(lumi_lower, dtype=np.float64)
+        self.lumi_upper = np.asarray(lumi_upper, dtype=np.float64)
+        self.prescales = np.asarray(prescales, dtype=np.float64)
+        # Sorted keys of the bins: the lumisection edges are shifted by the index of the run
+        run_index = np.repeat(np.arange(len(self.runs)), np.diff(self.offsets))
+        self._keys = run_index * LUMI_RANGE + np.clip(self.lumi_lower, 0, LUMI_RANGE - 1)
+
+    def evaluate(self, run, lumi, missing_runs="raise"):
+        '''Returns the prescales of the events with the given `run` and `lumi` numpy arrays.
+        The events of runs that are not in the prescale table are handled according to `missing_runs`:
+          - "raise": an exception listing the missing runs is raised
+          - "disabled": the path is considered disabled in these runs, with a prescale of 0
+        '''
+        if missing_runs not in MISSING_RUNS_OPTIONS:
+            raise Exception(f"Unknown option missing_runs='{missing_runs}'. Available options: {MISSING_RUNS_OPTIONS}.")
+        run = np.asarray(run, dtype=np.int64)
+        index = np.minimum(np.searchsorted(self.runs, run), len(self.runs) - 1)
+        missing = self.runs[index] != run
+        if np.any(missing) and missing_runs == "raise":
+            raise Exception(f"The runs {np.unique(run[missing]).tolist()} are not in the prescale table.")
+        keys = index * LUMI_RANGE + np.clip(np.asarray(lumi, dtype=np.float64), 0, LUMI_RANGE - 1)
+        bins = np.searchsorted(self._keys, keys, side="right") - 1
+        bins = np.clip(bins, self.offsets[index], self.offsets[index + 1] - 1)
+        return np.where(missing, 0., self.prescales[bins])
+
+def compile_prescale_file(path):
+    '''Returns a dictionary with the PrescaleLookup of each HLT path in the correctionlib prescale JSON `path`.'''
+    with open(path) as f:
+        data = json.load(f)
+    correction = next(c for c in data["corrections"] if c["name"] == "prescaleWeight")
+    tables = {}
+    for run_entry in correction["data"]["content"]:
+        for path_entry in run_entry["value"]["content"]:
+            runs, offsets, lumi_lower, lumi_upper, prescales = tables.setdefault(path_entry["key"], ([], [0], [], [], []))
+            value = path_entry["value"]
+            if isinstance(value, dict):
+                if value["nodetype"] != "binning" or value["flow"] != "clamp":
+                    raise Exception(f"The prescales of {path_entry['key']} in {path} must be a binning with clamped overflow.")
+                lumi_lower.extend(float(edge) for edge in value["edges"][:-1])
+                lumi_upper.extend(float(edge) for edge in value["edges"][1:])
+                prescales.extend(value["content"])
+            else:
+                # Constant prescale for the whole run
+                lumi_lower.append(1.)
+                lumi_upper.append(np.inf)
+                prescales.append(value)
+            runs.append(run_entry["key"])
+            offsets.append(len(prescales))
+    for hlt_path, (runs, offsets, lumi_lower, lumi_upper, prescales) in tables.items():
+        order = np.argsort(runs, kind="stable")
+        if not np.array_equal(order, np.arange(len(runs))):
+            raise Exception(f"The runs of {hlt_path} in {path} must be sorted.")
+        tables[hlt_path] = PrescaleLookup(runs, offsets, lumi_lower, lumi_upper, prescales)
+    return tables
+
+def get_prescale_lookups(path):
+    '''Returns the PrescaleLookup objects of the HLT paths in the prescale JSON `path`,
+    compiled once per process and cached with the correctionlib files (see `mutag_calib.lib.corrections`).'''
+    return get_cached(path, compile_prescale_file)
+
+def get_prescales(events, files, missing_runs="raise"):
+    '''Returns the effective prescale of the `events`, given the prescale JSON `files` of the HLT paths
+    (dictionary with the names of the HLT paths, without the "HLT_" prefix, as keys).
+    The prescale of an event is the lowest non-zero prescale of the paths fired by the event, in its run
+    and lumisection: the event is recorded by the least prescaled of the fired paths.
+    The prescale is 1 for the events without fired paths with a non-zero prescale.
+    Only the events firing a path are looked up in the prescale table of the path.
+    If a fired path has no prescales for the run of the event, an exception is raised (`missing_runs="raise"`),
+    or the path is considered disabled in that run (`missing_runs="disabled"`), as in `luminosity_weighted_prescales`
+    (`mutag_calib.lib.prescale_tables`),
+    which excludes these runs from the average prescale of the path.'''
+    run = ak.to_numpy(events.run)
+    lumi = ak.to_numpy(events.luminosityBlock)
+    prescale = np.full(len(run), np.inf)
+    for trigger, path in files.items():
+        lookup = get_prescale_lookups(path)[f"HLT_{trigger}"]
+        fired = np.nonzero(ak.to_numpy(events.HLT[trigger]))[0]
+        try:
+            ps = lookup.evaluate(run[fired], lumi[fired], missing_runs=missing_runs)
+        except Exception as e:
+            raise Exception(f"Cannot evaluate the prescale of HLT_{trigger} from {path}: {e}")
+        prescale[fired] = np.where(ps > 0, np.minimum(prescale[fired], ps), prescale[fired])
+    prescale[np.isinf(prescale)] = 1.
+    return prescale
@@ -0,0 +1,274 @@
+import gzip
+import json
+import itertools
+import numpy as np
+import correctionlib
+
+from mutag_calib.lib.corrections import get_cached, get_correction_set
+
+class StackedReweighting:
+    '''Evaluation of all the variations of a binned reweighting correction in a single call.
+    The correction is the one saved by `scripts/compute_3d_reweighting.py`: a tree of categories over the
+    string inputs (category, shape variation, variation) and the integer position of the AK8 jet,
+    with a (multi)binning with clamped overflow as leaves.
+    The string inputs are fixed to the values in `fixed`, except the `stacked` one whose values are evaluated together.
+    The bin of each jet is located once and the weights of all the variations are read from the same bin.
+    The structure of the correction is read from its JSON description `correction`, while the content of the bins
+    is taken from the correctionlib `evaluator` of the same correction, so that the weights are identical
+    to the ones of the correctionlib evaluation of each variation.
+    '''
+
+    def __init__(self, correction, evaluator, fixed, stacked="variation"):
+        self.name = correction["name"]
+        node = _resolve(correction["data"], fixed)
+        if node["nodetype"] != "category" or node["input"] != stacked:
+            raise Exception(f"The correction {self.name} has no category node over the input '{stacked}' after fixing the inputs {list(fixed.keys())}.")
+        self.variations = [item["key"] for item in node["content"]]
+        leaves = [_resolve(item["value"], fixed) for item in node["content"]]
+        # Inputs of `evaluate`, in the order of the correction
+        self.inputs = [i["name"] for i in correction["inputs"] if i["name"] not in fixed and i["name"] != stacked]
+
+        # The leaves are either binnings or categories over an integer input (the position of the jet)
+        if leaves[0]["nodetype"] == "category":
+            self.index_input = leaves[0]["input"]
+            keys = [item["key"] for item in leaves[0]["content"]]
+            binnings = {key : _get_binning([_category_value(leaf, key) for leaf in leaves], self.name) for key in keys}
+        else:
+            self.index_input = None
+            binnings = {None : _get_binning(leaves, self.name)}
+
+        # The content of each bin is evaluated at its center, for all the variations
+        inputs = [i["name"] for i in correction["inputs"]]
+        self.binnings = {}
+        for key, (names, edges) in binnings.items():
+            centers = np.meshgrid(*[0.5 * (e[1:] + e[:-1]) for e in edges], indexing="ij")
+            values = {name : c.ravel() for name, c in zip(names, centers)}
+            if self.index_input is not None:
+                values[self.index_input] = np.full(values[names[0]].size, key)
+            content = np.stack([
+                evaluator.evaluate(*[fixed[i] if i in fixed else variation if i == stacked else values[i] for i in inputs])
+                for variation in self.variations
+            ])
+            self.binnings[key] = (names, edges, content)
+
+    def evaluate(self, *values, bin_cache=None, jet_index=None):
+        '''Returns the weights of all the variations, as an array of shape (number of variations, number of jets).
+        The `values` are the flat arrays of the inputs of the correction that are not fixed, in the order of `self.inputs`.
+        The bins of the inputs cached in `bin_cache` (see `BinCache`) are taken from the cache with the index
+        of the jets in the chunk `jet_index`.'''
+        values = {name : np.asarray(value) for name, value in zip(self.inputs, values)}
+        jet_index = None if jet_index is None else np.asarray(jet_index)
+        n = len(next(iter(values.values())))
+        out = np.empty((len(self.variations), n), dtype=np.float64)
+        if self.index_input is None:
+            selections = {None : slice(None)}
+        else:
+            index = values[self.index_input]
+            selections = {key : np.nonzero(index == key)[0] for key in self.binnings}
+            if sum(len(s) for s in selections.values()) != n:
+                raise Exception(f"The values of the input '{self.index_input}' of the correction {self.name} must be in {list(self.binnings.keys())}.")
+        for key, selection in selections.items():
+            inputs, edges, content = self.binnings[key]
+            # Flat index of the bin, with the first input as the slowest running
+            flat = np.zeros(n if self.index_input is None else len(selection), dtype=np.int64)
+            for name, e in zip(inputs, edges):
+                if bin_cache is not None and name in bin_cache.inputs:
+                    bins = bin_cache.find_bin(name, values[name][selection], e, jet_index[selection])
+                else:
+                    bins = _find_bin(values[name][selection], e)
+                flat = flat * (len(e) - 1) + bins
+            out[:, selection] = content[:, flat]
+        return out
+
+class BinCache:
+    '''Cache of the bins of the AK8 jets of a chunk along the axes of the reweighting maps whose inputs
+    do not change between the shape variations (e.g. eta and tau21, which are not changed by the jet calibration).
+    The jets are identified by their index in the chunk, `jet_index`, since the selected jets can be different
+    in each variation: the bins of the jets not seen in the previous variations are computed and added to the cache.
+    The bins are cached for each input and binning, and the cache must be created again for each chunk.'''
+
+    def __init__(self, njets, inputs):
+        self.njets = njets
+        self.inputs = set(inputs)
+        self.bins = {}
+        self.stats = {"hits" : 0, "misses" : 0}
+
+    def find_bin(self, name, values, edges, jet_index):
+        '''Returns the bins of the `values` of the input `name` of the jets `jet_index` in the `edges`,
+        as `_find_bin`, computing only the bins missing in the cache.'''
+        key = (name, edges.tobytes())
+        if key not in self.bins:
+            self.bins[key] = np.full(self.njets, -1, dtype=np.int64)
+        cached = self.bins[key]
+        bins = cached[jet_index]
+        missing = np.nonzero(bins < 0)[0]
+        if len(missing) > 0:
+            bins[missing] = _find_bin(values[missing], edges)
+            cached[jet_index[missing]] = bins[missing]
+        self.stats["misses"] += len(missing)
+        self.stats["hits"] += len(bins) - len(missing)
+        return bins
+
+def position_views(weights, counts, pos, npositions=2):
+    '''Returns the weights of the AK8 jets in each position, as an array of shape
+    (number of variations, `npositions`, number of events), given the stacked `weights` of the jets
+    returned by `StackedReweighting.evaluate`, the number of jets per event `counts` and the flat positions `pos`.
+    The weight is 1 for the events without a jet in the position, and the first jet is taken if several
+    jets have the same position.'''
+    counts = np.asarray(counts)
+    pos = np.asarray(pos)
+    event = np.repeat(np.arange(len(counts)), counts)
+    out = np.ones((weights.shape[0], npositions, len(counts)), dtype=weights.dtype)
+    # The jets are assigned in reverse order, so that the first jet of the event is the last assignment
+    jets = np.nonzero(pos < npositions)[0][::-1]
+    out[:, pos[jets], event[jets]] = weights[:, jets]
+    return out
+
+class DenseReweighting:
+    '''Evaluation of all the variations of a reweighting map in a single call, from the dense npz companion
+    of the correctionlib file written by `write_dense_companion`.
+    The string inputs are fixed to the values in `fixed`, except the `stacked` one whose values are evaluated together.
+    The bins are located with `np.searchsorted` over the edges, with the same clamped overflow as correctionlib,
+    and the integer inputs (the position of the jet) are looked up in the keys of the category.
+    The interface is the same as `StackedReweighting`.
+    '''
+
+    def __init__(self, values, names, types, axes, fixed, stacked="variation"):
+        index = []
+        remaining = []
+        for name, type_, axis in zip(names, types, axes):
+            if name in fixed:
+                if type_ != "string":
+                    raise Exception(f"The input '{name}' of the dense reweighting map is not a string input.")
+                index.append(_category_index(axis, fixed[name], name))
+            else:
+                if type_ == "string" and name != stacked:
+                    raise Exception(f"The string input '{name}' of the dense reweighting map must be fixed.")
+                index.append(slice(None))
+                remaining.append((name, type_, axis))
+        if stacked not in [name for name, _, _ in remaining]:
+            raise Exception(f"The dense reweighting map has no input '{stacked}'.")
+        position = [name for name, _, _ in remaining].index(stacked)
+        values = np.moveaxis(values[tuple(index)], position, 0)
+        self.variations = [str(variation) for variation in remaining[position][2]]
+        self.axes = [(name, type_, axis) for name, type_, axis in remaining if name != stacked]
+        self.inputs = [name for name, _, _ in self.axes]
+        # Keys of the integer categories, sorted for the lookup
+        self.sorted_keys = {name : np.argsort(axis) for name, type_, axis in self.axes if type_ == "int"}
+        self.content = np.ascontiguousarray(values.reshape(len(self.variations), -1), dtype=np.float64)
+
+    def evaluate(self, *values, bin_cache=None, jet_index=None):
+        '''Returns the weights of all the variations, as an array of shape (number of variations, number of jets).
+        The `values` are the flat arrays of the inputs of the map that are not fixed, in the order of `self.inputs`.
+        The bins of the inputs cached in `bin_cache` (see `BinCache`) are taken from the cache with the index
+        of the jets in the chunk `jet_index`.'''
+        flat = 0
+        for (name, type_, axis), value in zip(self.axes, values):
+            value = np.asarray(value)
+            if type_ == "int":
+                order = self.sorted_keys[name]
+                index = np.minimum(np.searchsorted(axis[order], value), len(axis) - 1)
+                if not np.all(axis[order][index] == value):
+                    raise Exception(f"The values of the input '{name}' of the dense reweighting map must be in {list(axis)}.")
+                index = order[index]
+            elif bin_cache is not None and name in bin_cache.inputs:
+                index = bin_cache.find_bin(name, value, axis, jet_index)
+            else:
+                index = _find_bin(value, axis)
+            flat = flat * (len(axis) - (type_ == "real")) + index
+        return self.content[:, flat]
+
+def write_dense_companion(sfhist, correction_file, output):
+    '''Writes in `output` the dense npz companion of the correction built with `correctionlib.convert.from_histogram`
+    from the histogram `sfhist` with clamped overflow, and saved in the JSON file `correction_file`.
+    The npz file contains the dense array of the values, the names and types of the inputs and, for each input,
+    the labels of the categories or the edges of the bins.
+    The values are the ones of the correctionlib evaluation of `correction_file` at the center of each bin,
+    so that the two backends give identical weights. The string axes must precede the other axes.'''
+    corr = correctionlib.CorrectionSet.from_file(correction_file)[sfhist.name]
+    names = [axis.name for axis in sfhist.axes]
+    types = ["string" if isinstance(axis[0], str) else "int" if isinstance(axis[0], int) else "real" for axis in sfhist.axes]
+    axes = [np.asarray(list(axis)) if type_ != "real" else np.asarray(axis.edges, dtype=np.float64) for axis, type_ in zip(sfhist.axes, types)]
+    nstring = types.count("string")
+    if types[:nstring] != ["string"] * nstring:
+        raise Exception("The string axes of the histogram must precede the other axes.")
+
+    values = np.empty(sfhist.values().shape, dtype=np.float64)
+    points = np.meshgrid(*[axis if type_ == "int" else 0.5 * (axis[1:] + axis[:-1]) for axis, type_ in zip(axes[nstring:], types[nstring:])], indexing="ij")
+    for index in itertools.product(*[range(len(axis)) for axis in axes[:nstring]]):
+        labels = [str(axis[i]) for axis, i in zip(axes[:nstring], index)]
+        values[index] = corr.evaluate(*labels, *[p.ravel() for p in points]).reshape(points[0].shape)
+    np.savez_compressed(output, values=values, names=np.array(names), types=np.array(types),
+                        **{f"axis{i}" : axis for i, axis in enumerate(axes)})
+
+def get_reweighting(path, fixed, stacked="variation"):
+    '''Returns the reweighting of the only correction in the JSON file `path` (`StackedReweighting`),
+    or of the dense npz companion `path` (`DenseReweighting`) if the file has the `.npz` extension.
+    The reweighting is built once per process and cached with the correctionlib files (see `mutag_calib.lib.corrections`).'''
+    loader = _load_dense_reweighting if path.endswith(".npz") else _load_stacked_reweighting
+    return get_cached(path, loader, tuple(fixed.items()), stacked)
+
+def _load_stacked_reweighting(path, fixed, stacked):
+    with (gzip.open(path, "rt") if path.endswith(".gz") else open(path)) as f:
+        corrections = json.load(f)["corrections"]
+    assert len(corrections) == 1, "The correction file should contain only one correction."
+    evaluator = get_correction_set(path)[corrections[0]["name"]]
+    return StackedReweighting(corrections[0], evaluator, dict(fixed), stacked)
+
+def _load_dense_reweighting(path, fixed, stacked):
+    with np.load(path, allow_pickle=False) as f:
+        names = [str(name) for name in f["names"]]
+        axes = [f[f"axis{i}"] for i in range(len(names))]
+        return DenseReweighting(f["values"], names, [str(t) for t in f["types"]], axes, dict(fixed), stacked)
+
+def _category_index(axis, key, name):
+    index = np.nonzero(axis == key)[0]
+    if len(index) == 0:
+        raise Exception(f"The key {key} is not in the category of the input '{name}'.")
+    return index[0]
+
+def _resolve(node, fixed):
+    '''Descends the category nodes over the inputs in `fixed`.'''
+    while isinstance(node, dict) and node["nodetype"] == "category" and node["input"] in fixed:
+        node = _category_value(node, fixed[node["input"]])
+    return node
+
+def _category_value(node, key):
+    for item in node["content"]:
+        if item["key"] == key:
+            return item["value"]
+    if node.get("default") is not None:
+        return node["default"]
+    raise Exception(f"The key {key} is not in the category node of the input '{node['input']}'.")
+
+def _get_binning(nodes, name):
+    '''Returns the inputs and the edges of the binning `nodes` of the variations, which must be the same.'''
+    binnings = []
+    for node in nodes:
+        if node["nodetype"] == "binning":
+            inputs, edges = [node["input"]], [node["edges"]]
+        elif node["nodetype"] == "multibinning":
+            inputs, edges = node["inputs"], node["edges"]
+        else:
+            raise Exception(f"The nodes of type '{node['nodetype']}' of the correction {name} are not supported.")
+        if node["flow"] != "clamp":
+            raise Exception(f"Only the clamp overflow is supported, the correction {name} has '{node['flow']}'.")
+        if not all(isinstance(value, (int, float)) for value in node["content"]):
+            raise Exception(f"The content of the binnings of the correction {name} must be numbers.")
+        binnings.append((inputs, [_edges(e) for e in edges]))
+    inputs, edges = binnings[0]
+    for i, e in binnings[1:]:
+        if i != inputs or any(not np.array_equal(a, b) for a, b in zip(e, edges)):
+            raise Exception(f"The variations of the correction {name} must have the same binning.")
+    return inputs, edges
+
+def _edges(edges):
+    if isinstance(edges, dict):
+        # Uniform binning
+        return np.linspace(edges["low"], edges["high"], edges["n"] + 1)
+    return np.asarray(edges, dtype=np.float64)
+
+def _find_bin(values, edges):
+    '''Index of the bin of each value, with the values outside of the edges in the first or last bin,
+    as in correctionlib with clamped overflow.'''
+    return np.clip(np.searchsorted(edges, values, side="right") - 1, 0, len(edges) - 2)
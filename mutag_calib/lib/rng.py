@@ -0,0 +1,58 @@
+import numpy as np
+import numba
+
+# Constants of the Philox4x32 generator (Salmon et al., "Parallel random numbers: as easy as 1, 2, 3", SC11)
+PHILOX_M0 = np.uint64(0xD2511F53)
+PHILOX_M1 = np.uint64(0xCD9E8D57)
+PHILOX_W0 = np.uint64(0x9E3779B9)
+PHILOX_W1 = np.uint64(0xBB67AE85)
+MASK32 = np.uint64(0xFFFFFFFF)
+SHIFT32 = np.uint64(32)
+
+def philox4x32(counter, key, rounds=10):
+    '''Counter-based Philox4x32 generator: returns the 4 random 32-bit words of each (counter, key) pair.
+    `counter` is a sequence of 4 arrays and `key` a sequence of 2 arrays (or scalars) of unsigned 32-bit integers,
+    broadcast together. The output depends only on the counter and the key: the same counter and key always give
+    the same words, in any order, chunking or thread, and different counters give independent words.'''
+    words = [np.asarray(w, dtype=np.uint32) for w in list(counter) + list(key)]
+    shape = np.broadcast_shapes(*(w.shape for w in words))
+    words = [np.ascontiguousarray(w if w.shape == shape else np.broadcast_to(w, shape).copy()).ravel() for w in words]
+    out = np.empty((4, words[0].size), dtype=np.uint32)
+    _philox4x32_kernel(*words, rounds, out)
+    return tuple(w.reshape(shape) for w in out)
+
+@numba.njit
+def _philox4x32_kernel(c0, c1, c2, c3, k0, k1, rounds, out):
+    '''Philox4x32 rounds of each counter and key, in 64-bit integers for the 32x32 -> 64 bit products.'''
+    for i in range(len(c0)):
+        x0, x1, x2, x3 = np.uint64(c0[i]), np.uint64(c1[i]), np.uint64(c2[i]), np.uint64(c3[i])
+        key0, key1 = np.uint64(k0[i]), np.uint64(k1[i])
+        for r in range(rounds):
+            if r > 0:
+                key0 = (key0 + PHILOX_W0) & MASK32
+                key1 = (key1 + PHILOX_W1) & MASK32
+            p0 = PHILOX_M0 * x0
+            p1 = PHILOX_M1 * x2
+            x0, x1, x2, x3 = (p1 >> SHIFT32) ^ x1 ^ key0, p1 & MASK32, (p0 >> SHIFT32) ^ x3 ^ key1, p0 & MASK32
+        out[0, i], out[1, i], out[2, i], out[3, i] = x0, x1, x2, x3
+
+def uniform_from_words(high, low):
+    '''Returns the uniform numbers in (0, 1) with 53 random bits built from two arrays of 32-bit words.'''
+    bits = (high.astype(np.uint64) >> np.uint64(5)) * np.uint64(1 << 26) + (low.astype(np.uint64) >> np.uint64(6))
+    return (bits.astype(np.float64) + 0.5) / 2.**53
+
+def counter_normal(run, lumi, event, index, stream=0):
+    '''Returns one standard normal number for each object, identified by the `run`, `lumi`, `event` numbers
+    of its event and by its `index` in the event (numpy arrays of the same length).
+    The numbers are drawn with Philox4x32 with the counter (index, event low word, event high word, lumi)
+    and the key (run, stream), and transformed with the Box-Muller method: they are reproducible
+    independently of the chunks and of the executor. Different `stream` values give independent numbers
+    for the same objects, e.g. for different corrections.'''
+    event = np.asarray(event, dtype=np.uint64)
+    words = philox4x32(
+        (index, event & MASK32, event >> SHIFT32, lumi),
+        (run, stream),
+    )
+    u1 = uniform_from_words(words[0], words[1])
+    u2 = uniform_from_words(words[2], words[3])
+    return np.sqrt(-2. * np.log(u1)) * np.cos(2. * np.pi * u2)
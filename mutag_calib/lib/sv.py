@@ -1,6 +1,7 @@
 import sys
 
 import collections
+import numba
 import numpy as np
 import awkward as ak
 
@@ -9,11 +10,12 @@ from .deltar_matching import run_deltar_matching
 def project(a, b):
     return a.dot(b)/b.dot(b) * b
 
-def sv_matched_to_fatjet(events):
+def sv_matched_to_fatjet(events, backend="numba"):
     '''This function returns the collection of SV matched to the fatjets.
     The output array has the same shape as the events.FatJetGood collection.
+    The `backend` argument is passed to `run_deltar_matching`.
     '''
-    return run_deltar_matching(events.FatJetGood, events.SV, radius=0.8)
+    return run_deltar_matching(events.FatJetGood, events.SV, radius=0.8, backend=backend)
 
 # N.B.: In the following the logarithm of the mass-like variables is set to -5 as default value,
 # when the corresponding mass value is 0. This way, the log(mass) histograms will be filled with
@@ -78,3 +80,83 @@ def get_sumcorrmass(sv, log=True):
         return sumcorrmass, logsumcorrmass
     else:
         return sumcorrmass
+
+def get_sv_mass_observables(sv, dtype=np.float64):
+    '''Compute the SV mass observables of the jets in a single pass over the flat SV buffers,
+    without building the intermediate 4-momentum arrays.
+    The input is the collection of SV matched to the jets (NxMxG array) with the uncorrected SV mass.
+    The function returns the tuple (corrmass, sumcorrmass, logsumcorrmass, sv1mass, logsv1mass):
+      - corrmass: corrected mass of each SV, with the same shape as the input (see `get_corrmass`)
+      - sumcorrmass, logsumcorrmass: invariant mass of the sum of the SV with corrected mass and its log
+        (see `get_sumcorrmass`), one value per jet
+      - sv1mass, logsv1mass: corrected mass of the SV with the largest dxySig and its log, one value per jet.
+        If the jet has no SV, the mass is set to 0 and the log to -5 (see `get_sv1mass`).
+    The output values are identical to the ones of the awkward functions.
+    The `dtype` argument sets the precision of sv1mass and logsv1mass: with np.float64 the output of
+    `get_sv1mass` is reproduced, with np.float32 all the outputs keep the precision of the NanoAOD branches.
+    '''
+    njet = ak.num(sv, axis=1)
+    nsv = ak.to_numpy(ak.flatten(ak.num(sv, axis=2)))
+    offsets = np.zeros(len(nsv) + 1, dtype=np.int64)
+    np.cumsum(nsv, out=offsets[1:])
+    pt, eta, phi, mass, pAngle, dxySig = [
+        ak.to_numpy(ak.flatten(sv[field], axis=None)) for field in ["pt", "eta", "phi", "mass", "pAngle", "dxySig"]
+    ]
+    # The element-wise quantities are computed with the vectorized numpy functions on the flat buffers,
+    # with the same operations as the coffea PtEtaPhiMLorentzVector methods: the results are bitwise
+    # identical to the awkward implementation, which would not be the case with the scalar math of numba
+    p = pt * np.cosh(eta)
+    sin_pAngle = np.sin(pAngle)
+    # N.B.: `**2` on a numpy array is computed as a product, while on awkward arrays it calls `np.power`
+    corrmass = np.sqrt(np.power(mass, 2) + np.power(p, 2) * np.power(sin_pAngle, 2)) + p * sin_pAngle
+    px, py, pz = pt * np.cos(phi), pt * np.sin(phi), pt * np.sinh(eta)
+    energy = np.hypot(p, corrmass)
+
+    # The sum of the 4-momenta and the leading SV are computed for all the jets in a single pass
+    sumcorrmass = np.empty(len(nsv), dtype=corrmass.dtype)
+    sv1mass = np.empty(len(nsv), dtype=dtype)
+    _get_sv_mass_kernel(corrmass.dtype)(offsets, px, py, pz, energy, corrmass, dxySig, sumcorrmass, sv1mass)
+    # The jets without SV have sumcorrmass = 0 and logsumcorrmass = -inf, as in `get_sumcorrmass`
+    with np.errstate(divide="ignore"):
+        logsumcorrmass = np.log(sumcorrmass)
+    logsv1mass = np.full(len(nsv), -5., dtype=dtype)
+    np.log(sv1mass, out=logsv1mass, where=(sv1mass != 0))
+
+    return (
+        ak.unflatten(ak.unflatten(corrmass, nsv), njet),
+        ak.unflatten(sumcorrmass, njet),
+        ak.unflatten(logsumcorrmass, njet),
+        ak.unflatten(sv1mass, njet),
+        ak.unflatten(logsv1mass, njet),
+    )
+
+_sv_mass_kernels = {}
+
+def _get_sv_mass_kernel(dtype):
+    '''Returns the SV mass kernel compiled for the floating point type `dtype`.'''
+    dtype = np.dtype(dtype)
+    if dtype not in _sv_mass_kernels:
+        _sv_mass_kernels[dtype] = _build_sv_mass_kernel(dtype.type)
+    return _sv_mass_kernels[dtype]
+
+def _build_sv_mass_kernel(ftype):
+
+    @numba.njit
+    def kernel(offsets, px, py, pz, energy, corrmass, dxySig, sumcorrmass, sv1mass):
+        '''For each jet, sum the 4-momenta of its SV and compute the invariant mass of the sum,
+        and store the corrected mass of the SV with the largest dxySig (0 if the jet has no SV).'''
+        for ijet in range(len(offsets) - 1):
+            x, y, z, t = ftype(0), ftype(0), ftype(0), ftype(0)
+            best = -1
+            for i in range(offsets[ijet], offsets[ijet + 1]):
+                x += px[i]
+                y += py[i]
+                z += pz[i]
+                t += energy[i]
+                # Keep the first SV with the largest dxySig, as the stable sort in descending order
+                if best < 0 or dxySig[i] > dxySig[best]:
+                    best = i
+            sumcorrmass[ijet] = np.sqrt(t * t - x * x - y * y - z * z)
+            sv1mass[ijet] = corrmass[best] if best >= 0 else 0.
+
+    return kernel
@@ -3,89 +3,20 @@
 """
 Script to analyze trigger prescale factors from JSON correction files.
 
-This script reads the prescale JSON files referenced in triggers_prescales_run3.yaml,
-loops over run numbers and lumi sections, and calculates average prescale factors
-averaged over different luminosity sections.
+This script reads the prescale JSON files referenced in triggers_prescales_run3.yaml
+into a columnar table (see `mutag_calib.lib.prescale_tables`), cached on disk,
+and calculates average prescale factors over the runs and luminosity sections.
 """
 
-import os
 import json
-import yaml
 import argparse
 from pathlib import Path
-from collections import defaultdict
 import numpy as np
-import pandas as pd
 
-def load_yaml_config(config_path):
-    """Load the YAML configuration file with prescales."""
-    with open(config_path, 'r') as f:
-        config = yaml.safe_load(f)
-    return config
+from mutag_calib.lib.prescale_tables import read_prescale_files, get_prescale_tables, PRESCALE_TABLE_CACHE
 
-def resolve_config_path(path_string, config_dir):
-    """Resolve ${config_dir:} placeholders in file paths."""
-    if "${config_dir:}" in path_string:
-        return path_string.replace("${config_dir:}", config_dir)
-    return path_string
-
-def load_prescale_json(json_path):
-    """Load and parse a prescale JSON file."""
-    with open(json_path, 'r') as f:
-        data = json.load(f)
-    return data
-
-def parse_prescale_data(data):
-    """Parse prescale data to extract run numbers, lumi sections, and weights."""
-    prescale_info = []
-    
-    # Navigate the JSON structure
-    corrections = data.get("corrections", [])
-    for correction in corrections:
-        if correction.get("name") == "prescaleWeight":
-            content = correction.get("data", {}).get("content", [])
-            
-            for run_entry in content:
-                run_number = run_entry["key"]
-                path_content = run_entry["value"]["content"]
-                
-                for path_entry in path_content:
-                    hlt_path = path_entry["key"]
-                    weight_data = path_entry["value"]
-                    
-                    # Handle different weight data structures
-                    if isinstance(weight_data, (int, float)):
-                        # Simple constant weight
-                        prescale_info.append({
-                            'run': run_number,
-                            'hlt_path': hlt_path,
-                            'lumi_start': 1,
-                            'lumi_end': float('inf'),
-                            'weight': float(weight_data)
-                        })
-                    elif isinstance(weight_data, dict) and weight_data.get("nodetype") == "binning":
-                        # Binned weights by lumi section
-                        edges = weight_data["edges"]
-                        content = weight_data["content"]
-                        
-                        for i, weight in enumerate(content):
-                            lumi_start = edges[i]
-                            lumi_end = edges[i+1] if i+1 < len(edges) else float('inf')
-                            
-                            prescale_info.append({
-                                'run': run_number,
-                                'hlt_path': hlt_path,
-                                'lumi_start': lumi_start,
-                                'lumi_end': lumi_end,
-                                'weight': float(weight)
-                            })
-    
-    return prescale_info
-
-def calculate_averages(prescale_data):
-    """Calculate various averages of prescale factors."""
-    df = pd.DataFrame(prescale_data)
-    
+def calculate_averages(df):
+    """Calculate various averages of prescale factors from the prescale table."""
     results = {}
     
     # Overall average by HLT path
@@ -113,7 +44,7 @@ def calculate_averages(prescale_data):
     }
     results['overall'] = overall_stats
     
-    return results, df
+    return results
 
 def print_summary(results):
     """Print a summary of the results."""
@@ -189,6 +120,10 @@ def main():
                        help="Specific year to analyze (e.g., '2022_preEE'). If not specified, analyze all years.")
     parser.add_argument("--trigger-group", default=None, 
                        help="Specific trigger group to analyze (e.g., 'BTagMu'). If not specified, analyze all groups.")
+    parser.add_argument("--cache-dir", default=PRESCALE_TABLE_CACHE,
+                       help="Directory of the cache of the prescale tables")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Parse the prescale JSON files without using the cache")
     
     args = parser.parse_args()
     
@@ -198,70 +133,27 @@ def main():
         print(f"Error: Configuration file {config_path} does not exist")
         return
     
-    config = load_yaml_config(config_path)
-    config_dir = config_path.parent
-    
-    # Extract prescale information
-    hlt_triggers_prescales = config.get("HLT_triggers_prescales", {})
-    
-    all_prescale_data = []
-    processed_files = set()
-    
     print(f"Processing prescale files...")
     
-    for year, year_data in hlt_triggers_prescales.items():
-        if args.year and year != args.year:
-            continue
-            
-        print(f"\nProcessing year: {year}")
-        
-        for trigger_group, triggers in year_data.items():
-            if args.trigger_group and trigger_group != args.trigger_group:
-                continue
-                
-            print(f"  Processing trigger group: {trigger_group}")
-            
-            for trigger_name, json_path in triggers.items():
-                resolved_path = resolve_config_path(json_path, str(config_dir))
-                json_file = Path(resolved_path)
-                
-                if not json_file.exists():
-                    print(f"    Warning: JSON file not found: {json_file}")
-                    continue
-                
-                # Avoid processing the same file multiple times
-                if str(json_file) in processed_files:
-                    continue
-                processed_files.add(str(json_file))
-                
-                print(f"    Processing: {trigger_name} -> {json_file.name}")
-                
-                try:
-                    prescale_json = load_prescale_json(json_file)
-                    prescale_info = parse_prescale_data(prescale_json)
-                    
-                    # Add metadata
-                    for entry in prescale_info:
-                        entry['year'] = year
-                        entry['trigger_group'] = trigger_group
-                        entry['trigger_name'] = trigger_name
-                        entry['json_file'] = json_file.name
-                    
-                    all_prescale_data.extend(prescale_info)
-                    print(f"      Found {len(prescale_info)} prescale entries")
-                    
-                except Exception as e:
-                    print(f"      Error processing {json_file}: {e}")
+    # Each JSON file is included only once, for the first year and trigger group using it
+    prescale_files = read_prescale_files(config_path)
+    df = get_prescale_tables(prescale_files,
+                             years=[args.year] if args.year else None,
+                             trigger_groups=[args.trigger_group] if args.trigger_group else None,
+                             unique_files=True,
+                             cache_dir=None if args.no_cache else args.cache_dir)
     
-    if not all_prescale_data:
+    if len(df) == 0:
         print("No prescale data found!")
         return
     
-    print(f"\nTotal prescale entries collected: {len(all_prescale_data)}")
+    for (year, json_file), entries in df.groupby(['year', 'json_file'], sort=False).size().items():
+        print(f"  {year}: {json_file} -> {entries} prescale entries")
+    print(f"\nTotal prescale entries collected: {len(df)}")
     
     # Calculate averages
     print("Calculating averages...")
-    results, df = calculate_averages(all_prescale_data)
+    results = calculate_averages(df)
     
     # Print summary
     print_summary(results)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the categorization of the AK8 jets in the fit templates configs (see `configs/fit_templates`).
+
+The categories are the Cartesian product of the bins of softdrop mass, pT and tagger WPs (pass and fail)
+of a `mutag_calibration_*.yaml` file, as in the configs, with an inclusive common category.
+The masks of all the categories are computed for synthetic AK8 jets with `CartesianSelection`
+(one mask per cut, and the AND of the masks for each category) and with `PackedCartesianSelection`
+(one packed category code per jet), and the time per chunk of each selection is reported.
+The masks of the two selections are checked to be identical: a fraction of the jets is generated
+on the bin edges and WPs, and with NaN tagger scores.
+"""
+
+import os
+import time
+import argparse
+import yaml
+import numpy as np
+import awkward as ak
+
+from pocket_coffea.lib.categorization import CartesianSelection, MultiCut
+from pocket_coffea.parameters.cuts import passthrough
+from mutag_calib.configs.fatjet_base.custom.cuts import get_ptbin, get_msdbin
+from mutag_calib.configs.fatjet_base.custom.functions import get_inclusive_wp
+from mutag_calib.lib.categorization import PackedCartesianSelection
+
+params_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../configs/params")
+
+def get_multicuts(calibration, year):
+    '''Returns the MultiCut objects of the msd, pT and tagger bins of the `mutag_calibration` parameters, as in the configs.'''
+    cuts_tagger, cuts_names_tagger = [], []
+    for tagger in calibration["taggers"]:
+        for wp, wp_value in calibration["wp"][year][tagger].items():
+            for region in ["pass", "fail"]:
+                cuts_tagger.append(get_inclusive_wp(tagger, wp_value, region))
+                cuts_names_tagger.append(f"{tagger}-{wp}-{region}")
+    return [
+        MultiCut(name="msd", cuts=[get_msdbin(low, high) for low, high in calibration["msd_binning"][year]],
+                 cuts_names=[f"msd-{low}to{high}" for low, high in calibration["msd_binning"][year]]),
+        MultiCut(name="pt", cuts=[get_ptbin(low, high) for low, high in calibration["pt_binning"][year]],
+                 cuts_names=[f"Pt-{low}to{high}" for low, high in calibration["pt_binning"][year]]),
+        MultiCut(name="tagger", cuts=cuts_tagger, cuts_names=cuts_names_tagger),
+    ]
+
+def generate_events(rng, nevents, calibration, year):
+    '''Returns `nevents` events with 0 to 2 AK8 jets, with pT, softdrop mass and tagger scores.
+    1% of the values are set to the bin edges or WPs, and 1% of the tagger scores are NaN.'''
+    counts = rng.integers(0, 3, nevents)
+    n = np.sum(counts)
+    fields = {
+        "pt" : (250. + rng.exponential(150., n)).astype(np.float32),
+        "msoftdrop" : rng.uniform(0., 300., n).astype(np.float32),
+    }
+    edges = {
+        "pt" : [b for bins in calibration["pt_binning"][year] for b in bins if b != 'Inf'],
+        "msoftdrop" : [b for bins in calibration["msd_binning"][year] for b in bins if b != 'Inf'],
+    }
+    for tagger in calibration["taggers"]:
+        fields[tagger] = rng.uniform(-0.05, 1.05, n).astype(np.float32)
+        fields[tagger][rng.random(n) < 0.01] = np.nan
+        edges[tagger] = [0., 1.] + list(calibration["wp"][year][tagger].values())
+    for field, values in edges.items():
+        on_edge = rng.random(n) < 0.01
+        fields[field][on_edge] = rng.choice(np.array(values, dtype=np.float32), np.sum(on_edge))
+    return ak.zip({
+        "FatJetGood" : ak.unflatten(ak.zip(fields), counts),
+        "nFatJetGood" : counts,
+        "event" : np.arange(nevents),
+    }, depth_limit=1)
+
+def compute_masks(selection, events):
+    '''Prepares the selection and returns the masks of all the categories.'''
+    selection.prepare(events=events, processor_params=None, year=None, sample=None, isMC=True)
+    return dict(selection.get_masks())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the categorization of the AK8 jets in the fit templates configs.")
+    parser.add_argument('-n', '--nevents', type=int, nargs='+', default=[10000, 100000, 500000], help="Numbers of events.")
+    parser.add_argument('--analysis', type=str, default="HHbbbb", help="Analysis of the mutag_calibration_{analysis}.yaml parameters.")
+    parser.add_argument('--year', type=str, default="2022_preEE", help="Data-taking period of the binning.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of repetitions for each measurement.")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the random number generator.")
+    args = parser.parse_args()
+
+    with open(os.path.join(params_dir, f"mutag_calibration_{args.analysis}.yaml")) as f:
+        calibration = yaml.safe_load(f)["mutag_calibration"]
+    rng = np.random.default_rng(args.seed)
+    selections = {
+        "CartesianSelection" : CartesianSelection(multicuts=get_multicuts(calibration, args.year), common_cats={"inclusive" : [passthrough]}),
+        "PackedCartesianSelection" : PackedCartesianSelection(multicuts=get_multicuts(calibration, args.year), common_cats={"inclusive" : [passthrough]}),
+    }
+    print(f"Categories: {len(selections['CartesianSelection'].categories)}")
+    print(f"{'nevents':>9} " + " ".join(f"{name + ' [ms]':>28}" for name in selections) + f" {'speedup':>9}")
+    for nevents in args.nevents:
+        events = generate_events(rng, nevents, calibration, args.year)
+        timings, masks = {}, {}
+        for name, selection in selections.items():
+            timings[name] = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                masks[name] = compute_masks(selection, events)
+                timings[name].append(time.perf_counter() - t0)
+            timings[name] = min(timings[name])
+        for category, mask in masks["CartesianSelection"].items():
+            assert ak.all(mask == masks["PackedCartesianSelection"][category]), f"The masks of the category {category} do not match."
+        print(f"{nevents:>9} " + " ".join(f"{1e3 * timings[name]:>28.1f}" for name in selections)
+              + f" {timings['CartesianSelection'] / timings['PackedCartesianSelection']:>9.1f}")
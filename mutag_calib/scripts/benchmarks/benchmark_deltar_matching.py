@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""
+Scaling benchmark of the deltaR matching backends of `run_deltar_matching`.
+
+Synthetic events with a fixed number of AK8 jets and an increasing multiplicity
+of muons and SV are generated, and the time needed to match the objects to the jets
+is measured for each backend. The output of the compiled backends is checked
+against the reference awkward implementation.
+"""
+
+import time
+import argparse
+import numpy as np
+import awkward as ak
+
+from mutag_calib.lib.deltar_matching import run_deltar_matching
+from synthetic_events import generate_collection
+
+def time_backend(jets, objects, radius, backend, repeat):
+    '''Returns the best wall time out of `repeat` calls, and the matched collection.'''
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        matched = run_deltar_matching(jets, objects, radius=radius, backend=backend)
+        timings.append(time.perf_counter() - t0)
+    return min(timings), matched
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scaling of the deltaR matching backends with the object multiplicity.")
+    parser.add_argument('-n', '--nevents', type=int, default=50000, help="Number of events per chunk.")
+    parser.add_argument('--njets', type=int, default=2, help="Average number of AK8 jets per event.")
+    parser.add_argument('--multiplicities', type=int, nargs='+', default=[2, 5, 10, 20, 40, 80], help="Average number of muons/SV per event.")
+    parser.add_argument('--radius', type=float, default=0.8, help="Matching radius.")
+    parser.add_argument('--backends', type=str, nargs='+', default=["awkward", "numba", "sweep"], help="Backends to benchmark.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of repetitions for each measurement.")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the random number generator.")
+    parser.add_argument('--no-check', action='store_true', help="Do not check the output against the awkward backend.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    jets = generate_collection(rng, rng.poisson(args.njets, args.nevents), eta_max=2.4)
+
+    # Compile the kernels before timing
+    for backend in args.backends:
+        run_deltar_matching(jets[:10], jets[:10], radius=args.radius, backend=backend)
+
+    # The speedup of the sweep backend is reported with respect to the first backend in the list
+    print(f"{'multiplicity':>12} " + " ".join(f"{backend + ' [ms]':>14}" for backend in args.backends) + f" {'speedup sweep':>14}")
+    for multiplicity in args.multiplicities:
+        objects = generate_collection(rng, rng.poisson(multiplicity, args.nevents))
+        timings = {}
+        matched = {}
+        for backend in args.backends:
+            timings[backend], matched[backend] = time_backend(jets, objects, args.radius, backend, args.repeat)
+        if not args.no_check and "awkward" in matched:
+            for backend in matched:
+                assert ak.to_list(ak.num(matched[backend].pt, axis=2)) == ak.to_list(ak.num(matched["awkward"].pt, axis=2)), f"Backend '{backend}' does not match the awkward implementation."
+                assert ak.all(ak.flatten(matched[backend].dR, axis=None) == ak.flatten(matched["awkward"].dR, axis=None)), f"Backend '{backend}' does not match the awkward implementation."
+        reference = timings[args.backends[0]]
+        speedup = reference / timings["sweep"] if "sweep" in timings else float("nan")
+        print(f"{multiplicity:>12} " + " ".join(f"{1e3 * timings[backend]:>14.1f}" for backend in args.backends) + f" {speedup:>14.1f}")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the startup cost of the jet calibration module `mutag_calib.configs.fatjet_base.custom.jets`.
+
+The JME evaluator pickle of PocketCoffea (`jets_evaluator.pkl.gz`) is loaded lazily, at the first call
+of `get_jme_factories`, instead of at the import of the module. Each measurement runs in a fresh interpreter,
+as a new worker would: the import of the module is timed, then the first and second calls of `get_jme_factories`.
+The import followed by the first call is the startup cost of a worker before the lazy loading,
+while the import alone is the startup cost of the workers calibrating the jets with correctionlib.
+The peak resident memory after the import and after the loading of the factories is also reported.
+"""
+
+import sys
+import json
+import argparse
+import subprocess
+
+# Code run in the fresh interpreter, printing the timings and the peak memory as JSON
+measurement = """
+import json, time, resource
+t0 = time.perf_counter()
+import mutag_calib.configs.fatjet_base.custom.jets as jets
+t1 = time.perf_counter()
+rss_import = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+jets.get_jme_factories()
+t2 = time.perf_counter()
+jets.get_jme_factories()
+t3 = time.perf_counter()
+rss_load = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"import" : t1 - t0, "first_use" : t2 - t1, "second_use" : t3 - t2, "rss_import" : rss_import, "rss_load" : rss_load}))
+"""
+
+def measure():
+    '''Returns the timings and the peak memory (in kB) of the import and of the loading of the factories in a fresh interpreter.'''
+    output = subprocess.run([sys.executable, "-c", measurement], capture_output=True, text=True)
+    if output.returncode != 0:
+        raise Exception(f"The measurement failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the startup cost of the jet calibration module.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of fresh interpreters.")
+    args = parser.parse_args()
+
+    results = [measure() for _ in range(args.repeat)]
+    best = {key : min(r[key] for r in results) for key in results[0]}
+    print(f"{'import of the module (lazy)':<45} {1e3 * best['import']:>10.1f} ms")
+    print(f"{'first get_jme_factories() (pickle loading)':<45} {1e3 * best['first_use']:>10.1f} ms")
+    print(f"{'second get_jme_factories()':<45} {1e6 * best['second_use']:>10.1f} us")
+    print(f"{'import + loading (eager)':<45} {1e3 * (best['import'] + best['first_use']):>10.1f} ms")
+    print(f"{'peak memory after import':<45} {best['rss_import'] / 1024:>10.1f} MB")
+    print(f"{'peak memory after loading':<45} {best['rss_load'] / 1024:>10.1f} MB")
+    print(f"Worker startup reduced by {best['first_use'] / (best['import'] + best['first_use']):.0%} without the jet factories")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the cache of the per-jet columns that are not changed by the shape variations (`JetColumnCache`).
+
+With the jet calibration variations, the muons and SV are matched again to the AK8 jets in each variation
+and the SV mass observables are computed again, although the matching and the SV do not depend on the pT and mass
+of the jets. The stages of `fatjetBaseProcessor` computing these columns (`define_matched_objects` and
+`define_common_variables_after_presel`) are run on synthetic events for several shape variations:
+in each variation the pT of the AK8 jets is shifted, the jets below the pT threshold are not selected
+and the muon-tagged jets are kept, as in the preselection of the mutag workflows.
+The time per variation is reported with and without the cache, and the fields of the selected AK8 jets
+are checked to be identical in the two modes.
+"""
+
+import time
+import argparse
+import numpy as np
+import awkward as ak
+
+from mutag_calib.workflows.fatjet_base import fatjetBaseProcessor
+from mutag_calib.lib.column_cache import JetColumnCache
+from mutag_calib.lib.fields import with_fields
+from synthetic_events import generate_events
+
+fields = ["tau21", "nMuonGoodMatchedToFatJetGood", "nMuonGoodMatchedToSubJet", "nMuonGoodMatchedUniquelyToSubJet",
+          "nSVMatchedToFatJetGood", "sumcorrSVmass", "logsumcorrSVmass", "sv1mass", "logsv1mass"]
+
+def get_processor(njets, cache, match_sv_before_jet_selection=False):
+    '''Returns a fatjetBaseProcessor with the attributes used by the stages of the benchmark, without a config.
+    If `cache` is True, the per-jet columns of the `njets` AK8 jets of the chunk are cached.'''
+    processor = fatjetBaseProcessor.__new__(fatjetBaseProcessor)
+    processor.fatjet_matched_collections = {"MuonGood": 0.8, "SV": 0.8}
+    processor.subjet_matched_collections = ["MuonGoodMatchedToSubJet", "MuonGoodMatchedUniquelyToSubJet"]
+    processor.deltar_matching_backend = "numba"
+    processor.match_muons_to_subjets = True
+    processor.float32_observables = False
+    processor.cache_invariant_jet_columns = cache
+    processor.match_sv_before_jet_selection = match_sv_before_jet_selection
+    processor.jet_column_cache = JetColumnCache(njets) if cache else None
+    processor.sv_column_cache = JetColumnCache(njets) if cache and not match_sv_before_jet_selection else None
+    processor.sv_columns = ["nSVMatchedToFatJetGood", "sumcorrSVmass", "logsumcorrSVmass", "sv1mass", "logsv1mass"]
+    return processor
+
+def run_variation(processor, events, scale, pt_min):
+    '''Runs the stages of the processor for a shape variation scaling the pT of the AK8 jets by `scale`.
+    Returns the time of the stages and the selected AK8 jets.'''
+    fatjets = ak.with_field(events.FatJet, events.FatJet.pt * scale, "pt")
+    processor.events = ak.with_field(events, fatjets[fatjets.pt > pt_min], "FatJetGood")
+    processor.events = processor.events[ak.num(processor.events.FatJetGood) >= 1]
+    t0 = time.perf_counter()
+    processor.define_matched_objects()
+    processor.select_fatjets(processor.events.FatJetGood.nMuonGoodMatchedToFatJetGood >= 1)
+    processor.events = processor.events[ak.num(processor.events.FatJetGood) >= 1]
+    processor.define_common_variables_after_presel("variation")
+    return time.perf_counter() - t0, processor.events.FatJetGood
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the cache of the variation-invariant per-jet columns.")
+    parser.add_argument('-n', '--nevents', type=int, default=200000, help="Number of events per chunk.")
+    parser.add_argument('--nvariations', type=int, default=9, help="Number of shape variations, including the nominal.")
+    parser.add_argument('--pt-min', type=float, default=350., help="pT threshold of the selected AK8 jets.")
+    parser.add_argument('--match-sv-before-jet-selection', action='store_true', help="Match the SV to the AK8 jets before the jet selection, together with the muons.")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the random number generator.")
+    args = parser.parse_args()
+
+    events = generate_events(args.nevents, seed=args.seed)
+    events["Muon"] = events.Muon
+    events["MuonGood"] = events.Muon
+    nfatjet = ak.to_numpy(ak.num(events.FatJet))
+    events["FatJet"] = with_fields(events.FatJet, {"chunk_index" : ak.unflatten(np.arange(np.sum(nfatjet)), nfatjet)})
+    rng = np.random.default_rng(args.seed)
+    # Per-jet pT scale of each variation: the first one is the nominal
+    scales = [np.ones(np.sum(nfatjet))] + [1. + rng.normal(0., 0.05, np.sum(nfatjet)) for _ in range(args.nvariations - 1)]
+    scales = [ak.unflatten(scale.astype(np.float32), nfatjet) for scale in scales]
+    # Compile the kernels
+    run_variation(get_processor(np.sum(nfatjet), False, args.match_sv_before_jet_selection), events[:100], scales[0][:100], args.pt_min)
+
+    timings, jets = {}, {}
+    for cache in [False, True]:
+        processor = get_processor(np.sum(nfatjet), cache, args.match_sv_before_jet_selection)
+        timings[cache], jets[cache] = zip(*[run_variation(processor, events, scale, args.pt_min) for scale in scales])
+    for jets_nocache, jets_cache in zip(jets[False], jets[True]):
+        for field in fields:
+            assert ak.all(ak.flatten(jets_nocache[field]) == ak.flatten(jets_cache[field])), f"The field {field} does not match."
+
+    print(f"{'variation':>10} {'no cache [ms]':>14} {'cache [ms]':>11}")
+    for i in range(args.nvariations):
+        print(f"{'nominal' if i == 0 else i:>10} {1e3 * timings[False][i]:>14.1f} {1e3 * timings[True][i]:>11.1f}")
+    print(f"Time per additional variation: {1e3 * np.mean(timings[False][1:]):.1f} ms without cache, "
+          f"{1e3 * np.mean(timings[True][1:]):.1f} ms with cache")
+    print(f"Cache: {processor.jet_column_cache.stats}")
+    if processor.sv_column_cache is not None:
+        print(f"SV cache: {processor.sv_column_cache.stats}")
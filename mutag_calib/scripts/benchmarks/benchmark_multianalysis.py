@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the single pass over the datasets of several template analyses (`mutagMultiAnalysisProcessor`).
+
+When the analyses are run separately, the input columns of each chunk are read and the shared stages
+(matching of the muons and SV to the AK8 jets, per-jet columns, jet selection) are run once per analysis and
+shape variation. In the single pass they are run once per chunk and variation, and only the stages of each
+analysis (here a histogram fill per analysis) are repeated. The synthetic events of the benchmark are saved in a
+ROOT file with the branches of the NanoAOD collections, and the time to read them and the compressed bytes read
+are reported together with the CPU time of the shared stages, for the separate runs and for the single pass.
+The stages are the ones of `benchmark_invariant_columns.py`, with the cache of the per-jet columns.
+The benchmark does not run `mutagMultiAnalysisProcessor` itself: it estimates the saving on the reading and on the
+shared stages, while the categories, reweighting and histograms of the analyses are approximated by a histogram fill.
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+import awkward as ak
+import uproot
+import hist
+
+from mutag_calib.lib.fields import with_fields
+from synthetic_events import generate_events
+from benchmark_invariant_columns import get_processor, run_variation
+
+collections = {
+    "FatJet" : ["pt", "eta", "phi", "mass", "msoftdrop", "tau1", "tau2", "jetId"],
+    "Muon" : ["pt", "eta", "phi", "mass", "charge", "pfRelIso04_all", "tightId"],
+    "SV" : ["pt", "eta", "phi", "mass", "pAngle", "dxySig"],
+}
+
+def write_events(events, path):
+    '''Save the collections of the events in the tree `Events` of a ROOT file, with the NanoAOD branch names.'''
+    with uproot.recreate(path) as f:
+        f["Events"] = {
+            coll : ak.zip({field : events[coll][field] for field in fields})
+            for coll, fields in collections.items()
+        }
+
+def read_events(path):
+    '''Returns the time to read the branches of the collections and the compressed bytes of the branches.'''
+    branches = [f"{coll}_{field}" for coll, fields in collections.items() for field in fields] + [f"n{coll}" for coll in collections]
+    t0 = time.perf_counter()
+    with uproot.open(path) as f:
+        tree = f["Events"]
+        tree.arrays(branches, how=dict)
+        nbytes = sum(tree[branch].compressed_bytes for branch in branches)
+    return time.perf_counter() - t0, nbytes
+
+def run_shared_stages(events, scales, pt_min):
+    '''Returns the CPU time of the shared stages over all the shape variations of a chunk.'''
+    processor = get_processor(ak.sum(ak.num(events.FatJet)), True)
+    return sum(run_variation(processor, events, scale, pt_min)[0] for scale in scales)
+
+def run_analysis_stages(jets):
+    '''Returns the time of the stages of an analysis: the fill of a histogram of the selected AK8 jets.'''
+    t0 = time.perf_counter()
+    h = hist.Hist(hist.axis.Regular(50, 300., 1300., name="pt"), hist.axis.Regular(20, 0., 1., name="tau21"))
+    h.fill(pt=ak.to_numpy(ak.flatten(jets.pt)), tau21=ak.to_numpy(ak.flatten(jets.tau21)))
+    return time.perf_counter() - t0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the single pass over the datasets of several template analyses.")
+    parser.add_argument('-n', '--nevents', type=int, default=200000, help="Number of events per chunk.")
+    parser.add_argument('--nanalyses', type=int, default=3, help="Number of analyses.")
+    parser.add_argument('--nvariations', type=int, default=9, help="Number of shape variations, including the nominal.")
+    parser.add_argument('--pt-min', type=float, default=350., help="pT threshold of the selected AK8 jets.")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the random number generator.")
+    args = parser.parse_args()
+
+    events = generate_events(args.nevents, seed=args.seed)
+    events["MuonGood"] = events.Muon
+    nfatjet = ak.to_numpy(ak.num(events.FatJet))
+    events["FatJet"] = with_fields(events.FatJet, {"chunk_index" : ak.unflatten(np.arange(np.sum(nfatjet)), nfatjet)})
+    rng = np.random.default_rng(args.seed)
+    scales = [np.ones(np.sum(nfatjet))] + [1. + rng.normal(0., 0.05, np.sum(nfatjet)) for _ in range(args.nvariations - 1)]
+    scales = [ak.unflatten(scale.astype(np.float32), nfatjet) for scale in scales]
+    # Compile the kernels
+    run_shared_stages(events[:100], [scale[:100] for scale in scales[:1]], args.pt_min)
+    jets = run_variation(get_processor(np.sum(nfatjet), False), events, scales[0], args.pt_min)[1]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "events.root")
+        write_events(events, path)
+        timings = {}
+        for mode, npasses in [("separate", args.nanalyses), ("single pass", 1)]:
+            read_time, shared_time, nbytes = 0., 0., 0
+            for _ in range(npasses):
+                t, b = read_events(path)
+                read_time += t
+                nbytes += b
+                shared_time += run_shared_stages(events, scales, args.pt_min)
+            analysis_time = sum(run_analysis_stages(jets) for _ in range(args.nanalyses))
+            timings[mode] = (read_time, nbytes, shared_time, analysis_time)
+
+    print(f"{args.nanalyses} analyses, {args.nvariations} shape variations, {args.nevents} events")
+    print(f"{'mode':>12} {'read [ms]':>10} {'read [MB]':>10} {'shared [ms]':>12} {'analyses [ms]':>14} {'total [ms]':>11}")
+    for mode, (read_time, nbytes, shared_time, analysis_time) in timings.items():
+        total = read_time + shared_time + analysis_time
+        print(f"{mode:>12} {1e3 * read_time:>10.1f} {nbytes / 1e6:>10.1f} {1e3 * shared_time:>12.1f} {1e3 * analysis_time:>14.1f} {1e3 * total:>11.1f}")
+    total = {mode : t[0] + t[2] + t[3] for mode, t in timings.items()}
+    print(f"Speedup of the single pass: {total['separate'] / total['single pass']:.2f}x, "
+          f"bytes read reduced by {timings['separate'][1] / timings['single pass'][1]:.1f}x")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the evaluation of the (pT, eta, tau21) reweighting of the AK8 jets.
+
+A synthetic reweighting map with the axes of the maps of `scripts/compute_3d_reweighting.py`
+(category, shape variation, variation, jet position, pT, eta, tau21) is saved as a correctionlib JSON file
+and as its dense npz companion. The nominal, statUp and statDown weights of random jets are evaluated with
+correctionlib (one call per variation), with `StackedReweighting` (JSON) and with `DenseReweighting` (npz),
+and the cost per jet of each backend is reported. The weights of the three backends are checked to be identical.
+
+The evaluation over the shape variations of a chunk is then timed with and without the cache of the eta and tau21
+bins (`BinCache`): in each variation the pT of the jets is shifted and a fraction of the jets is not selected,
+as with the jet calibration variations. The time per variation and the time saved by the cache are reported.
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+import hist
+import correctionlib
+import correctionlib.convert
+import correctionlib.schemav2
+
+from mutag_calib.lib.reweighting import StackedReweighting, DenseReweighting, BinCache, write_dense_companion, get_reweighting
+
+# Binning of the reweighting maps
+pt_edges = [300., 320., 340., 360., 380., 400., 450., 500., 550., 600., 700., 800., 900., 2500.]
+eta_edges = [-5., -2., -1.75, -1.5, -1.25, -1., -0.75, -0.5, -0.25, 0., 0.25, 0.5, 0.75, 1., 1.25, 1.5, 1.75, 2., 5.]
+tau21_edges = [0, 0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 1]
+
+def write_map(rng, directory, ncategories, nshape_variations):
+    '''Save a synthetic reweighting map in `directory`, as JSON and npz files. Returns the paths of the files.'''
+    sfhist = hist.Hist(
+        hist.axis.StrCategory([f"cat{i}" for i in range(ncategories)], name="cat"),
+        hist.axis.StrCategory(["nominal"] + [f"shape{i}" for i in range(nshape_variations - 1)], name="shape_variation"),
+        hist.axis.StrCategory(["nominal", "statUp", "statDown"], name="variation"),
+        hist.axis.Integer(0, 2, name="FatJetGood_pos"),
+        hist.axis.Variable(pt_edges, name="FatJetGood_pt"),
+        hist.axis.Variable(eta_edges, name="FatJetGood_eta"),
+        hist.axis.Variable(tau21_edges, name="FatJetGood_tau21"),
+    )
+    sfhist[...] = rng.uniform(0.5, 1.5, sfhist.values().shape)
+    sfhist.label = "out"
+    sfhist.name = "FatJetGood_pt_eta_tau21_corr"
+    cset = correctionlib.schemav2.CorrectionSet(
+        schema_version=2,
+        corrections=[correctionlib.convert.from_histogram(sfhist, flow="clamp")],
+    )
+    json_file = os.path.join(directory, "reweighting.json")
+    with open(json_file, "w") as fout:
+        fout.write(cset.model_dump_json(exclude_unset=True))
+    npz_file = os.path.join(directory, "reweighting.npz")
+    write_dense_companion(sfhist, json_file, npz_file)
+    return json_file, npz_file
+
+def generate_jets(rng, n):
+    '''Returns the position, pT, eta and tau21 of `n` jets, including values outside of the map and on the edges.'''
+    pos = rng.integers(0, 2, n)
+    pt = (250. + rng.exponential(300., n)).astype(np.float32)
+    eta = rng.uniform(-2.5, 2.5, n).astype(np.float32)
+    tau21 = rng.uniform(0., 1., n).astype(np.float32)
+    edges = rng.random(n) < 0.01
+    pt[edges] = rng.choice(pt_edges, np.sum(edges))
+    eta[edges] = rng.choice(eta_edges, np.sum(edges))
+    tau21[edges] = rng.choice(tau21_edges, np.sum(edges))
+    return pos, pt, eta, tau21
+
+def generate_variations(rng, jets, nvariations, fraction_selected=0.9, pt_shift=0.03):
+    '''Returns the index in the chunk and the inputs of the jets selected in each shape variation:
+    the pT of the jets is scaled by a random factor and a random fraction of the jets is selected.
+    The first variation is the nominal one, with all the jets and the nominal pT.'''
+    pos, pt, eta, tau21 = jets
+    variations = [(np.arange(len(pt)), jets)]
+    for _ in range(nvariations - 1):
+        index = np.nonzero(rng.random(len(pt)) < fraction_selected)[0]
+        shifted = (pt[index] * (1 + pt_shift * rng.standard_normal(len(index)))).astype(np.float32)
+        variations.append((index, (pos[index], shifted, eta[index], tau21[index])))
+    return variations
+
+def evaluate_variations(maps, variations, njets, cached_inputs):
+    '''Evaluates the weights of all the shape variations of a chunk, with a new cache of the bins of `cached_inputs`.'''
+    bin_cache = BinCache(njets, cached_inputs) if cached_inputs else None
+    return [reweighting.evaluate(*jets, bin_cache=bin_cache, jet_index=index) for reweighting, (index, jets) in zip(maps, variations)]
+
+def time_function(function, repeat):
+    '''Returns the best wall time out of `repeat` calls, and the output of the function.'''
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        output = function()
+        timings.append(time.perf_counter() - t0)
+    return min(timings), output
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the evaluation of the (pT, eta, tau21) reweighting of the AK8 jets.")
+    parser.add_argument('-n', '--njets', type=int, nargs='+', default=[10000, 100000, 1000000], help="Numbers of jets.")
+    parser.add_argument('--ncategories', type=int, default=5, help="Number of categories of the map.")
+    parser.add_argument('--nshape-variations', type=int, default=9, help="Number of shape variations of the map.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of repetitions for each measurement.")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the random number generator.")
+    parser.add_argument('--chunk-njets', type=int, default=200000, help="Number of jets of the chunk for the benchmark of the shape variations.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    fixed = {"cat" : "cat0", "shape_variation" : "nominal"}
+    with tempfile.TemporaryDirectory() as directory:
+        json_file, npz_file = write_map(rng, directory, args.ncategories, args.nshape_variations)
+        print(f"Map: {os.path.getsize(json_file) / 1024**2:.1f} MB (JSON), {os.path.getsize(npz_file) / 1024**2:.2f} MB (npz)")
+        corr = correctionlib.CorrectionSet.from_file(json_file)["FatJetGood_pt_eta_tau21_corr"]
+        load_time = {}
+        load_time["stacked"], stacked = time_function(lambda: get_reweighting(json_file, fixed), 1)
+        load_time["dense"], dense = time_function(lambda: get_reweighting(npz_file, fixed), 1)
+        assert isinstance(stacked, StackedReweighting) and isinstance(dense, DenseReweighting)
+        print(f"Loading: {1e3 * load_time['stacked']:.1f} ms (StackedReweighting), {1e3 * load_time['dense']:.1f} ms (DenseReweighting)")
+
+        backends = {
+            "correctionlib" : lambda jets: np.stack([corr.evaluate(*fixed.values(), var, *jets) for var in ["nominal", "statUp", "statDown"]]),
+            "stacked" : lambda jets: stacked.evaluate(*jets),
+            "dense" : lambda jets: dense.evaluate(*jets),
+        }
+        print(f"{'njets':>9} " + " ".join(f"{name + ' [ns/jet]':>24}" for name in backends))
+        for n in args.njets:
+            jets = generate_jets(rng, n)
+            timings = {}
+            outputs = {}
+            for name, function in backends.items():
+                timings[name], outputs[name] = time_function(lambda: function(jets), args.repeat)
+            for name in ["stacked", "dense"]:
+                assert np.array_equal(outputs[name], outputs["correctionlib"]), f"The {name} weights do not match the correctionlib ones."
+            print(f"{n:>9} " + " ".join(f"{1e9 * timings[name] / n:>24.1f}" for name in backends))
+
+        # Evaluation over the shape variations of a chunk, with and without the cache of the eta and tau21 bins
+        shape_variations = ["nominal"] + [f"shape{i}" for i in range(args.nshape_variations - 1)]
+        cached_inputs = ["FatJetGood_eta", "FatJetGood_tau21"]
+        variations = generate_variations(rng, generate_jets(rng, args.chunk_njets), len(shape_variations))
+        print()
+        print(f"Shape variations: {len(shape_variations)} variations of a chunk with {args.chunk_njets} jets")
+        print(f"{'backend':>9} {'no cache [ms/variation]':>24} {'cache [ms/variation]':>24} {'saved [ms/variation]':>24}")
+        for name, path in [("stacked", json_file), ("dense", npz_file)]:
+            maps = [get_reweighting(path, {"cat" : "cat0", "shape_variation" : variation}) for variation in shape_variations]
+            t_nocache, nocache = time_function(lambda: evaluate_variations(maps, variations, args.chunk_njets, []), args.repeat)
+            t_cache, cache = time_function(lambda: evaluate_variations(maps, variations, args.chunk_njets, cached_inputs), args.repeat)
+            assert all(np.array_equal(a, b) for a, b in zip(nocache, cache)), f"The {name} weights with the bin cache do not match the ones without cache."
+            nvar = len(shape_variations)
+            print(f"{name:>9} {1e3 * t_nocache / nvar:>24.2f} {1e3 * t_cache / nvar:>24.2f} {1e3 * (t_nocache - t_cache) / nvar:>24.2f}")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the computation of the SV mass observables of the AK8 jets.
+
+Synthetic events with AK8 jets and SV are generated and the SV are matched to the jets.
+The time needed to compute the corrected SV mass, the summed corrected mass, the mass of the
+SV with the largest dxySig and their logs is measured with the awkward functions
+(`get_corrmass`, `get_sumcorrmass`, `get_sv1mass`) and with the fused `get_sv_mass_observables`.
+The outputs of the two implementations are checked to be identical.
+"""
+
+import time
+import argparse
+import numpy as np
+import awkward as ak
+from coffea.nanoevents.methods import candidate, nanoaod
+
+from mutag_calib.lib.deltar_matching import run_deltar_matching
+from mutag_calib.lib.sv import get_corrmass, get_sumcorrmass, get_sv1mass, get_sv_mass_observables
+from synthetic_events import generate_collection, generate_sv
+
+def run_awkward(sv):
+    '''Current path: correct the SV mass, then compute the sum and the leading SV mass with vector objects.'''
+    sv = ak.with_field(sv, get_corrmass(sv), "mass")
+    sumcorrmass, logsumcorrmass = get_sumcorrmass(sv)
+    index_max_dxySig = ak.argsort(sv.dxySig, ascending=False)
+    sv1mass, logsv1mass = get_sv1mass(sv[index_max_dxySig])
+    return sv.mass, sumcorrmass, logsumcorrmass, sv1mass, logsv1mass
+
+def run_fused(sv):
+    '''Fused path: all the observables are computed from the flat SV buffers.'''
+    corrmass, sumcorrmass, logsumcorrmass, sv1mass, logsv1mass = get_sv_mass_observables(sv)
+    return corrmass, sumcorrmass, logsumcorrmass, sv1mass[:,0], logsv1mass[:,0]
+
+def time_function(function, sv, repeat):
+    '''Returns the best wall time out of `repeat` calls, and the output of the function.'''
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        output = function(sv)
+        timings.append(time.perf_counter() - t0)
+    return min(timings), output
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the computation of the SV mass observables of the AK8 jets.")
+    parser.add_argument('-n', '--nevents', type=int, default=400000, help="Number of events per chunk.")
+    parser.add_argument('--njets', type=float, default=1.5, help="Average number of AK8 jets per event.")
+    parser.add_argument('--nsv', type=float, default=3., help="Average number of SV per event.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of repetitions for each measurement.")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the random number generator.")
+    args = parser.parse_args()
+
+    ak.behavior.update(candidate.behavior)
+    ak.behavior.update(nanoaod.behavior)
+    rng = np.random.default_rng(args.seed)
+    # At least one AK8 jet per event is required, as in the preselection of fatjetBaseProcessor
+    jets = generate_collection(rng, 1 + rng.poisson(args.njets - 1, args.nevents), eta_max=2.4)
+    sv = run_deltar_matching(jets, generate_sv(rng, rng.poisson(args.nsv, args.nevents)), radius=0.8)
+
+    # Compile the kernel before timing
+    get_sv_mass_observables(sv[:10])
+
+    timings = {}
+    outputs = {}
+    for name, function in [("awkward", run_awkward), ("fused", run_fused)]:
+        timings[name], outputs[name] = time_function(function, sv, args.repeat)
+
+    names = ["corrmass", "sumcorrmass", "logsumcorrmass", "sv1mass", "logsv1mass"]
+    for name, reference, fused in zip(names, outputs["awkward"], outputs["fused"]):
+        reference = ak.to_numpy(ak.flatten(reference, axis=None))
+        fused = ak.to_numpy(ak.flatten(fused, axis=None))
+        assert np.array_equal(reference, fused, equal_nan=True), f"The fused '{name}' does not match the awkward implementation."
+
+    print(f"{args.nevents} events, {ak.sum(ak.num(jets))} AK8 jets, {ak.count(sv.pt)} matched SV")
+    for name in timings:
+        print(f"{name:>10}: {1e3 * timings[name]:>10.1f} ms")
+    print(f"{'speedup':>10}: {timings['awkward'] / timings['fused']:>10.1f}")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the attachment of the derived fields to the FatJetGood collection.
+
+Synthetic events with AK8 jets are generated and a leading-jets selection is applied, as in the workflows.
+The derived observables of the AK8 jets are attached to the collection either with one `ak.with_field` call
+per field, each call rebuilding the collection, or with a single `with_fields` call.
+The wall time and the memory allocated for the new buffers of all the intermediate collections are reported per chunk.
+The memory is measured with the glibc `mallinfo2` counters (Linux only), keeping all the intermediate collections alive.
+The outputs of the two methods are checked to be identical.
+"""
+
+import time
+import argparse
+import ctypes
+import numpy as np
+import awkward as ak
+from coffea.nanoevents.methods import candidate, nanoaod
+
+from mutag_calib.lib.fields import with_fields
+from synthetic_events import generate_collection
+
+class MallInfo2(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_size_t) for name in
+                ["arena", "ordblks", "smblks", "hblks", "hblkhd", "usmblks", "fsmblks", "uordblks", "fordblks", "keepcost"]]
+
+def allocated_memory():
+    '''Returns the memory currently allocated with malloc, including the mmapped buffers.'''
+    mallinfo2 = ctypes.CDLL("libc.so.6").mallinfo2
+    mallinfo2.restype = MallInfo2
+    info = mallinfo2()
+    return info.uordblks + info.hblkhd
+
+def derived_fields(jets):
+    '''Derived observables of the AK8 jets, as the ones attached to FatJetGood in fatjetBaseProcessor.'''
+    return {
+        "tau21" : jets.tau2 / jets.tau1,
+        "nMuonGoodMatchedToFatJetGood" : ak.local_index(jets, axis=1) % 2,
+        "nMuonGoodMatchedToSubJet" : ak.local_index(jets, axis=1) % 3,
+        "nMuonGoodMatchedUniquelyToSubJet" : ak.local_index(jets, axis=1) % 2,
+        "sumcorrSVmass" : jets.mass / 10.,
+        "logsumcorrSVmass" : np.log(jets.mass / 10.),
+        # Per-event value, broadcast to all the jets of the event
+        "sv1mass" : jets.mass[:,0],
+        "pos" : ak.local_index(jets, axis=1),
+    }
+
+def run_with_field(jets, fields, intermediates=None):
+    '''Current path: one `ak.with_field` call per field.'''
+    for field, value in fields.items():
+        jets = ak.with_field(jets, value, field)
+        if intermediates is not None:
+            intermediates.append(jets)
+    return jets
+
+def run_with_fields(jets, fields, intermediates=None):
+    '''Bulk path: all the fields are attached with a single `with_fields` call.'''
+    return with_fields(jets, fields)
+
+def measure(function, jets, fields, repeat):
+    '''Returns the best wall time out of `repeat` calls, the memory allocated for the output and
+    the intermediate collections of one call, and the output of the function.'''
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        output = function(jets, fields)
+        timings.append(time.perf_counter() - t0)
+    del output
+    intermediates = []
+    before = allocated_memory()
+    output = function(jets, fields, intermediates)
+    allocated = allocated_memory() - before
+    return min(timings), allocated, output
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the attachment of the derived fields to the FatJetGood collection.")
+    parser.add_argument('-n', '--nevents', type=int, default=400000, help="Number of events per chunk.")
+    parser.add_argument('--njets', type=float, default=1.5, help="Average number of AK8 jets per event.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of repetitions for each measurement.")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the random number generator.")
+    args = parser.parse_args()
+
+    ak.behavior.update(candidate.behavior)
+    ak.behavior.update(nanoaod.behavior)
+    rng = np.random.default_rng(args.seed)
+    counts = 1 + rng.poisson(args.njets - 1, args.nevents)
+    jets = generate_collection(rng, counts, eta_max=2.4)
+    jets = ak.with_field(jets, ak.unflatten(rng.uniform(0.05, 1., np.sum(counts)).astype(np.float32), counts), "tau1")
+    jets = ak.with_field(jets, jets.tau1 * ak.unflatten(rng.uniform(0., 1., np.sum(counts)).astype(np.float32), counts), "tau2")
+    # Restrict to the leading and subleading jets, as in the workflows
+    jets = jets[ak.local_index(jets, axis=1) < 2]
+    fields = derived_fields(jets)
+
+    results = {}
+    for name, function in [("with_field", run_with_field), ("with_fields", run_with_fields)]:
+        results[name] = measure(function, jets, fields, args.repeat)
+
+    reference, bulk = results["with_field"][-1], results["with_fields"][-1]
+    assert reference.fields == bulk.fields, "The fields of the two outputs are different."
+    for field in reference.fields:
+        assert str(reference[field].type) == str(bulk[field].type), f"The type of the field '{field}' is different."
+        assert ak.all(ak.flatten(reference[field], axis=None) == ak.flatten(bulk[field], axis=None)), f"The field '{field}' is different."
+
+    print(f"{args.nevents} events, {ak.sum(ak.num(jets))} AK8 jets, {len(fields)} fields")
+    print(f"{'method':>12} {'time [ms]':>10} {'alloc [MB]':>11}")
+    for name, (timing, allocated, _) in results.items():
+        print(f"{name:>12} {1e3 * timing:>10.1f} {allocated / 1024**2:>11.1f}")
+    print(f"{'speedup':>12} {results['with_field'][0] / results['with_fields'][0]:>10.1f}")
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""
+Microbenchmark suite of the functions of `mutag_calib.lib`.
+
+Synthetic NanoAOD-like events (see `synthetic_events.py`) are generated for several numbers of events,
+and each function of the deltaR matching, muon matching, SV and lepton modules is timed on them.
+Each measurement runs in a forked process, so that the peak memory of the function is isolated:
+the report contains the best wall time, the throughput in events per second and the increase
+of the peak resident memory with respect to the memory of the inputs.
+The numba kernels are compiled before the measurement.
+
+The results are printed and can be saved in a JSON file with `--output`.
+A previous JSON file can be passed with `--compare` to print the ratio of the timings and
+of the peak memory with respect to it, e.g. to compare two commits:
+
+    python run_microbenchmarks.py --output before.json
+    git checkout <commit>
+    python run_microbenchmarks.py --compare before.json
+
+The peak memory is read from /proc, therefore the suite runs on Linux only.
+"""
+
+import os
+import sys
+import json
+import time
+import ctypes
+import argparse
+import platform
+import subprocess
+import multiprocessing
+from types import SimpleNamespace
+import numpy as np
+import awkward as ak
+import numba
+import coffea
+from omegaconf import OmegaConf
+
+from mutag_calib.lib.deltar_matching import run_deltar_matching, run_deltar_matching_multi
+from mutag_calib.lib.muon_matching import muons_matched_to_fatjet, muon_matched_to_subjet, muons_matched_to_subjets
+from mutag_calib.lib.sv import sv_matched_to_fatjet, get_corrmass, get_sumcorrmass, get_sv_mass_observables
+from mutag_calib.lib.leptons import lepton_selection_noniso
+from synthetic_events import generate_events
+
+# Object preselection of the mutag workflows, used by the lepton selection
+params_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../configs/params/object_preselection.yaml")
+
+# Parameter of mallopt (see malloc.h)
+M_MMAP_THRESHOLD = -3
+
+# Functions of the suite, by name. Each function takes the prepared events and the processor parameters.
+benchmarks = {
+    "deltar_matching.run_deltar_matching[numba]" : lambda events, params: run_deltar_matching(events.FatJetGood, events.MuonGood, radius=0.8, backend="numba"),
+    "deltar_matching.run_deltar_matching[sweep]" : lambda events, params: run_deltar_matching(events.FatJetGood, events.MuonGood, radius=0.8, backend="sweep"),
+    "deltar_matching.run_deltar_matching[awkward]" : lambda events, params: run_deltar_matching(events.FatJetGood, events.MuonGood, radius=0.8, backend="awkward"),
+    "deltar_matching.run_deltar_matching_multi" : lambda events, params: run_deltar_matching_multi(events.FatJetGood, [(events.MuonGood, 0.8), (events.SV, 0.8)]),
+    "muon_matching.muons_matched_to_fatjet" : lambda events, params: muons_matched_to_fatjet(events),
+    "muon_matching.muon_matched_to_subjet" : lambda events, params: muon_matched_to_subjet(events, pos=0, unique=True),
+    "muon_matching.muons_matched_to_subjets" : lambda events, params: muons_matched_to_subjets(events),
+    "sv.sv_matched_to_fatjet" : lambda events, params: sv_matched_to_fatjet(events),
+    "sv.get_corrmass" : lambda events, params: get_corrmass(events.SVMatchedToFatJetGood),
+    "sv.get_sumcorrmass" : lambda events, params: get_sumcorrmass(ak.with_field(events.SVMatchedToFatJetGood, get_corrmass(events.SVMatchedToFatJetGood), "mass")),
+    "sv.get_sv_mass_observables" : lambda events, params: get_sv_mass_observables(events.SVMatchedToFatJetGood),
+    "leptons.lepton_selection_noniso" : lambda events, params: lepton_selection_noniso(events, "Muon", params),
+}
+
+def prepare_events(nevents, args):
+    '''Generate the synthetic events and define the collections used as input by the functions of the suite.'''
+    events = generate_events(nevents, njets=args.njets, nmuons=args.nmuons, nsv=args.nsv, seed=args.seed)
+    # The AK8 jets with two subjets are selected, as in the subjet muon tagging
+    events["FatJetGood"] = events.FatJet[ak.num(events.FatJet.subjets, axis=2) == 2]
+    events["MuonGood"] = events.Muon
+    events["SVMatchedToFatJetGood"] = run_deltar_matching(events.FatJetGood, events.SV, radius=0.8)
+    return events
+
+def resident_memory(field="VmRSS"):
+    '''Returns the current (VmRSS) or peak (VmHWM) resident memory of the process in bytes.'''
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1]) * 1024
+
+def _measure(connection, function, events, params, repeat):
+    '''Runs in the forked process: compiles the kernels on a slice of the events,
+    then sends the timings of `repeat` calls and the increase of the peak resident memory.'''
+    function(events[:100], params)
+    # Release the free memory of the heap and allocate the large buffers with mmap, so that the memory
+    # allocated by the function is not hidden by the memory freed before the measurement
+    libc = ctypes.CDLL("libc.so.6")
+    libc.mallopt(M_MMAP_THRESHOLD, 128 * 1024)
+    libc.malloc_trim(0)
+    # Reset the peak resident memory to the current one, to exclude the compilation of the kernels
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    start = resident_memory("VmRSS")
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function(events, params)
+        timings.append(time.perf_counter() - t0)
+    peak = resident_memory("VmHWM")
+    connection.send((timings, max(peak - start, 0)))
+    connection.close()
+
+def measure(function, events, params, repeat):
+    '''Returns the timings and the peak memory increase of `function`, measured in a forked process.'''
+    context = multiprocessing.get_context("fork")
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=_measure, args=(child, function, events, params, repeat))
+    process.start()
+    child.close()
+    timings, peak = parent.recv()
+    process.join()
+    return timings, peak
+
+def get_metadata(args):
+    '''Returns the environment of the measurement, saved in the output to compare the results.'''
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit" : commit,
+        "date" : time.strftime("%Y-%m-%d %H:%M:%S"),
+        "host" : platform.node(),
+        "processor" : platform.processor() or platform.machine(),
+        "cpu_count" : os.cpu_count(),
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "awkward" : ak.__version__,
+        "numba" : numba.__version__,
+        "coffea" : coffea.__version__,
+        "njets" : args.njets,
+        "nmuons" : args.nmuons,
+        "nsv" : args.nsv,
+        "seed" : args.seed,
+        "repeat" : args.repeat,
+    }
+
+def compare(results, reference):
+    '''Print the ratio of the timings and peak memory of `results` with respect to the `reference` output.'''
+    print()
+    print(f"Comparison with commit {reference['metadata'].get('commit')}: ratio new/reference")
+    reference = {(r["benchmark"], r["nevents"]) : r for r in reference["results"]}
+    print(f"{'benchmark':<48} {'nevents':>9} {'time':>8} {'peak':>8}")
+    for r in results:
+        key = (r["benchmark"], r["nevents"])
+        if key not in reference:
+            continue
+        ref = reference[key]
+        time_ratio = r["time"] / ref["time"]
+        peak_ratio = r["peak_memory"] / ref["peak_memory"] if ref["peak_memory"] > 0 else float("nan")
+        print(f"{r['benchmark']:<48} {r['nevents']:>9} {time_ratio:>8.2f} {peak_ratio:>8.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark suite of the functions of mutag_calib.lib.")
+    parser.add_argument('-n', '--nevents', type=int, nargs='+', default=[10000, 100000, 400000], help="Numbers of events of the chunks.")
+    parser.add_argument('--njets', type=float, default=1.5, help="Average number of AK8 jets per event.")
+    parser.add_argument('--nmuons', type=float, default=2., help="Average number of muons per event.")
+    parser.add_argument('--nsv', type=float, default=3., help="Average number of SV per event.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of repetitions for each measurement.")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the random number generator.")
+    parser.add_argument('-k', '--filter', type=str, nargs='+', default=None, help="Run only the benchmarks containing one of these strings.")
+    parser.add_argument('-o', '--output', type=str, default=None, help="Output JSON file with the results.")
+    parser.add_argument('--compare', type=str, default=None, help="JSON file with reference results to compare with.")
+    args = parser.parse_args()
+
+    if not sys.platform.startswith("linux"):
+        sys.exit("The microbenchmark suite runs on Linux only.")
+    if args.filter:
+        benchmarks = {name : function for name, function in benchmarks.items() if any(f in name for f in args.filter)}
+    params = SimpleNamespace(object_preselection=OmegaConf.to_container(OmegaConf.load(params_file))["object_preselection"])
+    metadata = get_metadata(args)
+    print(f"commit {metadata['commit']}, {metadata['processor']}, python {metadata['python']}, awkward {metadata['awkward']}, numba {metadata['numba']}")
+
+    results = []
+    print(f"{'benchmark':<48} {'nevents':>9} {'time [ms]':>10} {'events/s':>10} {'peak [MB]':>10}")
+    for nevents in args.nevents:
+        events = prepare_events(nevents, args)
+        for name, function in benchmarks.items():
+            timings, peak = measure(function, events, params, args.repeat)
+            results.append({
+                "benchmark" : name,
+                "nevents" : nevents,
+                "time" : min(timings),
+                "timings" : timings,
+                "throughput" : nevents / min(timings),
+                "peak_memory" : peak,
+            })
+            print(f"{name:<48} {nevents:>9} {1e3 * min(timings):>10.1f} {nevents / min(timings):>10.3g} {peak / 1024**2:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata" : metadata, "results" : results}, f, indent=2)
+        print(f"Results saved in {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
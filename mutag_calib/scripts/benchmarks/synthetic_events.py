@@ -0,0 +1,148 @@
+"""
+Generator of synthetic NanoAOD-like events for the benchmarks of `mutag_calib.lib`.
+
+The events contain the collections used by the mutag workflows, with the NanoAOD field names and types:
+AK8 jets (`FatJet`) with their subjets, muons (`Muon`) and secondary vertices (`SV`).
+The multiplicities of the collections are drawn from Poisson distributions with configurable averages.
+A fraction of the muons and SV is generated inside the AK8 jets, so that the matching to the jets
+and to the subjets is exercised as in real events.
+The generator only depends on numpy, awkward and the coffea behaviors, and runs offline.
+"""
+
+import numpy as np
+import awkward as ak
+from coffea.nanoevents.methods import candidate, nanoaod
+
+def generate_collection(rng, counts, eta_max=2.5):
+    '''Generate a jagged collection of PtEtaPhiMCandidate objects with `counts` objects per event.'''
+    n = np.sum(counts)
+    objects = ak.zip(
+        {
+            "pt": rng.exponential(50., n).astype(np.float32),
+            "eta": rng.uniform(-eta_max, eta_max, n).astype(np.float32),
+            "phi": rng.uniform(-np.pi, np.pi, n).astype(np.float32),
+            "mass": rng.uniform(0., 5., n).astype(np.float32),
+            "charge": np.zeros(n, dtype=np.int32),
+        },
+        with_name="PtEtaPhiMCandidate",
+        behavior=candidate.behavior,
+    )
+    return ak.unflatten(objects, counts)
+
+def generate_sv(rng, counts):
+    '''Generate a jagged collection of SecondaryVertex objects with `counts` objects per event.'''
+    n = np.sum(counts)
+    sv = ak.zip(
+        {
+            "pt": rng.exponential(20., n).astype(np.float32),
+            "eta": rng.uniform(-2.5, 2.5, n).astype(np.float32),
+            "phi": rng.uniform(-np.pi, np.pi, n).astype(np.float32),
+            "mass": rng.uniform(0.3, 6., n).astype(np.float32),
+            "pAngle": rng.exponential(0.05, n).astype(np.float32),
+            "dxySig": rng.exponential(10., n).astype(np.float32),
+        },
+        with_name="SecondaryVertex",
+        behavior=nanoaod.behavior,
+    )
+    return ak.unflatten(sv, counts)
+
+def _around_leading_jet(rng, counts, jet_eta, jet_phi, fraction, spread):
+    '''Returns the (eta, phi) of `sum(counts)` objects: a `fraction` of them is generated around
+    the leading AK8 jet of the event with a gaussian spread, the others uniformly.'''
+    n = np.sum(counts)
+    event = np.repeat(np.arange(len(counts)), counts)
+    eta = rng.uniform(-2.4, 2.4, n)
+    phi = rng.uniform(-np.pi, np.pi, n)
+    inside = rng.random(n) < fraction
+    eta[inside] = np.clip(jet_eta[event[inside]] + rng.normal(0., spread, np.sum(inside)), -2.4, 2.4)
+    phi[inside] = np.mod(jet_phi[event[inside]] + rng.normal(0., spread, np.sum(inside)) + np.pi, 2 * np.pi) - np.pi
+    return eta.astype(np.float32), phi.astype(np.float32)
+
+def generate_events(nevents, njets=1.5, nmuons=2., nsv=3., fraction_in_jet=0.5, seed=42):
+    '''Generate `nevents` synthetic events with the FatJet, Muon and SV collections.
+    The average multiplicities of the collections are given by `njets`, `nmuons` and `nsv`.
+    Each event contains at least one AK8 jet, as after the preselection of the mutag workflows.
+    Each AK8 jet has two subjets in 90% of the cases, one otherwise.
+    A fraction `fraction_in_jet` of the muons and SV is generated within dR~0.4 of the leading AK8 jet.
+    '''
+    rng = np.random.default_rng(seed)
+
+    # AK8 jets
+    counts_jet = 1 + rng.poisson(max(njets - 1, 0.), nevents)
+    n = np.sum(counts_jet)
+    counts_subjet = np.where(rng.random(n) < 0.9, 2, 1)
+    nsub = np.sum(counts_subjet)
+    jet_eta = rng.uniform(-2.4, 2.4, n).astype(np.float32)
+    jet_phi = rng.uniform(-np.pi, np.pi, n).astype(np.float32)
+    jet_index = np.repeat(np.arange(n), counts_subjet)
+    subjets = ak.zip(
+        {
+            "pt": rng.exponential(150., nsub).astype(np.float32),
+            "eta": (jet_eta[jet_index] + rng.normal(0., 0.3, nsub)).astype(np.float32),
+            "phi": (np.mod(jet_phi[jet_index] + rng.normal(0., 0.3, nsub) + np.pi, 2 * np.pi) - np.pi).astype(np.float32),
+            "mass": rng.uniform(0., 40., nsub).astype(np.float32),
+        },
+        with_name="PtEtaPhiMCandidate",
+    )
+    tau1 = rng.uniform(0.05, 1., n).astype(np.float32)
+    fatjets = ak.zip(
+        {
+            "pt": (300. + rng.exponential(150., n)).astype(np.float32),
+            "eta": jet_eta,
+            "phi": jet_phi,
+            "mass": rng.uniform(20., 250., n).astype(np.float32),
+            "msoftdrop": rng.uniform(0., 250., n).astype(np.float32),
+            "tau1": tau1,
+            "tau2": (tau1 * rng.uniform(0., 1., n)).astype(np.float32),
+            "jetId": np.full(n, 6, dtype=np.int32),
+            "subjets": ak.unflatten(subjets, counts_subjet),
+        },
+        # The NanoAOD FatJet behavior is not used, since it resolves the subjets from the SubJet collection
+        with_name="PtEtaPhiMCandidate",
+        depth_limit=1,
+    )
+    first_jet = np.concatenate([[0], np.cumsum(counts_jet)[:-1]])
+    leading_eta, leading_phi = jet_eta[first_jet], jet_phi[first_jet]
+
+    # Muons
+    counts_muon = rng.poisson(nmuons, nevents)
+    n = np.sum(counts_muon)
+    eta, phi = _around_leading_jet(rng, counts_muon, leading_eta, leading_phi, fraction_in_jet, 0.4)
+    muons = ak.zip(
+        {
+            "pt": (3. + rng.exponential(10., n)).astype(np.float32),
+            "eta": eta,
+            "phi": phi,
+            "mass": np.full(n, 0.10566, dtype=np.float32),
+            "charge": rng.choice(np.array([-1, 1], dtype=np.int32), n),
+            "pfRelIso04_all": rng.exponential(0.3, n).astype(np.float32),
+            "tightId": rng.random(n) < 0.8,
+        },
+        with_name="Muon",
+    )
+
+    # Secondary vertices
+    counts_sv = rng.poisson(nsv, nevents)
+    n = np.sum(counts_sv)
+    eta, phi = _around_leading_jet(rng, counts_sv, leading_eta, leading_phi, fraction_in_jet, 0.4)
+    sv = ak.zip(
+        {
+            "pt": rng.exponential(20., n).astype(np.float32),
+            "eta": eta,
+            "phi": phi,
+            "mass": rng.uniform(0.3, 6., n).astype(np.float32),
+            "pAngle": rng.exponential(0.05, n).astype(np.float32),
+            "dxySig": rng.exponential(10., n).astype(np.float32),
+        },
+        with_name="SecondaryVertex",
+    )
+
+    return ak.zip(
+        {
+            "FatJet": ak.unflatten(fatjets, counts_jet),
+            "Muon": ak.unflatten(muons, counts_muon),
+            "SV": ak.unflatten(sv, counts_sv),
+        },
+        depth_limit=1,
+        behavior=nanoaod.behavior,
+    )
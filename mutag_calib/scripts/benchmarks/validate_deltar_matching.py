@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+Equivalence test of the backends of `run_deltar_matching` against the reference awkward implementation.
+
+Synthetic events with AK8 jets and muon-like objects are generated in float32 and float64. A fraction of the objects
+is placed on the edge of the matching cone of a jet (dR equal to the radius up to a few units in the last place),
+at the phi wrap-around, and at the same distance from two jets, so that the rounding of the deltaR computation
+and the tie-breaking of the closest jet are exercised. The matching is run with a scalar radius and with a radius
+per jet, for the single and multi-collection interfaces, and the matched objects and their dR are required to be
+identical to the ones of the awkward backend. The script exits with an error at the first difference.
+"""
+
+import sys
+import argparse
+import numpy as np
+import awkward as ak
+from coffea.nanoevents.methods import candidate
+
+from mutag_calib.lib.deltar_matching import run_deltar_matching, run_deltar_matching_multi
+from synthetic_events import generate_collection
+
+def generate_edge_objects(rng, jets, radius, dtype):
+    '''Returns a collection with, in each event, objects on the cone edge of a random jet, objects at the phi
+    wrap-around, objects at the same distance from the first two jets, and uniformly distributed objects.'''
+    njets = ak.to_numpy(ak.num(jets))
+    events = np.repeat(np.arange(len(njets)), 4)
+    start = np.concatenate([[0], np.cumsum(njets)[:-1]])
+    ijet = start[events] + (rng.random(len(events)) * njets[events]).astype(np.int64)
+    eta_jet = ak.to_numpy(ak.flatten(jets.eta)).astype(np.float64)[ijet]
+    phi_jet = ak.to_numpy(ak.flatten(jets.phi)).astype(np.float64)[ijet]
+    radius_jet = np.broadcast_to(np.asarray(radius, dtype=np.float64), (len(ak.flatten(jets.eta)),))[ijet]
+
+    angle = rng.uniform(-np.pi, np.pi, len(events))
+    eta = eta_jet + radius_jet * np.cos(angle)
+    phi = phi_jet + radius_jet * np.sin(angle)
+    kind = np.tile(np.arange(4), len(njets))
+    # Objects at the phi wrap-around, on the cone edge of a jet close to phi = pi
+    phi[kind == 1] = np.pi - 1e-3
+    eta[kind == 1] = eta_jet[kind == 1]
+    # Objects at the same distance from the first two jets of the event (in double precision)
+    has_two = njets[events] >= 2
+    tie = (kind == 2) & has_two
+    eta1 = ak.to_numpy(ak.flatten(jets.eta)).astype(np.float64)[start[events[tie]]]
+    eta2 = ak.to_numpy(ak.flatten(jets.eta)).astype(np.float64)[start[events[tie]] + 1]
+    phi1 = ak.to_numpy(ak.flatten(jets.phi)).astype(np.float64)[start[events[tie]]]
+    phi2 = ak.to_numpy(ak.flatten(jets.phi)).astype(np.float64)[start[events[tie]] + 1]
+    eta[tie] = 0.5 * (eta1 + eta2)
+    phi[tie] = 0.5 * (phi1 + phi2)
+    # Uniformly distributed objects
+    eta[kind == 3] = rng.uniform(-2.5, 2.5, np.sum(kind == 3))
+    phi[kind == 3] = rng.uniform(-np.pi, np.pi, np.sum(kind == 3))
+
+    eta = eta.astype(dtype)
+    phi = np.mod(phi + np.pi, 2 * np.pi).astype(dtype) - dtype(np.pi)
+    # Shift the objects on the cone edge by a few units in the last place, inside and outside the cone
+    edge = kind == 0
+    eta[edge] = eta[edge] + rng.integers(-3, 4, np.sum(edge)) * np.spacing(eta[edge])
+    objects = ak.zip(
+        {
+            "pt": np.ones(len(eta), dtype=dtype),
+            "eta": eta,
+            "phi": phi,
+            "mass": np.zeros(len(eta), dtype=dtype),
+            "charge": np.zeros(len(eta), dtype=np.int32),
+        },
+        with_name="PtEtaPhiMCandidate",
+        behavior=candidate.behavior,
+    )
+    return ak.unflatten(objects, np.full(len(njets), 4))
+
+def compare(matched, reference, label):
+    '''Returns True if the matched collections have the same objects, in the same order, and the same dR.'''
+    same = (
+        ak.to_list(ak.num(matched.pt, axis=2)) == ak.to_list(ak.num(reference.pt, axis=2))
+        and ak.all(ak.flatten(matched.eta, axis=None) == ak.flatten(reference.eta, axis=None))
+        and ak.all(ak.flatten(matched.dR, axis=None) == ak.flatten(reference.dR, axis=None))
+    )
+    print(f"{label:<60} {'OK' if same else 'DIFFERENT'}")
+    return same
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the backends of the deltaR matching give the same output as the awkward backend.")
+    parser.add_argument('-n', '--nevents', type=int, default=20000, help="Number of events.")
+    parser.add_argument('--radius', type=float, default=0.8, help="Matching radius.")
+    parser.add_argument('--backends', type=str, nargs='+', default=["numba", "sweep"], help="Backends to compare with the awkward backend.")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the random number generator.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    success = True
+    for dtype in [np.float32, np.float64]:
+        jets = ak.values_astype(generate_collection(rng, 1 + rng.poisson(1., args.nevents), eta_max=2.4), dtype)
+        radii = {
+            "scalar radius" : args.radius,
+            "radius per jet" : ak.values_astype(args.radius * (0.5 + 0.5 * jets.pt / (jets.pt + 50.)), dtype),
+        }
+        for radius_label, radius in radii.items():
+            objects = generate_edge_objects(rng, jets, ak.to_numpy(ak.flatten(ak.broadcast_arrays(radius, jets.eta)[0])), dtype)
+            others = ak.values_astype(generate_collection(rng, rng.poisson(3., args.nevents)), dtype)
+            reference = run_deltar_matching(jets, objects, radius=radius, backend="awkward")
+            reference_others = run_deltar_matching(jets, others, radius=radius, backend="awkward")
+            for backend in args.backends:
+                label = f"{np.dtype(dtype).name}, {radius_label}, {backend}"
+                success &= compare(run_deltar_matching(jets, objects, radius=radius, backend=backend), reference, label)
+                matched, matched_others = run_deltar_matching_multi(jets, [(objects, radius), (others, radius)], backend=backend)
+                success &= compare(matched, reference, label + ", multi")
+                success &= compare(matched_others, reference_others, label + ", multi (2nd collection)")
+    if not success:
+        sys.exit("The backends of the deltaR matching are not equivalent to the awkward backend.")
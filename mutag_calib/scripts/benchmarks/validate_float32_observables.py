@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+Validation of the float32 mode of the derived FatJetGood observables (`float32_observables` workflow option).
+
+Synthetic events with AK8 jets and SV are generated and the derived observables of the AK8 jets are computed
+in single precision, as in the float32 mode, and in double precision starting from the input branches cast to float64.
+For each observable the report shows the largest absolute difference between the two computations, the width of
+the bins used in the fit templates, the number of jets migrating to a different bin and the largest relative
+difference of the bin contents. The memory of the derived columns is reported for the two precisions.
+"""
+
+import argparse
+import numpy as np
+import awkward as ak
+import hist
+from coffea.nanoevents.methods import candidate, nanoaod
+
+from mutag_calib.lib.deltar_matching import run_deltar_matching
+from mutag_calib.lib.sv import get_sv_mass_observables
+from synthetic_events import generate_collection, generate_sv
+
+# Binning of the fit templates (see `configs/fit_templates`).
+# The logsv1mass is not used in the fit: the binning of logsumcorrSVmass is used as reference.
+binning = {
+    "logsumcorrSVmass" : hist.axis.Regular(42, -2.4, 6),
+    "logsv1mass" : hist.axis.Regular(42, -2.4, 6),
+    "tau21" : hist.axis.Variable([0, 0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 1]),
+}
+
+def compute_observables(jets, sv, dtype):
+    '''Compute the derived observables of the AK8 jets with all the inputs and outputs in the precision `dtype`.'''
+    jets = ak.values_astype(jets, dtype)
+    sv = ak.values_astype(sv, dtype)
+    _, sumcorrmass, logsumcorrmass, sv1mass, logsv1mass = get_sv_mass_observables(sv, dtype=dtype)
+    return {
+        "tau21" : jets.tau2 / jets.tau1,
+        "sumcorrSVmass" : sumcorrmass,
+        "logsumcorrSVmass" : logsumcorrmass,
+        "sv1mass" : sv1mass,
+        "logsv1mass" : logsv1mass,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate the float32 mode of the derived FatJetGood observables.")
+    parser.add_argument('-n', '--nevents', type=int, default=400000, help="Number of events per chunk.")
+    parser.add_argument('--njets', type=float, default=1.5, help="Average number of AK8 jets per event.")
+    parser.add_argument('--nsv', type=float, default=3., help="Average number of SV per event.")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the random number generator.")
+    args = parser.parse_args()
+
+    ak.behavior.update(candidate.behavior)
+    ak.behavior.update(nanoaod.behavior)
+    rng = np.random.default_rng(args.seed)
+    counts = 1 + rng.poisson(args.njets - 1, args.nevents)
+    jets = generate_collection(rng, counts, eta_max=2.4)
+    jets = ak.with_field(jets, ak.unflatten(rng.uniform(0.05, 1., np.sum(counts)).astype(np.float32), counts), "tau1")
+    jets = ak.with_field(jets, jets.tau1 * ak.unflatten(rng.uniform(0., 1., np.sum(counts)).astype(np.float32), counts), "tau2")
+    sv = run_deltar_matching(jets, generate_sv(rng, rng.poisson(args.nsv, args.nevents)), radius=0.8)
+
+    observables = {dtype: compute_observables(jets, sv, dtype) for dtype in [np.float32, np.float64]}
+
+    print(f"{args.nevents} events, {ak.sum(counts)} AK8 jets, {ak.count(sv.pt)} matched SV")
+    print(f"{'observable':>18} {'max |diff|':>12} {'bin width':>12} {'migrations':>12} {'max rel. diff':>14}")
+    for name, axis in binning.items():
+        values = {dtype: ak.to_numpy(ak.flatten(observables[dtype][name])).astype(np.float64) for dtype in observables}
+        finite = np.isfinite(values[np.float32]) & np.isfinite(values[np.float64])
+        max_diff = np.max(np.abs(values[np.float32][finite] - values[np.float64][finite]))
+        migrations = np.sum(axis.index(values[np.float32]) != axis.index(values[np.float64]))
+        contents = {dtype: hist.Hist(axis).fill(values[dtype]).values(flow=True) for dtype in values}
+        rel_diff = np.max(np.abs(contents[np.float32] - contents[np.float64]) / np.maximum(contents[np.float64], 1))
+        print(f"{name:>18} {max_diff:>12.2e} {np.min(axis.widths):>12.2e} {migrations:>12} {rel_diff:>14.2e}")
+
+    print()
+    for dtype, fields in observables.items():
+        nbytes = sum(ak.flatten(value).layout.nbytes for value in fields.values())
+        print(f"Memory of the derived columns in {np.dtype(dtype).name}: {nbytes / 1024**2:.1f} MB")
@@ -8,6 +8,8 @@ import correctionlib.convert
 import rich
 from coffea.util import save, load
 
+from mutag_calib.lib.reweighting import write_dense_companion
+
 def dense_axes(h):
     '''Returns the list of dense axes of a histogram.'''
     dense_axes = []
@@ -145,12 +147,17 @@ def pt_reweighting(accumulator, histname, output, test=False, overwrite=False):
 
         os.makedirs(output, exist_ok=True)
         outfile_reweighting = os.path.join(output, f'{histname}_{year}_reweighting.json')
+        # Dense binary companion of the correction, evaluated by `DenseReweighting`
+        outfile_dense = outfile_reweighting.replace(".json", ".npz")
         if not overwrite:
             overwrite_check(outfile_reweighting)
+            overwrite_check(outfile_dense)
         print(f"Saving pt reweighting factors in {outfile_reweighting}")
         with open(outfile_reweighting, "w") as fout:
             fout.write(cset.model_dump_json(exclude_unset=True))
         fout.close()
+        print(f"Saving dense reweighting map in {outfile_dense}")
+        write_dense_companion(sfhist, outfile_reweighting, outfile_dense)
         if test:
             print(f"Loading correction from {outfile_reweighting}")
             cset = correctionlib.CorrectionSet.from_file(os.path.abspath(outfile_reweighting))
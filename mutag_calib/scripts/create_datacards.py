@@ -275,8 +275,37 @@ def add_Madgraph_systematic(histogram_logsumSVmass_tau21):
                 raise ValueError(f"ratio > 2 for flavor {flav}, cannot create down variation")
             histogram_logsumSVmass_tau21[mu_name][dataset] = new_hist
 
-def get_1d_histogram(h2d_dict, tau21_cut):
-    """Function to get the 1D histogram from the 2D histogram by integrating over the axis corresponding to tau21."""
+def get_cumulative_tau21_histogram(h2d_dict):
+    """Function to convert the 2D histograms to a cumulative representation along the axis corresponding to tau21.
+
+    For each dataset, the bin i of the tau21 axis of the returned histogram contains the sum
+    of the bins 0 to i of the input histogram, for the values and for the variances.
+    The underflow and overflow bins of the tau21 axis are not included in the sums, as in the
+    integration of get_1d_histogram, so that the template with the cut ``tau21 < tau21_cut``
+    is the single bin of the cumulative histogram below the cut.
+    """
+    hcum_dict = {}
+    for proc, ds_dict in h2d_dict.items():
+        hcum_dict[proc] = {}
+        for ds, histo2d in ds_dict.items():
+            axis = histo2d.axes.name.index("FatJetGood.tau21")
+            ax_tau21 = histo2d.axes[axis]
+            histo_cum = histo2d.copy()
+            # Only the tau21 flow bins are excluded: the flow bins of the other axes are kept in the templates
+            start = 1 if ax_tau21.traits.underflow else 0
+            view = histo_cum.view(flow=True)[(slice(None),) * axis + (slice(start, start + ax_tau21.size),)]
+            if view.dtype.names:
+                for field in ["value", "variance"]:
+                    view[field] = np.cumsum(view[field], axis=axis)
+            else:
+                view[...] = np.cumsum(view, axis=axis)
+            hcum_dict[proc][ds] = histo_cum
+    return hcum_dict
+
+def get_1d_histogram(h2d_dict, tau21_cut, cumulative=False):
+    """Function to get the 1D histogram from the 2D histogram by integrating over the axis corresponding to tau21.
+    If `cumulative` is True, the histograms are the output of get_cumulative_tau21_histogram and
+    the integral is the slice of the tau21 axis at the last bin below the cut."""
     h1d_dict = {}
     for proc, ds_dict in h2d_dict.items():
         # print(f"\nProcessing {proc}...\n")
@@ -286,13 +315,18 @@ def get_1d_histogram(h2d_dict, tau21_cut):
             # print(f"Dataset: {ds}\n")
             ax_tau21 = histo2d.axes["FatJetGood.tau21"]
             bin_stop = next(i for i, edge in enumerate(ax_tau21.edges[1:]) if edge > tau21_cut)
-            histo_cut = histo2d.integrate(ax_tau21.name, 0, bin_stop)
+            if cumulative:
+                if bin_stop == 0:
+                    raise ValueError(f"The cut tau21 < {tau21_cut} is below the upper edge of the first tau21 bin.")
+                histo_cut = histo2d[{ax_tau21.name : bin_stop - 1}]
+            else:
+                histo_cut = histo2d.integrate(ax_tau21.name, 0, bin_stop)
             h1d_dict[proc][ds] = histo_cut
     # print(f"{h1d_dict.keys()}\n")
     return h1d_dict
 
 
-def get_1d_histogram_reweighed(h2d_dict, tau21_cut, samples, year, parent_category):
+def get_1d_histogram_reweighed(h2d_dict, tau21_cut, samples, year, parent_category, cumulative=False):
     """Return 1D histograms with MC (b+c+light) reweighted to data.
 
     The input 2D histograms are first integrated over the tau21 axis as in
@@ -305,7 +339,7 @@ def get_1d_histogram_reweighed(h2d_dict, tau21_cut, samples, year, parent_catego
     """
 
     # Start from the standard 1D histograms
-    h1d_dict = get_1d_histogram(h2d_dict, tau21_cut)
+    h1d_dict = get_1d_histogram(h2d_dict, tau21_cut, cumulative=cumulative)
 
     # Find a reference histogram to infer axes
     example_hist = None
@@ -441,6 +475,10 @@ def main():
     parser.add_argument("--variable", default="FatJetGood_logsumcorrSVmass_tau21", help="Variable to use for the fit")
     parser.add_argument("--years", nargs="+", default=["2022_preEE", "2022_postEE", "2023_preBPix", "2023_postBPix"], 
                        help="Years to include in the analysis")
+    parser.add_argument("--tau21-cuts", nargs="+", type=float, default=[0.2, 0.25, 0.3, 0.35, 0.4],
+                       help="Cuts tau21 < X of the templates")
+    parser.add_argument("--cumulative-tau21", action="store_true", default=False,
+                       help="Convert the histograms to a cumulative representation in tau21 once per dataset, so that each tau21 cut is a single slice")
     parser.add_argument("--verbose", "-v", action="store_true", default=False, help="Enable verbose output")
     args = parser.parse_args()
     
@@ -477,6 +515,10 @@ def main():
 
         # Add the variation QCD_Madgraph/QCD_MuEnriched to the Hist
         add_Madgraph_systematic(histograms[args.variable])
+        if args.cumulative_tau21:
+            histograms_fit = get_cumulative_tau21_histogram(histograms[args.variable])
+        else:
+            histograms_fit = histograms[args.variable]
         
         systematics = define_systematics([year], [p_name for p_name, p in mc_processes.items()])
         print(f"systematics: {systematics}\n")
@@ -495,11 +537,11 @@ def main():
         # Create datacards for each combination
         for cat in categories:
 
-            for tau21 in [0.2, 0.25, 0.3, 0.35, 0.4]:
+            for tau21 in args.tau21_cuts:
                 print(f"Creating datacard: Year: {year}\tCategory: {cat}\ttau21 < {tau21}")
                 
                 # Get the 1D histogram by integrating over tau21 axis with a specific cut: tau21 < tau21_cut
-                histo_1d = get_1d_histogram(histograms[args.variable], tau21)
+                histo_1d = get_1d_histogram(histograms_fit, tau21, cumulative=args.cumulative_tau21)
                 # Create datacard
                 datacard = DatacardMutag(
                     histograms=histo_1d,
@@ -523,7 +565,7 @@ def main():
                 if abs(tau21 - 0.3) < 1e-6:
                     parent_category = "-".join(cat.split("-")[:-1])
                     histo_1d_rew = get_1d_histogram_reweighed(
-                        histograms[args.variable], tau21, samples, year, parent_category
+                        histograms_fit, tau21, samples, year, parent_category, cumulative=args.cumulative_tau21
                     )
                     datacard_rew = DatacardMutag(
                         histograms=histo_1d_rew,
@@ -543,7 +585,7 @@ def main():
         # Loop over categories again to dump datacards modified with pass/fail ratios
         parent_categories = set()
         for cat in categories:
-            for tau21 in [0.2, 0.25, 0.3, 0.35, 0.4]:
+            for tau21 in args.tau21_cuts:
                 # Extract parent category (without pass/fail)
                 parent_category = '-'.join(cat.split("-")[:-1])
                 parent_categories.add(parent_category)
@@ -593,7 +635,7 @@ def main():
 
         # Create combined datacard for pass+fail regions, for each parent category
         for parent_cat in parent_categories:
-            for tau21 in [0.2, 0.25, 0.3, 0.35, 0.4]:
+            for tau21 in args.tau21_cuts:
                 print(f"\nCreating combined datacard for category: {parent_cat} with tau21 < {tau21} (pass + fail)")
                 tau21_str = get_tau21_str(tau21)
                 directory = output_dir / year / parent_cat / tau21_str
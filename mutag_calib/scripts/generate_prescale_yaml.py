@@ -3,137 +3,57 @@
 """
 Script to generate YAML output with average prescale factors by year and HLT trigger path.
 
-This script reads the prescale JSON files and calculates the average prescale factor
-for each HLT trigger path within each data-taking year, then outputs in the requested YAML format.
+This script reads the prescale JSON files into a columnar table (see `mutag_calib.lib.prescale_tables`),
+cached on disk, and calculates the average prescale factor for each HLT trigger path
+within each data-taking year, then outputs in the requested YAML format.
+
+With the per-lumisection recorded luminosity of a year (`brilcalc lumi --byls -o <file>.csv`),
+passed with `--lumi-csv <year>=<file>.csv`, the average of the year is the effective prescale
+sum(L) / sum(L / prescale) over its lumisections (see `luminosity_weighted_prescales`).
+Otherwise the prescales are averaged over the lumisection ranges, weighted by their size.
+The prescale files shared by several years are restricted to the runs of each year, with the run ranges
+of the `HLT_triggers_prescales_run_ranges` entry of the config. A year sharing a prescale file with another year,
+without a run range and without recorded luminosity, is not averaged: an exception is raised.
 """
 
-import os
-import json
 import yaml
 import argparse
 from pathlib import Path
-from collections import defaultdict
 import numpy as np
+import pandas as pd
 
-def load_yaml_config(config_path):
-    """Load the YAML configuration file with prescales."""
-    with open(config_path, 'r') as f:
-        config = yaml.safe_load(f)
-    return config
-
-def resolve_config_path(path_string, config_dir):
-    """Resolve ${config_dir:} placeholders in file paths."""
-    if "${config_dir:}" in path_string:
-        return path_string.replace("${config_dir:}", config_dir)
-    return path_string
-
-def load_prescale_json(json_path):
-    """Load and parse a prescale JSON file."""
-    with open(json_path, 'r') as f:
-        data = json.load(f)
-    return data
+from mutag_calib.lib.prescale_tables import read_prescale_files, read_run_ranges, restrict_to_run_ranges, get_prescale_tables, read_lumi_csv, luminosity_weighted_prescales, PRESCALE_TABLE_CACHE
 
-def parse_prescale_data(data):
-    """Parse prescale data to extract run numbers, lumi sections, and weights."""
-    prescale_info = []
-    
-    # Navigate the JSON structure
-    corrections = data.get("corrections", [])
-    for correction in corrections:
-        if correction.get("name") == "prescaleWeight":
-            content = correction.get("data", {}).get("content", [])
-            
-            for run_entry in content:
-                run_number = run_entry["key"]
-                path_content = run_entry["value"]["content"]
-                
-                for path_entry in path_content:
-                    hlt_path = path_entry["key"]
-                    weight_data = path_entry["value"]
-                    
-                    # Handle different weight data structures
-                    if isinstance(weight_data, (int, float)):
-                        # Simple constant weight
-                        prescale_info.append({
-                            'run': run_number,
-                            'hlt_path': hlt_path,
-                            'lumi_start': 1,
-                            'lumi_end': float('inf'),
-                            'weight': float(weight_data),
-                            'lumi_range_size': float('inf')
-                        })
-                    elif isinstance(weight_data, dict) and weight_data.get("nodetype") == "binning":
-                        # Binned weights by lumi section
-                        edges = weight_data["edges"]
-                        content_weights = weight_data["content"]
-                        
-                        for i, weight in enumerate(content_weights):
-                            lumi_start = edges[i]
-                            lumi_end = edges[i+1] if i+1 < len(edges) else float('inf')
-                            
-                            # Handle string "inf" values
-                            if lumi_start == "inf":
-                                lumi_start = float('inf')
-                            elif isinstance(lumi_start, str):
-                                try:
-                                    lumi_start = float(lumi_start)
-                                except ValueError:
-                                    print(f"        Warning: Could not convert lumi_start '{lumi_start}' to float")
-                                    lumi_start = 1.0
-                            
-                            if lumi_end == "inf":
-                                lumi_end = float('inf')
-                            elif isinstance(lumi_end, str):
-                                try:
-                                    lumi_end = float(lumi_end)
-                                except ValueError:
-                                    print(f"        Warning: Could not convert lumi_end '{lumi_end}' to float")
-                                    lumi_end = float('inf')
-                            
-                            # Calculate range size
-                            if lumi_end == float('inf') or lumi_start == float('inf'):
-                                lumi_range_size = float('inf')
-                            else:
-                                lumi_range_size = lumi_end - lumi_start
-                            
-                            prescale_info.append({
-                                'run': run_number,
-                                'hlt_path': hlt_path,
-                                'lumi_start': lumi_start,
-                                'lumi_end': lumi_end,
-                                'weight': float(weight),
-                                'lumi_range_size': lumi_range_size
-                            })
-    
-    return prescale_info
+def calculate_weighted_averages(df):
+    """Calculate the weighted average prescale of each year, trigger group and HLT path,
+    weighting by luminosity section range size. Used for the years without recorded luminosity."""
+    range_size = df['lumi_end'] - df['lumi_start']
+    # For infinite ranges, treat as having weight 1000 (arbitrary large number)
+    # This ensures constant prescales for entire runs have proper influence
+    range_size = range_size.where(np.isfinite(range_size), 1000.0)
+    sums = df.assign(weighted=df['weight'] * range_size, range_size=range_size) \
+             .groupby(['year', 'trigger_group', 'hlt_path'])[['weighted', 'range_size']].sum()
+    averages = (sums['weighted'] / sums['range_size']).where(sums['range_size'] != 0, 0.0)
+    counts = df.groupby(['year', 'trigger_group', 'hlt_path']).size()
+    return averages, counts
 
-def calculate_weighted_average(prescale_entries):
-    """Calculate weighted average prescale, weighting by luminosity section range size."""
-    if not prescale_entries:
-        return 0.0
-    
-    total_weight = 0.0
-    total_range = 0.0
-    
-    for entry in prescale_entries:
-        weight = entry['weight']
-        range_size = entry['lumi_range_size']
-        
-        if range_size == float('inf'):
-            # For infinite ranges, treat as having weight 1000 (arbitrary large number)
-            # This ensures constant prescales for entire runs have proper influence
-            range_size = 1000.0
-        
-        total_weight += weight * range_size
-        total_range += range_size
-    
-    if total_range == 0:
-        return 0.0
-    
-    return total_weight / total_range
+def check_shared_files(df, run_ranges, lumi_csv):
+    """Raise an exception if a year shares a prescale file with another year, but has neither a run range
+    nor recorded luminosity: the average of the whole file would be written for both years."""
+    files = df.groupby('year')['json_file'].agg(set)
+    for year, year_files in files.items():
+        if year in run_ranges or year in lumi_csv:
+            continue
+        other_files = set().union(*[f for other_year, f in files.items() if other_year != year])
+        shared = sorted(year_files & other_files)
+        if shared:
+            raise Exception(f"The prescale files {shared} of {year} are shared with other years: "
+                            f"define the run range of {year} in 'HLT_triggers_prescales_run_ranges' or pass its recorded luminosity with --lumi-csv.")
 
-def generate_prescale_yaml(config_path, output_path=None):
-    """Generate YAML output with average prescale factors by year and HLT path."""
+def generate_prescale_yaml(config_path, output_path=None, cache_dir=PRESCALE_TABLE_CACHE, lumi_csv=None):
+    """Generate YAML output with average prescale factors by year and HLT path.
+    The prescales of the years in `lumi_csv` (dictionary year -> CSV file of the recorded luminosity)
+    are weighted by the recorded luminosity."""
     
     # Load configuration
     config_path = Path(config_path)
@@ -141,85 +61,49 @@ def generate_prescale_yaml(config_path, output_path=None):
         print(f"Error: Configuration file {config_path} does not exist")
         return
     
-    config = load_yaml_config(config_path)
-    config_dir = config_path.parent
-    
-    # Extract prescale information
-    hlt_triggers_prescales = config.get("HLT_triggers_prescales", {})
-    
-    # Dictionary to store results: year -> trigger_group -> hlt_path -> list of prescale entries
-    results = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-    
     print(f"Processing prescale files...")
     
-    processed_files = set()
-    
-    for year, year_data in hlt_triggers_prescales.items():
-        print(f"\nProcessing year: {year}")
-        
-        for trigger_group, triggers in year_data.items():
-            print(f"  Processing trigger group: {trigger_group}")
-            
-            for trigger_name, json_path in triggers.items():
-                resolved_path = resolve_config_path(json_path, str(config_dir))
-                json_file = Path(resolved_path)
-                
-                if not json_file.exists():
-                    print(f"    Warning: JSON file not found: {json_file}")
-                    continue
-                
-                # Avoid processing the same file multiple times
-                file_key = str(json_file)
-                if file_key in processed_files:
-                    print(f"    Skipping already processed file: {json_file.name}")
-                    continue
-                processed_files.add(file_key)
-                
-                print(f"    Processing: {trigger_name} -> {json_file.name}")
-                
-                try:
-                    prescale_json = load_prescale_json(json_file)
-                    prescale_info = parse_prescale_data(prescale_json)
-                    
-                    # Group prescale entries by HLT path
-                    for entry in prescale_info:
-                        hlt_path = entry['hlt_path']
-                        results[year][trigger_group][hlt_path].append(entry)
-                    
-                    print(f"      Found {len(prescale_info)} prescale entries")
-                    
-                except Exception as e:
-                    print(f"      Error processing {json_file}: {e}")
-                    import traceback
-                    print(f"      Full traceback: {traceback.format_exc()}")
-                    continue
+    # The JSON files shared by several years are included for each of them, restricted to the runs of the year
+    df = get_prescale_tables(read_prescale_files(config_path), cache_dir=cache_dir)
+    run_ranges = read_run_ranges(config_path)
+    lumi_csv = lumi_csv or {}
+    check_shared_files(df, run_ranges, lumi_csv)
+    df = restrict_to_run_ranges(df, run_ranges)
     
     # Calculate averages and format output
     output_data = {"HLT_triggers_prescales": {}}
     
     print(f"\nCalculating averages...")
     
-    for year in sorted(results.keys()):
-        output_data["HLT_triggers_prescales"][year] = {}
-        print(f"\nYear {year}:")
-        
-        for trigger_group in sorted(results[year].keys()):
+    averages, counts = calculate_weighted_averages(df)
+    recorded = pd.Series(dtype=float)
+    if lumi_csv:
+        lumi = pd.concat([read_lumi_csv(path).assign(year=year) for year, path in lumi_csv.items()], ignore_index=True)
+        effective = luminosity_weighted_prescales(df[df['year'].isin(lumi_csv.keys())], lumi)
+        averages = averages.where(~averages.index.isin(effective.index), effective['prescale'].reindex(averages.index))
+        recorded = effective['recorded']
+    for (year, trigger_group, hlt_path), avg_prescale in averages.items():
+        if year not in output_data["HLT_triggers_prescales"]:
+            output_data["HLT_triggers_prescales"][year] = {}
+            print(f"\nYear {year}:")
+        if trigger_group not in output_data["HLT_triggers_prescales"][year]:
             output_data["HLT_triggers_prescales"][year][trigger_group] = {}
             print(f"  {trigger_group}:")
-            
-            for hlt_path in sorted(results[year][trigger_group].keys()):
-                prescale_entries = results[year][trigger_group][hlt_path]
-                avg_prescale = calculate_weighted_average(prescale_entries)
-                
-                # Round to reasonable precision
-                if avg_prescale == int(avg_prescale):
-                    avg_prescale = int(avg_prescale)
-                else:
-                    avg_prescale = round(avg_prescale, 3)
-                
-                output_data["HLT_triggers_prescales"][year][trigger_group][hlt_path] = avg_prescale
-                
-                print(f"    {hlt_path}: {avg_prescale} (from {len(prescale_entries)} entries)")
+        
+        # Round to reasonable precision
+        if not np.isfinite(avg_prescale):
+            print(f"    Warning: {hlt_path} is disabled in all the lumisections of {year}")
+        elif avg_prescale == int(avg_prescale):
+            avg_prescale = int(avg_prescale)
+        else:
+            avg_prescale = round(float(avg_prescale), 3)
+        
+        output_data["HLT_triggers_prescales"][year][trigger_group][hlt_path] = avg_prescale
+        
+        if (year, trigger_group, hlt_path) in recorded.index:
+            print(f"    {hlt_path}: {avg_prescale} (weighted by {recorded[(year, trigger_group, hlt_path)]:g} of recorded luminosity)")
+        else:
+            print(f"    {hlt_path}: {avg_prescale} (from {counts[(year, trigger_group, hlt_path)]} entries)")
     
     # Save to file
     if output_path is None:
@@ -246,10 +130,17 @@ def main():
                        help="Path to triggers prescales YAML config file")
     parser.add_argument("--output", "-o", default="average_prescales.yaml",
                        help="Output YAML file path")
+    parser.add_argument("--cache-dir", default=PRESCALE_TABLE_CACHE,
+                       help="Directory of the cache of the prescale tables")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Parse the prescale JSON files without using the cache")
+    parser.add_argument("--lumi-csv", nargs="+", default=[], metavar="YEAR=CSV",
+                       help="CSV files of the recorded luminosity by lumisection (brilcalc lumi --byls), by year (e.g. 2022_preEE=lumi_2022_preEE.csv)")
     
     args = parser.parse_args()
     
-    generate_prescale_yaml(args.config, args.output)
+    lumi_csv = dict(arg.split("=", 1) for arg in args.lumi_csv)
+    generate_prescale_yaml(args.config, args.output, cache_dir=None if args.no_cache else args.cache_dir, lumi_csv=lumi_csv)
 
 if __name__ == "__main__":
     main()
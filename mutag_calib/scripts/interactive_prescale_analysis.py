@@ -7,93 +7,20 @@ This script provides more detailed analysis capabilities for trigger prescale fa
 including visualization and specific queries.
 """
 
-import os
-import json
-import yaml
 import argparse
 from pathlib import Path
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-from collections import defaultdict
 
-def load_and_parse_all_prescales(config_path):
-    """Load and parse all prescale data from the configuration."""
-    
-    config_path = Path(config_path)
-    config_dir = config_path.parent
-    
-    with open(config_path, 'r') as f:
-        config = yaml.safe_load(f)
-    
-    hlt_triggers_prescales = config.get("HLT_triggers_prescales", {})
-    all_data = []
-    
-    for year, year_data in hlt_triggers_prescales.items():
-        for trigger_group, triggers in year_data.items():
-            for trigger_name, json_path in triggers.items():
-                resolved_path = json_path.replace("${config_dir:}", str(config_dir))
-                json_file = Path(resolved_path)
-                
-                if not json_file.exists():
-                    continue
-                
-                try:
-                    with open(json_file, 'r') as f:
-                        data = json.load(f)
-                    
-                    # Parse the correctionlib JSON structure
-                    corrections = data.get("corrections", [])
-                    for correction in corrections:
-                        if correction.get("name") == "prescaleWeight":
-                            content = correction.get("data", {}).get("content", [])
-                            
-                            for run_entry in content:
-                                run_number = run_entry["key"]
-                                path_content = run_entry["value"]["content"]
-                                
-                                for path_entry in path_content:
-                                    hlt_path = path_entry["key"]
-                                    weight_data = path_entry["value"]
-                                    
-                                    if isinstance(weight_data, (int, float)):
-                                        all_data.append({
-                                            'year': year,
-                                            'trigger_group': trigger_group,
-                                            'trigger_name': trigger_name,
-                                            'run': run_number,
-                                            'hlt_path': hlt_path,
-                                            'lumi_start': 1,
-                                            'lumi_end': float('inf'),
-                                            'weight': float(weight_data),
-                                            'lumi_range_size': float('inf')
-                                        })
-                                    elif isinstance(weight_data, dict) and weight_data.get("nodetype") == "binning":
-                                        edges = weight_data["edges"]
-                                        content = weight_data["content"]
-                                        
-                                        for i, weight in enumerate(content):
-                                            lumi_start = edges[i]
-                                            lumi_end = edges[i+1] if i+1 < len(edges) else float('inf')
-                                            lumi_range_size = lumi_end - lumi_start if lumi_end != float('inf') else float('inf')
-                                            
-                                            all_data.append({
-                                                'year': year,
-                                                'trigger_group': trigger_group,
-                                                'trigger_name': trigger_name,
-                                                'run': run_number,
-                                                'hlt_path': hlt_path,
-                                                'lumi_start': lumi_start,
-                                                'lumi_end': lumi_end,
-                                                'weight': float(weight),
-                                                'lumi_range_size': lumi_range_size
-                                            })
-                
-                except Exception as e:
-                    print(f"Error processing {json_file}: {e}")
-    
-    return pd.DataFrame(all_data)
+from mutag_calib.lib.prescale_tables import read_prescale_files, get_prescale_tables, PRESCALE_TABLE_CACHE
+
+def load_and_parse_all_prescales(config_path, cache_dir=PRESCALE_TABLE_CACHE):
+    """Load all prescale data from the configuration, as a columnar table cached on disk."""
+    df = get_prescale_tables(read_prescale_files(config_path), cache_dir=cache_dir)
+    df['lumi_range_size'] = df['lumi_end'] - df['lumi_start']
+    return df
 
 def analyze_run_range(df, run_start, run_end):
     """Analyze prescales for a specific run range."""
@@ -218,12 +145,16 @@ def main():
     parser.add_argument("--output-dir", "-o", default="prescale_plots",
                        help="Output directory for plots")
     parser.add_argument("--plot", action="store_true", help="Generate plots")
+    parser.add_argument("--cache-dir", default=PRESCALE_TABLE_CACHE,
+                       help="Directory of the cache of the prescale tables")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Parse the prescale JSON files without using the cache")
     
     args = parser.parse_args()
     
     # Load all prescale data
     print("Loading prescale data...")
-    df = load_and_parse_all_prescales(args.config)
+    df = load_and_parse_all_prescales(args.config, cache_dir=None if args.no_cache else args.cache_dir)
     
     if len(df) == 0:
         print("No prescale data found!")
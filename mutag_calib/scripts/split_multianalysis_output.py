@@ -0,0 +1,28 @@
+import os
+import argparse
+from coffea.util import load, save
+
+# Split the output of the combined fit templates config (`configs/fit_templates/fit_templates_HH_combined.py`)
+# into one output per analysis. The output of each analysis has the same format as the output of its config
+# run separately, and it is saved with the same file name in the folder `{outputdir}/{analysis}`.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split the output of the multi-analysis processor into one output per analysis.")
+    parser.add_argument('inputs', type=str, nargs='+', help="Output files of the combined config (merged or one per dataset).")
+    parser.add_argument('-o', '--outputdir', type=str, default=None, help="Output folder. By default, the folder of the input files.")
+    parser.add_argument('--analyses', type=str, nargs='+', default=None, help="Analyses to save. By default, all the analyses of the output.")
+    args = parser.parse_args()
+
+    for input_file in args.inputs:
+        output = load(input_file)
+        if not "analyses" in output:
+            raise Exception(f"The file {input_file} does not contain the key 'analyses': it is not an output of the multi-analysis processor.")
+        analyses = args.analyses if args.analyses else output["analyses"].keys()
+        for analysis in analyses:
+            if not analysis in output["analyses"]:
+                raise Exception(f"The analysis '{analysis}' is not in the file {input_file}. Available analyses: {list(output['analyses'].keys())}")
+            outputdir = os.path.join(args.outputdir if args.outputdir else os.path.dirname(os.path.abspath(input_file)), analysis)
+            os.makedirs(outputdir, exist_ok=True)
+            output_file = os.path.join(outputdir, os.path.basename(input_file))
+            save(output["analyses"][analysis], output_file)
+            print(f"Saved the output of the analysis {analysis} in {output_file}")
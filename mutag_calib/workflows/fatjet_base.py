@@ -1,19 +1,80 @@
+import numpy as np
 import awkward as ak
-from collections import defaultdict
 
 from pocket_coffea.workflows.base import BaseProcessorABC
 from pocket_coffea.utils.configurator import Configurator
 from pocket_coffea.lib.jets import jet_selection
 
 from mutag_calib.lib.leptons import lepton_selection_noniso
-from mutag_calib.lib.sv import get_corrmass, sv_matched_to_fatjet, get_sumcorrmass, get_sv1mass
-from mutag_calib.lib.muon_matching import muons_matched_to_fatjet, muon_matched_to_subjet
+from mutag_calib.lib.sv import get_sv_mass_observables
+from mutag_calib.lib.muon_matching import muons_matched_to_subjets
+from mutag_calib.lib.deltar_matching import run_deltar_matching, run_deltar_matching_multi, check_deltar_matching_backend
+from mutag_calib.lib.input_columns import get_input_columns, restrict_input_columns, get_config_collections, get_config_cuts, get_histogram_fields
+from mutag_calib.lib.fields import with_fields
+from mutag_calib.lib.corrections import count_correction_set_cache, set_correction_set_cache_size
+from mutag_calib.lib.column_cache import JetColumnCache
+from mutag_calib.configs.fatjet_base.custom.functions import mutag_subjet
 
 class fatjetBaseProcessor(BaseProcessorABC):
+    # Top-level NanoAOD collections and branches read by the workflow.
+    # The fields read by the weights, calibrators, cuts and histograms of the config are added in `__init__`
+    input_columns = {
+        "FatJet", "SubJet", "Muon", "SV",
+        "HLT", "PV", "Flag", "run", "luminosityBlock", "event",
+    }
+
     def __init__(self, cfg: Configurator):
         super().__init__(cfg)
-        # Define dictionary to save fatjet JER seeds
-        self.output_format.update({"seed_fatjet_chunk": defaultdict(str)})
+        # With the `restrict_input_columns` workflow option, only the fields of the input columns manifest
+        # are accessible from the events: accessing any other field raises an error, so that no unneeded branch is read.
+        # The restriction is disabled by default, since the manifest of the weights and calibrators is maintained by hand.
+        self.restrict_to_input_columns = self.cfg.workflow_options.get("restrict_input_columns", False)
+        if self.restrict_to_input_columns:
+            self.input_columns_manifest = get_input_columns(self.cfg, self.input_columns)
+        # The correctionlib files are parsed once per worker and cached (see `mutag_calib.lib.corrections`).
+        # The hits and misses of the cache in each chunk are summed in the output.
+        # The size of the cache is set in `process`, since the processor is built on the driver and not on the workers.
+        self.correction_set_cache_size = self.cfg.workflow_options.get("correction_set_cache_size", None)
+        self.output_format.update({"correction_set_cache": {"hits": 0, "misses": 0}})
+        self.check_prescale_files()
+        # Backend used for the deltaR matching of muons and SV to the AK8 jets (see `run_deltar_matching`).
+        # The "sweep" backend is convenient for chunks with a high multiplicity of muons and SV.
+        self.deltar_matching_backend = self.cfg.workflow_options.get("deltar_matching_backend", "numba")
+        check_deltar_matching_backend(self.deltar_matching_backend)
+        # Collections matched to the FatJetGood collection, with the corresponding matching radius.
+        # For each collection `coll`, the matched objects are saved in `{coll}MatchedToFatJetGood`.
+        self.fatjet_matched_collections = {"MuonGood": 0.8, "SV": 0.8}
+        # By default the SV are matched to the final FatJetGood collection, after the jet selections of the workflow
+        # (e.g. leading and subleading jets, muon tagging), in `define_common_variables_after_presel`.
+        # With the `match_sv_before_jet_selection` workflow option, the SV are matched together with the muons
+        # in `match_objects_to_fatjets`, to the closest jet among all the FatJetGood: this changes the SV
+        # assigned to the selected jets, and therefore the SV mass templates.
+        self.match_sv_before_jet_selection = self.cfg.workflow_options.get("match_sv_before_jet_selection", False)
+        # Collections of muons matched to the leading and subleading subjets of FatJetGood
+        self.subjet_matched_collections = ["MuonGoodMatchedToSubJet", "MuonGoodMatchedUniquelyToSubJet"]
+        # Collections used in the cuts and histograms of the config: the derived collections are built only if used.
+        # The subjet matching can be forced with the `match_muons_to_subjets` workflow option.
+        self.used_collections = get_config_collections(self.cfg)
+        self.match_muons_to_subjets = self.cfg.workflow_options.get("match_muons_to_subjets", self.requires_subjet_matching())
+        # Minimum number of MuonGood required in the event before the selection of the AK8 jets.
+        # The workflows requiring muon-tagged AK8 jets set it to the number of muons required in the jet.
+        self.min_muons_in_event = 0
+        # If True, the derived floating point fields of FatJetGood and SV are kept in single precision,
+        # as the NanoAOD branches, instead of being promoted to double precision.
+        # This halves the memory of these columns: the effect on the histograms can be checked
+        # with `scripts/benchmarks/validate_float32_observables.py`
+        self.float32_observables = self.cfg.workflow_options.get("float32_observables", False)
+        # The per-jet columns that are not changed by the jet calibration (numbers of matched muons and SV,
+        # SV mass observables and tau21) can be computed once per chunk and reused in the shape variations,
+        # looking up the AK8 jets by their index in the chunk (see `JetColumnCache`).
+        # In this mode the matched collections are not built: the cache is enabled with the `cache_invariant_jet_columns`
+        # workflow option, and is used only if the matched collections are not used in the cuts and histograms of the config.
+        # Custom workflows or functions reading the matched collections elsewhere have to keep it disabled.
+        self.cache_invariant_jet_columns = self.cfg.workflow_options.get("cache_invariant_jet_columns", False) and not self.uses_matched_collections()
+        self.jet_column_cache = None
+        self.sv_column_cache = None
+        # Cached columns attached to the FatJetGood collection after the preselection
+        self.sv_columns = ["nSVMatchedToFatJetGood", "sumcorrSVmass", "logsumcorrSVmass", "sv1mass", "logsv1mass"]
 
         # Additional axis for the year
         #self.custom_axes.append(
@@ -28,67 +89,251 @@ class fatjetBaseProcessor(BaseProcessorABC):
         #    )
         #)
 
+    def check_prescale_files(self):
+        '''Check that the prescale files of the weight `sf_trigger_prescale_runlumi` are defined for all the years
+        of the config, so that a missing year fails when the config is loaded and not in the processing.'''
+        if "sf_trigger_prescale_runlumi" not in self.cfg.requested_weights:
+            return
+        prescale_files = self.params.get("HLT_triggers_prescales_runlumi", {})
+        missing_years = [year for year in self.cfg.years if year not in prescale_files]
+        if missing_years:
+            raise Exception(f"The weight 'sf_trigger_prescale_runlumi' is requested, but the prescale files of the years {missing_years} are not defined in the parameters 'HLT_triggers_prescales_runlumi'.")
+
+    def process(self, events):
+        if self.restrict_to_input_columns:
+            events = restrict_input_columns(events, self.input_columns_manifest)
+        if self.correction_set_cache_size is not None:
+            set_correction_set_cache_size(self.correction_set_cache_size)
+        # Only the calls of the thread processing the chunk are counted
+        with count_correction_set_cache() as counters:
+            output = super().process(events)
+        output["correction_set_cache"] = dict(counters)
+        return output
+
     def process_extra_after_skim(self):
         super().process_extra_after_skim()
         # Save raw softdrop mass before any calibration as a new field of FatJet
-        self.events["FatJet"] = ak.with_field(
-            self.events.FatJet, self.events.FatJet.msoftdrop, "msoftdrop_raw"
-        )
+        fatjet_fields = {"msoftdrop_raw" : self.events.FatJet.msoftdrop}
+        nfatjet = ak.to_numpy(ak.num(self.events.FatJet))
+        if self.requires_fatjet_chunk_index():
+            # Index of the AK8 jets in the chunk, which identifies the jets across the shape variations
+            fatjet_fields["chunk_index"] = ak.unflatten(np.arange(np.sum(nfatjet)), nfatjet)
+        self.events["FatJet"] = with_fields(self.events.FatJet, fatjet_fields)
+        self.jet_column_cache = JetColumnCache(np.sum(nfatjet)) if self.cache_invariant_jet_columns else None
+        # Without the early SV matching, the SV columns depend on the final set of FatJetGood jets of the event,
+        # and are cached separately with this set as key
+        self.sv_column_cache = JetColumnCache(np.sum(nfatjet)) if self.cache_invariant_jet_columns and not self.match_sv_before_jet_selection else None
 
     def apply_object_preselection(self, variation):
         '''
-        The ttHbb processor cleans
-          - Electrons
-          - Muons
-          - Jets -> JetGood
-          - BJet -> BJetGood
+        The mutag processor selects
+          - Muons -> MuonGood
+          - FatJets -> FatJetGood
 
+        The cheapest per-event requirements are applied first, so that the object selections
+        and the matching of the muons and SV are run only on the events that can pass the preselection.
         '''
-        # Include the supercluster pseudorapidity variable
-        electron_etaSC = self.events.Electron.eta + self.events.Electron.deltaEtaSC
-        self.events["Electron"] = ak.with_field(
-            self.events.Electron, electron_etaSC, "etaSC"
+        # Select here events with at least one FatJet passing the pt, eta and msd requirements of FatJetGood
+        # WARNING: Here we are applying a per-event selection asking for at least one AK8 jet in the event
+        # In this way, we can compute the number of MuonGood matched to the FatJetGood and its subjets
+        cuts = self.params.object_preselection["FatJet"]
+        fatjet_candidates = (
+            (self.events.FatJet.pt > cuts["pt"])
+            & (np.abs(self.events.FatJet.eta) < cuts["eta"])
+            & (self.events.FatJet.msoftdrop > cuts["msd"])
         )
-        # Build masks for selection of muons, electrons, jets, fatjets
+        self.events = self.events[ak.any(fatjet_candidates, axis=1)]
 
         ################################################
         # Dedicated Muon selection for mutag final state
         self.events["MuonGood"] = lepton_selection_noniso(
             self.events, "Muon", self.params
         )
+        # Events with less MuonGood than the ones required in a muon-tagged AK8 jet cannot pass the preselection
+        if self.min_muons_in_event > 0:
+            self.events = self.events[ak.num(self.events.MuonGood) >= self.min_muons_in_event]
 
         self.events["FatJetGood"], self.fatjetGoodMask = jet_selection(
             self.events, "FatJet", self.params, self._year
         )
-
-        # Select here events with at least one FatJetGood
-        # WARNING: Here we are applying a per-event selection asking for at least one AK8 jet in the event
-        # In this way, we can compute the number of MuonGood matched to the FatJetGood and its subjets
+        # The jet selection also includes the jetId requirement
         self.events = self.events[ak.num(self.events.FatJetGood) >= 1]
 
+        self.define_matched_objects()
+
+    def define_matched_objects(self):
+        '''Match the muons and SV to the FatJetGood collection and the muons to its subjets,
+        and attach tau21 and the numbers of matched muons to the FatJetGood collection.'''
+        if self.jet_column_cache is not None:
+            # The muons (and SV, if matched before the jet selection) are matched only to the AK8 jets of the events
+            # with a set of jets not seen in the previous variations. The SV columns are attached after the preselection.
+            fatjet_fields = self.get_invariant_jet_columns(self.jet_column_cache, self.compute_matched_objects_columns)
+            self.events["FatJetGood"] = with_fields(
+                self.events.FatJetGood, {field : value for field, value in fatjet_fields.items() if field not in self.sv_columns}
+            )
+            return
+
+        self.match_objects_to_fatjets()
         # Uniquely match muons to leading and subleading subjets
-        # The shape of these masks is the same as the self.events.FatJetGood collection:
-        # the first object are the muons matched to the leading subjet,
-        # the second object are the muons that are matched to the subleading subjet, while
-        # the third object are the dimuon pairs constructed from the matched muons
-
-        self.events["MuonGoodMatchedToFatJetGood"] = muons_matched_to_fatjet(self.events)
-        #muon_matched_to_leading_subjet = muon_matched_to_subjet(self.events, pos=0, unique=False)
-        #muon_matched_to_subleading_subjet = muon_matched_to_subjet(self.events, pos=1, unique=False)
-        #self.events["MuonGoodMatchedToSubJet"] = ak.concatenate((muon_matched_to_leading_subjet, muon_matched_to_subleading_subjet), axis=2)
-        #muon_matched_uniquely_to_leading_subjet = muon_matched_to_subjet(self.events, pos=0, unique=True)
-        #muon_matched_uniquely_to_subleading_subjet = muon_matched_to_subjet(self.events, pos=1, unique=True)
-        #self.events["MuonGoodMatchedUniquelyToSubJet"] = ak.concatenate((muon_matched_uniquely_to_leading_subjet, muon_matched_uniquely_to_subleading_subjet), axis=2)
+        # The shape of these collections is the same as the self.events.FatJetGood collection:
+        # the first object is the muon matched to the leading subjet,
+        # the second object is the muon matched to the subleading subjet.
+        # The leading and subleading subjets are matched with fixed and unique cones in a single pass,
+        # only if the subjet matching is used in the config
+        if self.match_muons_to_subjets:
+            self.events["MuonGoodMatchedToSubJet"], self.events["MuonGoodMatchedUniquelyToSubJet"] = muons_matched_to_subjets(self.events)
 
         fatjet_fields = {
             "tau21" : self.events.FatJetGood.tau2 / self.events.FatJetGood.tau1,
             #"nSubJet" : ak.count(events.FatJetGood.subjets.pt, axis=2),
             "nMuonGoodMatchedToFatJetGood" : ak.count(self.events["MuonGoodMatchedToFatJetGood"].pt, axis=2),
-            #"nMuonGoodMatchedToSubJet" : ak.count(self.events["MuonGoodMatchedToSubJet"].pt, axis=2),
-            #"nMuonGoodMatchedUniquelyToSubJet" : ak.count(self.events["MuonGoodMatchedUniquelyToSubJet"].pt, axis=2)
         }
-        for field, value in fatjet_fields.items():
-            self.events["FatJetGood"] = ak.with_field(self.events.FatJetGood, value, field)
+        if self.match_muons_to_subjets:
+            for coll in self.subjet_matched_collections:
+                fatjet_fields[f"n{coll}"] = ak.count(self.events[coll].pt, axis=2)
+        # All the fields are attached to FatJetGood with a single rebuild of the collection
+        self.events["FatJetGood"] = with_fields(
+            self.events.FatJetGood, {field : self.cast_precision(value) for field, value in fatjet_fields.items()}
+        )
+
+    def get_early_matched_collections(self):
+        '''Returns the collections matched to the FatJetGood collection before the jet selections of the workflow:
+        the muons, and the SV if `match_sv_before_jet_selection` is enabled.'''
+        return [coll for coll in self.fatjet_matched_collections if coll != "SV" or self.match_sv_before_jet_selection]
+
+    def match_objects_to_fatjets(self):
+        '''Match muons (and SV, if `match_sv_before_jet_selection` is enabled) to the FatJetGood collection in a single pass over the jets.
+        The matched collections have the same shape as the FatJetGood collection:
+        if the FatJetGood collection is masked afterwards, the `select_fatjets` method has to be used.
+        '''
+        # N.B.: the SV mass is corrected only for the matched SV, in `define_common_variables_after_presel`
+        collections = self.get_early_matched_collections()
+        matched = run_deltar_matching_multi(
+            self.events.FatJetGood,
+            [(self.events[coll], self.fatjet_matched_collections[coll]) for coll in collections],
+            backend=self.deltar_matching_backend
+        )
+        for coll, matched_coll in zip(collections, matched):
+            self.events[f"{coll}MatchedToFatJetGood"] = matched_coll
+
+    def get_invariant_jet_columns(self, cache, compute):
+        '''Returns the per-jet columns computed by `compute(events)` for the FatJetGood collection, as jagged arrays,
+        from the JetColumnCache `cache`. Since each muon and SV is matched to the closest AK8 jet of the event,
+        the columns of a jet are cached with the set of FatJetGood jets of its event, as a bitmask of the positions of
+        the jets in the FatJet collection. They are computed again if the set of jets changes in a variation.'''
+        nfatjet = ak.to_numpy(ak.num(self.events.FatJetGood))
+        jet_index = ak.to_numpy(ak.flatten(self.events.FatJetGood.chunk_index))
+        position = jet_index - np.repeat(ak.to_numpy(ak.min(self.events.FatJet.chunk_index, axis=1)), nfatjet)
+        bits = np.left_shift(np.uint64(1), np.minimum(position, 63).astype(np.uint64))
+        # The jets of events with more than 64 AK8 jets are never cached (key 0)
+        bits[position >= 64] = 0
+        offsets = np.zeros(len(nfatjet) + 1, dtype=np.int64)
+        np.cumsum(nfatjet, out=offsets[1:])
+        keys = np.zeros(len(nfatjet), dtype=np.uint64)
+        keys[nfatjet > 0] = np.bitwise_or.reduceat(bits, offsets[:-1][nfatjet > 0])
+        event_has_overflow = np.zeros(len(nfatjet), dtype=bool)
+        event_has_overflow[np.repeat(np.arange(len(nfatjet)), nfatjet)[position >= 64]] = True
+        keys[event_has_overflow] = 0
+        keys = np.repeat(keys, nfatjet)
+
+        def compute_missing(missing):
+            # All the jets of the events with missing jets are matched, so that the muons and SV are
+            # matched to the closest jet among the same jets as without the cache
+            event_index = np.repeat(np.arange(len(nfatjet)), nfatjet)
+            event_missing = np.zeros(len(nfatjet), dtype=bool)
+            event_missing[event_index[missing]] = True
+            jet_missing = np.zeros(len(jet_index), dtype=bool)
+            jet_missing[missing] = True
+            jet_missing = jet_missing[event_missing[event_index]]
+            columns = compute(self.events[event_missing])
+            return {name : ak.to_numpy(ak.flatten(self.cast_precision(value)))[jet_missing] for name, value in columns.items()}
+
+        columns = cache.get(jet_index, keys, compute_missing)
+        return {name : ak.unflatten(value, nfatjet) for name, value in columns.items()}
+
+    def compute_matched_objects_columns(self, events):
+        '''Returns the per-jet columns of the objects matched in `define_matched_objects`:
+        the muon columns, and the SV columns if `match_sv_before_jet_selection` is enabled.'''
+        columns = self.compute_muon_columns(events)
+        if self.match_sv_before_jet_selection:
+            columns.update(self.compute_sv_columns(events))
+        return columns
+
+    def compute_muon_columns(self, events):
+        '''Returns tau21 and the numbers of muons matched to the FatJetGood jets of `events` and to their subjets,
+        as computed in `define_matched_objects` without the cache.'''
+        muons_matched = run_deltar_matching(
+            events.FatJetGood, events.MuonGood, radius=self.fatjet_matched_collections["MuonGood"], backend=self.deltar_matching_backend
+        )
+        columns = {
+            "tau21" : events.FatJetGood.tau2 / events.FatJetGood.tau1,
+            "nMuonGoodMatchedToFatJetGood" : ak.count(muons_matched.pt, axis=2),
+        }
+        if self.match_muons_to_subjets:
+            for coll, matched in zip(self.subjet_matched_collections, muons_matched_to_subjets(events)):
+                columns[f"n{coll}"] = ak.count(matched.pt, axis=2)
+        return columns
+
+    def compute_sv_columns(self, events):
+        '''Returns the number of SV matched to the FatJetGood jets of `events` and their SV mass observables,
+        as computed in `define_common_variables_after_presel` without the cache.
+        The mass of the leading SV is returned for each jet.'''
+        sv_matched = run_deltar_matching(
+            events.FatJetGood, events.SV, radius=self.fatjet_matched_collections["SV"], backend=self.deltar_matching_backend
+        )
+        _, sumcorrSVmass, logsumcorrSVmass, sv1mass, logsv1mass = get_sv_mass_observables(
+            sv_matched, dtype=np.float32 if self.float32_observables else np.float64
+        )
+        return {
+            "nSVMatchedToFatJetGood" : ak.count(sv_matched.pt, axis=2),
+            "sumcorrSVmass" : sumcorrSVmass,
+            "logsumcorrSVmass" : logsumcorrSVmass,
+            "sv1mass" : sv1mass,
+            "logsv1mass" : logsv1mass,
+        }
+
+    def select_fatjets(self, mask):
+        '''Apply a per-jet mask to the FatJetGood collection and to the collections matched to it.'''
+        self.events["FatJetGood"] = self.events.FatJetGood[mask]
+        # The matched collections are not built if the per-jet columns are cached
+        if self.jet_column_cache is not None:
+            return
+        for coll in self.get_early_matched_collections():
+            self.events[f"{coll}MatchedToFatJetGood"] = self.events[f"{coll}MatchedToFatJetGood"][mask]
+        if self.match_muons_to_subjets:
+            for coll in self.subjet_matched_collections:
+                self.events[coll] = self.events[coll][mask]
+
+    def uses_matched_collections(self):
+        '''Returns True if the collections of muons and SV matched to the AK8 jets or to their subjets are used
+        in the cuts or in the histograms of the config, and not only the numbers of matched objects.'''
+        matched_collections = [f"{coll}MatchedToFatJetGood" for coll in self.fatjet_matched_collections] + self.subjet_matched_collections
+        return any(coll in self.used_collections for coll in matched_collections)
+
+    def requires_fatjet_chunk_index(self):
+        '''Returns True if the AK8 jets have to be identified across the shape variations by the `chunk_index` field.'''
+        return self.cache_invariant_jet_columns
+
+    def requires_subjet_matching(self):
+        '''Returns True if the muons matched to the subjets are used in the cuts or in the histograms of the config,
+        either as collections or through the number of matched muons of the AK8 jets (e.g. `nMuonGoodMatchedToSubJet`).'''
+        if any(cut.function is mutag_subjet for cut in get_config_cuts(self.cfg)):
+            return True
+        fields = {field for _, field in get_histogram_fields(self.cfg)}
+        return any((coll in self.used_collections) or (f"n{coll}" in fields) for coll in self.subjet_matched_collections)
+
+    def cast_precision(self, array):
+        '''If the float32 mode is enabled, cast a double precision array to single precision.
+        Integer and boolean arrays are returned unchanged.
+        The dtype is read from the type of the array, without flattening its content.'''
+        if not self.float32_observables:
+            return array
+        array_type = ak.type(array)
+        while hasattr(array_type, "type"):
+            array_type = array_type.type
+        if getattr(array_type, "dtype", None) == "float64":
+            return ak.values_astype(array, np.float32)
+        return array
 
     def count_objects(self, variation):
         self.events["nMuonGood"] = ak.num(self.events.MuonGood)
@@ -96,23 +341,40 @@ class fatjetBaseProcessor(BaseProcessorABC):
         self.events["nSV"] = ak.num(self.events.SV)
 
     def define_common_variables_after_presel(self, variation):
+        if self.jet_column_cache is not None:
+            if self.match_sv_before_jet_selection:
+                # The SV columns of the selected AK8 jets are computed in `define_matched_objects`
+                nfatjet = ak.to_numpy(ak.num(self.events.FatJetGood))
+                jet_index = ak.to_numpy(ak.flatten(self.events.FatJetGood.chunk_index))
+                fatjet_fields = {field : ak.unflatten(self.jet_column_cache.lookup(field, jet_index), nfatjet) for field in self.sv_columns}
+            else:
+                # The SV are matched to the final FatJetGood collection, cached with its set of jets
+                fatjet_fields = self.get_invariant_jet_columns(self.sv_column_cache, self.compute_sv_columns)
+            # The leading SV mass of the leading AK8 jet is assigned to all the AK8 jets of the event, as in `get_sv1mass`
+            for field in ["sv1mass", "logsv1mass"]:
+                fatjet_fields[field] = fatjet_fields[field][:,0]
+            self.events["FatJetGood"] = with_fields(self.events.FatJetGood, fatjet_fields)
+            return
 
-        # Correct SV mass for mis-aligment between the SV momentum and the PV-SV direction.
-        # This takes into account particles that are not reconstructed in the SV reconstruction.
-        # The corrected mass is assigned to the SV.mass branch
-        self.events.SV = ak.with_field(self.events.SV, get_corrmass(self.events.SV), "mass")
-        # Match SV to AK8 jets
-        self.events["SVMatchedToFatJetGood"] = sv_matched_to_fatjet(self.events)
-
+        if not self.match_sv_before_jet_selection:
+            # Match SV to the final AK8 jets
+            self.events["SVMatchedToFatJetGood"] = run_deltar_matching(
+                self.events.FatJetGood, self.events.SV, radius=self.fatjet_matched_collections["SV"], backend=self.deltar_matching_backend
+            )
         # Compute final particleNetMD scores
         # Xbb = self.events.FatJetGood.particleNetMD_Xbb
         # Xcc = self.events.FatJetGood.particleNetMD_Xcc
         # QCD = self.events.FatJetGood.particleNetMD_QCD
-        sumcorrSVmass, logsumcorrSVmass = get_sumcorrmass(self.events.SVMatchedToFatJetGood)
-        # Order SV by dxySig and compute the leading SV mass and its log
-        #index_max_pt = ak.argsort(self.events.SVMatchedToFatJetGood.pt, ascending=False)
-        index_max_dxySig = ak.argsort(self.events.SVMatchedToFatJetGood.dxySig, ascending=False)
-        sv1mass, logsv1mass = get_sv1mass(self.events.SVMatchedToFatJetGood[index_max_dxySig])
+        # Correct SV mass for mis-aligment between the SV momentum and the PV-SV direction.
+        # This takes into account particles that are not reconstructed in the SV reconstruction.
+        # The corrected mass, its sum and the mass of the SV with the largest dxySig are computed in a single pass.
+        # The corrected mass is assigned to the SVMatchedToFatJetGood.mass branch
+        corrmass, sumcorrSVmass, logsumcorrSVmass, sv1mass, logsv1mass = get_sv_mass_observables(
+            self.events.SVMatchedToFatJetGood, dtype=np.float32 if self.float32_observables else np.float64
+        )
+        self.events["SVMatchedToFatJetGood"] = ak.with_field(self.events.SVMatchedToFatJetGood, corrmass, "mass")
+        # The leading SV mass of the leading AK8 jet is assigned to all the AK8 jets of the event, as in `get_sv1mass`
+        sv1mass, logsv1mass = sv1mass[:,0], logsv1mass[:,0]
         fatjet_fields = {
             "nSVMatchedToFatJetGood": ak.count(self.events["SVMatchedToFatJetGood"].pt, axis=2),
             # "particleNetMD_Xbb_QCD" : Xbb / (Xbb + QCD),
@@ -123,8 +385,10 @@ class fatjetBaseProcessor(BaseProcessorABC):
             "logsv1mass" : logsv1mass,
         }
 
-        for field, value in fatjet_fields.items():
-            self.events["FatJetGood"] = ak.with_field(self.events.FatJetGood, value, field)
+        # All the fields are attached to FatJetGood with a single rebuild of the collection
+        self.events["FatJetGood"] = with_fields(
+            self.events.FatJetGood, {field : self.cast_precision(value) for field, value in fatjet_fields.items()}
+        )
 
     def fill_column_accumulators(self, variation):
         pass
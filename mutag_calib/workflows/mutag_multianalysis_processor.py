@@ -0,0 +1,204 @@
+from mutag_calib.workflows.mutag_oneMuAK8_processor import mutagAnalysisOneMuonInAK8Processor
+from pocket_coffea.utils.configurator import Configurator
+from pocket_coffea.utils.utils import load_config
+from mutag_calib.lib.input_columns import get_input_columns, get_config_collections
+
+def get_weights(weights):
+    '''Returns the set of the weights of the weights configuration of a sample or subsample, inclusive and by category.'''
+    return set(weights["inclusive"]).union(*weights["bycategory"].values())
+
+def get_weights_variations(variations):
+    '''Returns the set of the weights with variations in the variations configuration of a sample or subsample
+    (see `Configurator.variations_config`), over all the categories.'''
+    return set().union(*variations["weights"].values())
+
+def same_weights(weights_a, weights_b, variations_a, variations_b):
+    '''Returns True if the two weights configurations of a sample (see `Configurator.weights_config`)
+    have the same inclusive weights, for the sample and for each subsample, and no weights by category,
+    and if the two variations configurations of the sample have the same weights variations, for the sample
+    and for each subsample. In this case the weights of the two configurations can be computed by the same WeightsManager.'''
+    if weights_a["by_subsample"].keys() != weights_b["by_subsample"].keys():
+        return False
+    if variations_a["by_subsample"].keys() != variations_b["by_subsample"].keys():
+        return False
+    configs_a = [weights_a] + list(weights_a["by_subsample"].values())
+    configs_b = [weights_b] + list(weights_b["by_subsample"].values())
+    same_inclusive = all(
+        not a["is_split_bycat"] and not b["is_split_bycat"] and set(a["inclusive"]) == set(b["inclusive"])
+        for a, b in zip(configs_a, configs_b)
+    )
+    configs_a = [variations_a] + list(variations_a["by_subsample"].values())
+    configs_b = [variations_b] + list(variations_b["by_subsample"].values())
+    return same_inclusive and all(
+        get_weights_variations(a) == get_weights_variations(b) for a, b in zip(configs_a, configs_b)
+    )
+
+class mutagMultiAnalysisProcessor(mutagAnalysisOneMuonInAK8Processor):
+    '''Processor running several template analyses in a single pass over the datasets.
+    The analyses are the configs listed in the `analyses` entry of the `workflow_options`, as {name: path of the config}.
+    The skim, the calibration, the object selection, the matching of muons and SV to the AK8 jets and the preselection
+    are run once per chunk and variation by this processor, with the config in which it is used.
+    The reweighting, categories, weights, histograms and event counts of each analysis are then computed
+    by the processor of the analysis, on the same events, and saved in `output["analyses"][name]`,
+    with the same format as the output of the analysis run separately (see `scripts/split_multianalysis_output.py`).
+    '''
+    def __init__(self, cfg: Configurator):
+        super().__init__(cfg)
+        if not "analyses" in self.cfg.workflow_options.keys():
+            raise Exception("The entry of the config file 'workflow_options' does not contain a key 'analyses'. Please specify it in the config file.")
+        self.analysis_processors = {}
+        for name, path in self.cfg.workflow_options["analyses"].items():
+            analysis_cfg = load_config(path, save_config=False)
+            self.check_analysis(name, analysis_cfg)
+            self.analysis_processors[name] = analysis_cfg.processor_instance
+
+        # The objects and input columns used by any of the analyses are built and read by the shared stages
+        for processor in self.analysis_processors.values():
+            if self.restrict_to_input_columns:
+                self.input_columns_manifest |= get_input_columns(processor.cfg, self.input_columns)
+            self.used_collections |= get_config_collections(processor.cfg)
+        self.match_muons_to_subjets = self.cfg.workflow_options.get(
+            "match_muons_to_subjets", any(processor.match_muons_to_subjets for processor in self.analysis_processors.values())
+        )
+        self.cache_invariant_jet_columns = self.cfg.workflow_options.get("cache_invariant_jet_columns", False) and not self.uses_matched_collections()
+
+        self.output_format["analyses"] = {
+            name : {key : value for key, value in processor.output_format.items() if key != "correction_set_cache"}
+            for name, processor in self.analysis_processors.items()
+        }
+        # Analyses processing the current chunk, and the ones with their own WeightsManager
+        self.active_analyses = []
+        self.analyses_with_own_weights = set()
+        self.analysis_variations = {}
+
+    def check_analysis(self, name, analysis_cfg):
+        '''Check that the stages shared by the analyses are the same in the config of the analysis `name`
+        and in the combined config: the workflow, the skim, the preselections, the calibrators,
+        the object preselection and the jet calibration parameters. The samples, years, weights, weights variations
+        and shape variations of the analysis have to be included in the ones of the combined config.'''
+        if not isinstance(self, analysis_cfg.workflow):
+            raise Exception(f"The workflow of the analysis '{name}' ({analysis_cfg.workflow.__name__}) is not a base class of {type(self).__name__}.")
+        if [cut.id for cut in analysis_cfg.skim] != [cut.id for cut in self.cfg.skim]:
+            raise Exception(f"The skim of the analysis '{name}' is different from the skim of the combined config.")
+        if [cut.id for cut in analysis_cfg.preselections] != [cut.id for cut in self.cfg.preselections]:
+            raise Exception(f"The preselections of the analysis '{name}' are different from the preselections of the combined config.")
+        if [calibrator.name for calibrator in analysis_cfg.calibrators] != [calibrator.name for calibrator in self.cfg.calibrators]:
+            raise Exception(f"The calibrators of the analysis '{name}' are different from the calibrators of the combined config.")
+        for key in ["object_preselection", "jets_calibration"]:
+            if analysis_cfg.parameters[key] != self.params[key]:
+                raise Exception(f"The parameters '{key}' of the analysis '{name}' are different from the ones of the combined config.")
+        missing_datasets = set(analysis_cfg.filesets.keys()) - set(self.cfg.filesets.keys())
+        if missing_datasets:
+            raise Exception(f"The datasets {sorted(missing_datasets)} of the analysis '{name}' are not in the combined config.")
+        for sample in analysis_cfg.samples:
+            missing_variations = set(analysis_cfg.available_shape_variations[sample]) - set(self.cfg.available_shape_variations[sample])
+            if missing_variations:
+                raise Exception(f"The shape variations {sorted(missing_variations)} of the sample {sample} in the analysis '{name}' are not in the combined config.")
+            weights, weights_combined = analysis_cfg.weights_config[sample], self.cfg.weights_config[sample]
+            variations, variations_combined = analysis_cfg.variations_config[sample], self.cfg.variations_config[sample]
+            missing_subsamples = set(weights["by_subsample"]) - set(weights_combined["by_subsample"])
+            if missing_subsamples:
+                raise Exception(f"The subsamples {sorted(missing_subsamples)} of the sample {sample} in the analysis '{name}' are not in the combined config.")
+            configs = [(sample, weights, weights_combined, variations, variations_combined)]
+            for subsample in weights["by_subsample"]:
+                configs.append((
+                    subsample, weights["by_subsample"][subsample], weights_combined["by_subsample"][subsample],
+                    variations["by_subsample"][subsample], variations_combined["by_subsample"][subsample],
+                ))
+            for label, w, w_combined, v, v_combined in configs:
+                missing_weights = get_weights(w) - get_weights(w_combined)
+                if missing_weights:
+                    raise Exception(f"The weights {sorted(missing_weights)} of the sample {label} in the analysis '{name}' are not in the combined config.")
+                missing_variations = get_weights_variations(v) - get_weights_variations(v_combined)
+                if missing_variations:
+                    raise Exception(f"The weights variations {sorted(missing_variations)} of the sample {label} in the analysis '{name}' are not in the combined config.")
+
+    def pass_events(self, processor):
+        '''Pass the events of the current stage of the chunk to the processor of an analysis, together with
+        the objects built once per chunk by the shared stages: the calibrators and the cache of the reweighting bins.'''
+        processor.events = self.events
+        processor.calibrators_manager = self.calibrators_manager
+        processor.reweighting_bin_cache = self.reweighting_bin_cache
+
+    def load_metadata_extra(self):
+        super().load_metadata_extra()
+        # Only the analyses including the dataset of the chunk are processed
+        self.active_analyses = [name for name, processor in self.analysis_processors.items() if self._dataset in processor.cfg.filesets]
+        for name in self.active_analyses:
+            # The metadata of the chunk (dataset, sample, year, subsamples...) are loaded by the processor of the analysis
+            # from the events, with its config, as in `BaseProcessorABC.process`
+            processor = self.analysis_processors[name]
+            processor.events = self.events
+            processor.load_metadata()
+            processor.load_metadata_extra()
+            processor.output = self.output["analyses"][name]
+
+    def define_weights(self):
+        super().define_weights()
+        # The WeightsManager of the combined config is shared by the analyses with the same weights for the sample
+        self.analyses_with_own_weights = set()
+        for name in self.active_analyses:
+            processor = self.analysis_processors[name]
+            self.pass_events(processor)
+            if same_weights(processor.cfg.weights_config[self._sample], self.cfg.weights_config[self._sample],
+                            processor.cfg.variations_config[self._sample], self.cfg.variations_config[self._sample]):
+                processor.weights_manager = self.weights_manager
+            else:
+                processor.define_weights()
+                self.analyses_with_own_weights.add(name)
+
+    def define_histograms(self):
+        super().define_histograms()
+        for name in self.active_analyses:
+            processor = self.analysis_processors[name]
+            self.pass_events(processor)
+            processor.define_custom_axes_extra()
+            processor.define_histograms()
+            processor.define_histograms_extra()
+            # Shape variations of the chunk requested by the analysis
+            self.analysis_variations[name] = {"nominal"}.union(*(
+                self.calibrators_manager.get_available_variations(calibrator)
+                for calibrator in processor.cfg.available_shape_variations[self._sample]
+            ))
+
+    def process_extra_after_presel(self, variation):
+        # The reweighting depends on the analysis: it is computed by the processors of the analyses
+        pass
+
+    def compute_weights(self, variation):
+        super().compute_weights(variation)
+        for name in self.active_analyses:
+            if name in self.analyses_with_own_weights and variation in self.analysis_variations[name]:
+                processor = self.analysis_processors[name]
+                self.pass_events(processor)
+                processor.nEvents_after_presel = self.nEvents_after_presel
+                processor.compute_weights(variation)
+                processor.compute_weights_extra(variation)
+
+    def fill_histograms(self, variation):
+        '''The histograms of the analyses are filled by their processors, on the events selected by the shared stages.
+        For each analysis, the reweighting, the categories, the histograms and the event counts are computed
+        as in `BaseProcessorABC.process`, for the shape variations requested by the analysis.'''
+        for name in self.active_analyses:
+            if variation not in self.analysis_variations[name]:
+                continue
+            processor = self.analysis_processors[name]
+            self.pass_events(processor)
+            processor.process_extra_after_presel(variation)
+            processor.define_categories(variation)
+            processor.fill_histograms(variation)
+            processor.fill_histograms_extra(variation)
+            processor.count_events(variation)
+
+    def postprocess(self, accumulator):
+        super().postprocess(accumulator)
+        # The number of events and the sum of the genweights before the preselection are shared by the analyses
+        for name, processor in self.analysis_processors.items():
+            output = accumulator["analyses"][name]
+            datasets = [dataset for dataset in accumulator["cutflow"]["initial"] if dataset in processor.cfg.filesets]
+            for key in ["sum_genweights", "sum_signOf_genweights"]:
+                output[key] = {dataset : accumulator[key][dataset] for dataset in datasets if dataset in accumulator[key]}
+            for key in ["initial", "skim", "presel"]:
+                output["cutflow"][key] = {dataset : accumulator["cutflow"][key][dataset] for dataset in datasets if dataset in accumulator["cutflow"][key]}
+            processor.postprocess(output)
+        return accumulator
@@ -1,10 +1,15 @@
 from mutag_calib.workflows.mutag_processor import mutagAnalysisProcessor
+from pocket_coffea.utils.configurator import Configurator
 from pocket_coffea.lib.categorization import StandardSelection
 from mutag_calib.lib.sv import *
 from mutag_calib.configs.fatjet_base.custom.cuts import mutag_fatjet_sel
 
 
 class mutagAnalysisOneMuonInAK8Processor(mutagAnalysisProcessor):
+    def __init__(self, cfg: Configurator):
+        super().__init__(cfg)
+        # Only events with enough muons for a muon-tagged AK8 jet can pass the preselection
+        self.min_muons_in_event = self.params.object_preselection["FatJet"]["nmu"]
 
     def apply_object_preselection(self, variation):
         super().apply_object_preselection(variation)
@@ -24,7 +29,7 @@ class mutagAnalysisOneMuonInAK8Processor(mutagAnalysisProcessor):
         mask_mutag = selection_mutag.get_mask(mask_name)
 
         # Apply muon tagging asking for at least one muon inside the AK8 jet
-        self.events["FatJetGood"] = self.events.FatJetGood[mask_mutag]
+        self.select_fatjets(mask_mutag)
 
     def fill_column_accumulators(self, variation):
         pass
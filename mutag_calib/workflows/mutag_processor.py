@@ -1,10 +1,12 @@
 from collections import defaultdict
 import awkward as ak
-import correctionlib
 
 from mutag_calib.workflows.fatjet_base import fatjetBaseProcessor
 from pocket_coffea.utils.configurator import Configurator
 from mutag_calib.lib.sv import *
+from mutag_calib.lib.fields import with_fields
+from mutag_calib.lib.reweighting import get_reweighting, position_views, BinCache
+from mutag_calib.lib.hist_manager import ReweightingHistManager, VariedWeight
 
 class mutagAnalysisProcessor(fatjetBaseProcessor):
     def __init__(self, cfg: Configurator):
@@ -14,42 +16,94 @@ class mutagAnalysisProcessor(fatjetBaseProcessor):
         self.histograms_to_reweigh = self.cfg.workflow_options["histograms_to_reweigh"]
         self.weight_3d = defaultdict(dict)
         self.custom_histogram_weights = {}
+        # Statistical variations of the reweighting, filled in the variation axis of the reweighted histograms
+        # in the nominal pass by the `ReweightingHistManager`. The filling is disabled with `False`.
+        self.reweighting_variations = ["sf_ptetatau21_reweightingUp", "sf_ptetatau21_reweightingDown"]
+        self.fill_reweighting_variations_histograms = self.cfg.workflow_options.get("fill_reweighting_variations", True)
+        # Samples reweighted with the (pT, eta, tau21) reweighting
+        self.reweighted_samples = ["QCD_MuEnriched", "QCD_Madgraph"]
+        # Inputs of the reweighting maps that are not changed by the shape variations: the bins of the AK8 jets
+        # along these axes are computed once per chunk and cached across the variations (see `BinCache`).
+        # The cache is disabled with an empty list.
+        self.reweighting_cached_inputs = self.cfg.workflow_options.get("reweighting_cached_inputs", ["FatJetGood_eta", "FatJetGood_tau21"])
+        self.reweighting_bin_cache = None
+
+    def requires_fatjet_chunk_index(self):
+        return super().requires_fatjet_chunk_index() or (self._sample in self.reweighted_samples and bool(self.reweighting_cached_inputs))
+
+    def process_extra_after_skim(self):
+        super().process_extra_after_skim()
+        if self._sample in self.reweighted_samples and self.reweighting_cached_inputs:
+            # The AK8 jets are identified across the shape variations by the `chunk_index` field
+            self.reweighting_bin_cache = BinCache(ak.sum(ak.num(self.events.FatJet)), self.reweighting_cached_inputs)
+        else:
+            self.reweighting_bin_cache = None
+
+    def define_histograms(self):
+        '''The statistical variations of the reweighting are added to the variation axis of the reweighted histograms
+        of the reweighted samples, and filled in the nominal pass by the `ReweightingHistManager`.'''
+        if self._sample in self.reweighted_samples and self.fill_reweighting_variations_histograms:
+            weight_variations = self.reweighting_variations
+        else:
+            weight_variations = []
+        self.hists_manager = ReweightingHistManager(
+            self.cfg.variables,
+            self._year,
+            self._sample,
+            self._hasSubsamples,
+            self._subsamples[self._sample].keys(),
+            self._categories,
+            variations_config=self.cfg.variations_config[self._sample] if self._isMC else None,
+            processor_params=self.params,
+            weights_manager=self.weights_manager,
+            calibrators_manager=self.calibrators_manager,
+            custom_axes=self.custom_axes,
+            isMC=self._isMC,
+            weight_variations=weight_variations,
+            weighted_histograms=[histname for hists in self.histograms_to_reweigh["by_pos"].values() for histname in hists],
+        )
 
     def apply_object_preselection(self, variation):
         super().apply_object_preselection(variation)
 
         # Restrict analysis to leading and subleading jets only
-        self.events["FatJetGood"] = self.events.FatJetGood[ak.local_index(self.events.FatJetGood, axis=1) < 2]
+        self.select_fatjets(ak.local_index(self.events.FatJetGood, axis=1) < 2)
 
         # Label leading and subleading AK8 jets BEFORE muon tagging selection
         # Leading: pos=0, Subleading: pos=1
-        self.events["FatJetGood"] = ak.with_field(self.events["FatJetGood"], ak.local_index(self.events["FatJetGood"], axis=1), "pos")
+        self.events["FatJetGood"] = with_fields(self.events["FatJetGood"], {"pos" : ak.local_index(self.events["FatJetGood"], axis=1)})
 
     def ptetatau21_reweighting(self, variation):
         '''Correction of jets observable by a 3D reweighting based on (pT, eta, tau21).
         The function stores the nominal, up and down weights in self.weight_3d,
         where the up/down variations are computed considering the statistical uncertainty on data and MC.'''
-        cset = correctionlib.CorrectionSet.from_file(self.params["ptetatau21_reweighting"][self._year]["file"])
-        assert len(list(cset.keys())) == 1, "The correction file should contain only one correction."
-        key = list(cset.keys())[0]
-        corr = cset[key]
+        # All the statistical variations are evaluated at once for the category and shape variation
+        reweighting = get_reweighting(
+            self.params["ptetatau21_reweighting"][self._year]["file"],
+            {"cat" : self.params["ptetatau21_reweighting"][self._year]["category"], "shape_variation" : variation},
+        )
+        nfatjet  = ak.to_numpy(ak.num(self.events.FatJetGood.pt))
+        pos = ak.to_numpy(ak.flatten(self.events.FatJetGood.pos))
+        pt = ak.to_numpy(ak.flatten(self.events.FatJetGood.pt))
+        eta = ak.to_numpy(ak.flatten(self.events.FatJetGood.eta))
+        tau21 = ak.to_numpy(ak.flatten(self.events.FatJetGood.tau21))
 
-        cat = self.params["ptetatau21_reweighting"][self._year]["category"]
-        nfatjet  = ak.num(self.events.FatJetGood.pt)
-        pos = ak.flatten(self.events.FatJetGood.pos)
-        pt = ak.flatten(self.events.FatJetGood.pt)
-        eta = ak.flatten(self.events.FatJetGood.eta)
-        tau21 = ak.flatten(self.events.FatJetGood.tau21)
+        # The bins of eta and tau21 are taken from the cache of the chunk, and only the pT bins are located again
+        if self.reweighting_bin_cache is not None:
+            jet_index = ak.to_numpy(ak.flatten(self.events.FatJetGood.chunk_index))
+            weights = reweighting.evaluate(pos, pt, eta, tau21, bin_cache=self.reweighting_bin_cache, jet_index=jet_index)
+        else:
+            weights = reweighting.evaluate(pos, pt, eta, tau21)
+        # Here we build the flattened custom weights for the leading and subleading jet collections.
+        # In order for the length of the weights array to match the number of the per-event mask,
+        # the weight is 1 for the events that does not contain a jet with pos=0(1)
+        weights_by_pos = position_views(weights, nfatjet, pos, npositions=2)
 
         weight_dict = {"all" : {}, "1" : {}, "2" : {}}
-        for var in ["nominal", "statUp", "statDown"]:
-            w = corr.evaluate(cat, variation, var, pos, pt, eta, tau21)
-            weight_dict["all"][var] = ak.unflatten(w, nfatjet)
-            # Here we build the flattened custom weights for the leading and subleading jet collections.
-            # In order for the length of the weights array to match the number of the per-event mask,
-            # we set the weight to be 1 for the events that does not contain a jet with pos=0(1)
-            weight_dict["1"][var] = ak.fill_none(ak.firsts(weight_dict["all"]["nominal"][self.events.FatJetGood.pos == 0]), 1)
-            weight_dict["2"][var] = ak.fill_none(ak.firsts(weight_dict["all"]["nominal"][self.events.FatJetGood.pos == 1]), 1)
+        for i, var in enumerate(reweighting.variations):
+            weight_dict["all"][var] = ak.unflatten(weights[i], nfatjet)
+            weight_dict["1"][var] = ak.Array(weights_by_pos[i, 0])
+            weight_dict["2"][var] = ak.Array(weights_by_pos[i, 1])
 
         # Here we store the dictionary for the custom weights, with the following content:
         # - pos = "all": the jagged array of weights of the full jet collection
@@ -64,11 +118,12 @@ class mutagAnalysisProcessor(fatjetBaseProcessor):
             }
 
     def process_extra_after_presel(self, variation):
-        if self._sample in ["QCD_MuEnriched", "QCD_Madgraph"]:
+        if self._sample in self.reweighted_samples:
             self.ptetatau21_reweighting(variation)
             for pos, hists in self.histograms_to_reweigh["by_pos"].items():
+                weight = VariedWeight(f"ptetatau21_reweighting_{pos}", self.weight_3d[pos])
                 for histname in hists:
-                    self.custom_histogram_weights[histname] = self.weight_3d[pos]["nominal"]
+                    self.custom_histogram_weights[histname] = weight
 
     # We redefine the fill_histograms method in order to use the custom histogram weights
     def fill_histograms(self, variation):
@@ -5,11 +5,20 @@ from pocket_coffea.lib.categorization import StandardSelection
 from mutag_calib.lib.sv import *
 from mutag_calib.configs.fatjet_base.custom.cuts import get_ptmsd, mutag_fatjet_sel, mutag_subjet_sel
 from mutag_calib.workflows.fatjet_base import fatjetBaseProcessor
+from mutag_calib.lib.fields import with_fields
 
 
 class ptReweightProcessor(fatjetBaseProcessor):
+    # Collections of AK8 jets with muon-tagged subjets, built only if used in the config
+    subjet_tagged_collections = {
+        "FatJetGoodNMuonSJ1" : False,
+        "FatJetGoodNMuonSJUnique1" : True,
+    }
+
     def __init__(self, cfg: Configurator):
         super().__init__(cfg)
+        # Only events with enough muons for a muon-tagged AK8 jet can pass the preselection
+        self.min_muons_in_event = self.params.object_preselection["FatJet"]["nmu"]
         self.pt_eta_2d_maps = [
             'FatJetGood_pt_eta',
             #'FatJetGoodNMuon1_pt_eta',
@@ -28,29 +37,48 @@ class ptReweightProcessor(fatjetBaseProcessor):
             if not histname in self.cfg.variables.keys():
                 raise Exception(f"'{histname}' is not present in the histogram keys.")
 
+    def requires_subjet_matching(self):
+        return super().requires_subjet_matching() or any(coll in self.used_collections for coll in self.subjet_tagged_collections)
+
     def apply_object_preselection(self, variation):
         super().apply_object_preselection(variation)
 
         # Restrict analysis to leading and subleading jets only
-        self.events["FatJetGood"] = self.events.FatJetGood[ak.local_index(self.events.FatJetGood, axis=1) < 2]
+        self.select_fatjets(ak.local_index(self.events.FatJetGood, axis=1) < 2)
 
         # Label leading and subleading AK8 jets BEFORE muon tagging selection
         # Leading: pos=0, Subleading: pos=1
-        self.events["FatJetGood"] = ak.with_field(self.events["FatJetGood"], ak.local_index(self.events["FatJetGood"], axis=1), "pos")
+        # Define a new field called btag, that depends on what we will cut on later on.
+        if "2024" in self._year:
+            tagger = "globalParT3_Xbb"
+        else:
+            tagger = "particleNet_XbbVsQCD"
+        self.events["FatJetGood"] = with_fields(
+            self.events["FatJetGood"],
+            {
+                "pos" : ak.local_index(self.events["FatJetGood"], axis=1),
+                "btag" : self.events["FatJetGood"][tagger],
+            }
+        )
 
-        # Build 4 distinct AK8 jet collections with 4 different muon tagging scenarios
+        # Build distinct AK8 jet collections with different muon tagging scenarios.
+        # The collections with muon-tagged subjets are built only if used in the config
+        subjet_tagged_collections = [coll for coll in self.subjet_tagged_collections if coll in self.used_collections]
         cuts_mutag = {
             "FatJetGoodNMuon1" : [mutag_fatjet_sel(nmu=self.params.object_preselection["FatJet"]["nmu"])],
             #"FatJetGoodNMuon2" : [mutag_fatjet_sel(nmu=2)],
-            #"FatJetGoodNMuonSJ1" : [mutag_subjet_sel(unique_matching=False)],
-            #"FatJetGoodNMuonSJUnique1" : [mutag_subjet_sel(unique_matching=True)],
         }
+        for coll in subjet_tagged_collections:
+            cuts_mutag[coll] = [mutag_subjet_sel(unique_matching=self.subjet_tagged_collections[coll])]
         selection_mutag = StandardSelection(cuts_mutag)
         selection_mutag.prepare(
             events=self.events,
             processor_params=self.params
         )
-        self.events["FatJetGood"] = self.events.FatJetGood[selection_mutag.get_mask("FatJetGoodNMuon1")]
+        # Apply subjet muon tagging to AK8 jet collections, before the AK8 muon tagging is applied to FatJetGood
+        for coll in subjet_tagged_collections:
+            self.events[coll] = self.events.FatJetGood[selection_mutag.get_mask(coll)]
+        self.select_fatjets(selection_mutag.get_mask("FatJetGoodNMuon1"))
         #self._ak8jet_collections = list(cuts_mutag.keys())
         #for coll in self._ak8jet_collections:
         #    mask_mutag = selection_mutag.get_mask(coll)
@@ -58,13 +86,6 @@ class ptReweightProcessor(fatjetBaseProcessor):
         #    # Apply muon tagging to AK8 jet collection
         #    self.events[coll] = self.events.FatJetGood[mask_mutag]
 
-        # Define a new field called btag, that depends on what we will cut on later on.
-        if "2024" in self._year:
-            tagger = "globalParT3_Xbb"
-        else:
-            tagger = "particleNet_XbbVsQCD"
-        self.events["FatJetGood"] = ak.with_field(self.events["FatJetGood"], self.events["FatJetGood"][tagger], "btag")
-
 
 class ptReweightProcessorSkimonly(fatjetBaseProcessor):
     def __init__(self, cfg: Configurator):